@@ -1,13 +1,44 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.schema import CreateIndex
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./allergy_menu.db")
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
 
-connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
-engine = create_engine(DATABASE_URL, echo=False, future=True, connect_args=connect_args)
+# pool (per process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "30"))
+DB_POOL_RECYCLE_S = int(os.getenv("DB_POOL_RECYCLE_S", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# SQLite: WAL lets readers run while an ingest writes; writers wait busy_timeout instead of failing
+SQLITE_PRAGMAS = os.getenv("SQLITE_PRAGMAS", "true").lower() == "true"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 << 20)))
+# asyncio engine for the read-heavy routers (needs aiosqlite on SQLite; psycopg 3 covers Postgres)
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+
+def _engine_kwargs(url: str) -> dict:
+    kw = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE_S}
+    # in-memory SQLite uses a singleton pool and aiosqlite a NullPool: no sizing there
+    if ":memory:" not in url and url.rstrip("/") != "sqlite:" and not url.startswith("sqlite+aiosqlite"):
+        kw.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT_S)
+    return kw
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+    cur.close()
+
+connect_args = {"check_same_thread": False} if IS_SQLITE else {}
+engine = create_engine(DATABASE_URL, echo=False, future=True, connect_args=connect_args, **_engine_kwargs(DATABASE_URL))
+if IS_SQLITE and SQLITE_PRAGMAS: event.listen(engine, "connect", _sqlite_pragmas)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 Base = declarative_base()
 
@@ -17,3 +48,62 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def async_url(url: str) -> str:
+    if url.startswith("sqlite:"): return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for sync in ("postgresql+psycopg2:", "postgresql+psycopg:", "postgresql:"):
+        if url.startswith(sync): return "postgresql+psycopg:" + url[len(sync):]
+    return url
+
+async_engine = AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    async_engine = create_async_engine(async_url(DATABASE_URL), **_engine_kwargs(async_url(DATABASE_URL)))
+    if IS_SQLITE and SQLITE_PRAGMAS: event.listen(async_engine.sync_engine, "connect", _sqlite_pragmas)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_async_db():
+    """
+    For `async def` read routes: yields run(fn, *args), which awaits fn(session, *args) where fn is
+    ordinary sync Session code. With DB_ASYNC the session rides the asyncio engine (AsyncSession.run_sync,
+    no worker thread); otherwise fn runs on a regular session in the threadpool.
+    """
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as s:
+            yield lambda fn, *args: s.run_sync(fn, *args)
+    else:
+        from starlette.concurrency import run_in_threadpool
+        db = SessionLocal()
+        try:
+            yield lambda fn, *args: run_in_threadpool(fn, db, *args)
+        finally:
+            await run_in_threadpool(db.close)
+
+def _default_sql(col) -> str:
+    d = col.default
+    if d is None or not d.is_scalar: return ""
+    v = d.arg
+    if isinstance(v, str): return " DEFAULT '" + v.replace("'", "''") + "'"
+    if isinstance(v, bool): return f" DEFAULT {int(v)}"
+    if isinstance(v, (int, float)): return f" DEFAULT {v}"
+    return ""
+
+def ensure_schema(bind=engine):
+    """
+    create_all() never alters existing tables: add model columns and indexes missing from the
+    live schema. New columns must be nullable or carry a scalar default.
+    """
+    insp = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name): continue
+            have = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in have: continue
+                ddl = col.type.compile(dialect=bind.dialect)
+                default = _default_sql(col)
+                null = "" if col.nullable or not default else " NOT NULL"
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {ddl}{default}{null}"))
+            for idx in table.indexes:
+                # IF NOT EXISTS: reflection skips expression indexes, so checkfirst can't see them
+                conn.execute(CreateIndex(idx, if_not_exists=True))
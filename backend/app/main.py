@@ -1,24 +1,51 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from .db import Base, engine
+from .db import engine, async_engine
+from .migrate import DB_MIGRATE_ON_STARTUP, migrate
 from .routers import auth as auth_router
 from .routers import allergens as allergens_router
 from .routers import menus as menus_router
 from .routers import ingest as ingest_router
+from .routers import tagger as tagger_router
+from .routers import metrics as metrics_router
+from .services.ingest.pdf import shutdown_pool
+from .services.ingest import jobs as ingest_jobs
+from .services import retag
+from .services.metrics import MetricsMiddleware
+from .services import db_profile
 
-Base.metadata.create_all(bind=engine)
-app = FastAPI(title="Allergy Menu Finder API")
+if db_profile.ENABLED: db_profile.install(engine, async_engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # schema DDL is a startup step (a single SELECT once applied), not an import side effect
+    if DB_MIGRATE_ON_STARTUP: migrate()
+    ingest_jobs.recover_jobs()
+    yield
+    ingest_jobs.shutdown()
+    retag.shutdown()
+    shutdown_pool()
+    if async_engine is not None: await async_engine.dispose()
+
+app = FastAPI(title="Allergy Menu Finder API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
+    expose_headers=[menus_router.NEXT_CURSOR_HEADER, db_profile.QUERIES_HEADER, db_profile.TIME_HEADER],
 )
+app.add_middleware(MetricsMiddleware)
+if db_profile.ENABLED: app.add_middleware(db_profile.DBProfileMiddleware)
 
 app.include_router(auth_router.router)
 app.include_router(allergens_router.router)
 app.include_router(menus_router.router)
 app.include_router(ingest_router.router)
+app.include_router(tagger_router.router)
+app.include_router(metrics_router.router)
 
 @app.get("/api/health")
 def health():
@@ -0,0 +1,96 @@
+"""
+Maintenance commands.
+
+    cd backend && python -m app.manage <command> [options]
+"""
+import argparse, sys
+from .db import SessionLocal, engine
+from .migrate import migrate
+from .services import allergen_mask, search
+
+def cmd_migrate(args) -> int:
+    ran = migrate(force=args.force)
+    print("migrate: schema " + ("updated" if ran else "already current"))
+    return 0
+
+def cmd_allergen_mask(args) -> int:
+    migrate()
+    with SessionLocal() as db:
+        if not args.verify_only:
+            fixed = allergen_mask.backfill(db)
+            db.commit()
+            print(f"allergen_mask: updated {fixed} menu items")
+        bad = allergen_mask.verify(db)
+    for mid, stored, expected in bad:
+        print(f"  menu item {mid}: stored={stored} expected={expected}")
+    print("allergen_mask: " + ("out of sync" if bad else "in sync"))
+    return 1 if bad else 0
+
+def cmd_rebuild_search(args) -> int:
+    migrate()
+    if not search.supported(engine.dialect.name):
+        print(f"search: no full-text index for {engine.dialect.name}; q falls back to ILIKE")
+        return 0
+    search.rebuild(engine)
+    print(f"search: rebuilt {engine.dialect.name} index")
+    return 0
+
+def cmd_retag(args) -> int:
+    from .services import retag
+    migrate()
+    def progress(run):
+        print(f"  {run.phase:<11} scanned={run.rows_scanned} changed={run.rows_changed} last_id={run.last_id}")
+    with SessionLocal() as db:
+        try:
+            run = retag.retag(db, batch=args.batch, max_batches=args.max_batches, force=args.force, on_batch=progress)
+        except retag.RetagBusy as e:
+            print(f"retag: {e} (use --force to take it over)")
+            return 1
+    print(f"retag: run {run.id} -> {run.model_version} {run.status}" + (f": {run.error}" if run.error else ""))
+    return 0 if run.status in ("done", "paused") else 1
+
+def cmd_compact_predictions(args) -> int:
+    from .services import retention
+    migrate()
+    with SessionLocal() as db:
+        r = retention.compact(db, days=args.days, dry_run=args.dry_run, do_vacuum=args.vacuum)
+    verb = "would drop" if r["dry_run"] else "dropped"
+    print(f"compact: {verb} {r['predictions']} parsed-row predictions of {r['files']} files idle since before {r['cutoff']:%Y-%m-%d %H:%M}")
+    for name in sorted(set(r["before"]) | set(r["after"])):
+        print(f"  {name:<45} {r['before'].get(name, 0):>12} -> {r['after'].get(name, 0):>12} bytes")
+    if not r["dry_run"]:
+        print(f"compact: reclaimed {r['reclaimed_bytes']} bytes" + ("" if args.vacuum else " (run with --vacuum to shrink the file)"))
+    return 0
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help="create/upgrade tables, columns, indexes and the search index (once per schema)")
+    p.add_argument("--force", action="store_true", help="run the DDL even if this schema is recorded as applied")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("allergen-mask", help="backfill menu_items.allergen_mask from menu_allergens and verify it")
+    p.add_argument("--verify-only", action="store_true", help="only report items whose mask is out of sync")
+    p.set_defaults(func=cmd_allergen_mask)
+
+    p = sub.add_parser("rebuild-search", help="rebuild the full-text index behind GET /api/menus?q=")
+    p.set_defaults(func=cmd_rebuild_search)
+
+    p = sub.add_parser("retag", help="re-tag parsed rows and menu items stored under an older tagger version")
+    p.add_argument("--batch", type=int, default=None, help="rows per batch/transaction (RETAG_BATCH)")
+    p.add_argument("--max-batches", type=int, default=None, help="pause after this many batches; rerun to resume")
+    p.add_argument("--force", action="store_true", help="take over a run another process still marks as running")
+    p.set_defaults(func=cmd_retag)
+
+    p = sub.add_parser("compact-predictions", help="drop parsed-row predictions of files idle past the retention age")
+    p.add_argument("--days", type=float, default=None, help="retention age in days (PREDICTION_RETENTION_DAYS)")
+    p.add_argument("--dry-run", action="store_true", help="only count what would be dropped")
+    p.add_argument("--vacuum", action="store_true", help="VACUUM afterwards so the freed pages are returned")
+    p.set_defaults(func=cmd_compact_predictions)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+One-time schema setup, kept out of import so workers start fast.
+
+    cd backend && python -m app.manage migrate [--force]
+
+create_all + ensure_schema (missing columns/indexes) + the full-text index + the data migrations
+below, then the fingerprint of the models is recorded in schema_migrations. Later runs - each worker start, with
+DB_MIGRATE_ON_STARTUP - find the fingerprint and skip all DDL and reflection after one SELECT.
+Run the command once per deploy and set DB_MIGRATE_ON_STARTUP=false to take even that off startup.
+"""
+import hashlib, os
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from .db import Base, engine, ensure_schema
+from . import models  # noqa: F401  (registers tables on Base.metadata)
+from .services import allergen_mask, search
+
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "true").lower() == "true"
+
+def fingerprint() -> str:
+    """Changes whenever a table, column type, index or search DDL in the code changes."""
+    parts = [f"{t.name}:{','.join(f'{c.name} {c.type!r}' for c in t.columns)}:{','.join(sorted(i.name for i in t.indexes))}"
+             for t in Base.metadata.sorted_tables]
+    parts += search._SQLITE_DDL + search._PG_DDL
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+def is_current(bind=engine) -> bool:
+    try:
+        with bind.connect() as conn:
+            return conn.execute(text("SELECT 1 FROM schema_migrations WHERE fingerprint = :f"),
+                                {"f": fingerprint()}).first() is not None
+    except DBAPIError:  # no schema_migrations table yet
+        return False
+
+def _fold_prediction_versions(bind):
+    # allergen_predictions used to repeat rules_version/model_version strings on every row: move them
+    # into tagger_versions, keep the small id, and drop the owner indexes the unique constraints cover
+    if "model_version" not in {c["name"] for c in inspect(bind).get_columns("allergen_predictions")}: return
+    with bind.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO tagger_versions (rules_version, model_version)
+            SELECT DISTINCT rules_version, model_version FROM allergen_predictions WHERE true
+            ON CONFLICT (rules_version, model_version) DO NOTHING
+        """))
+        conn.execute(text("""
+            UPDATE allergen_predictions SET version_id = (
+                SELECT tv.id FROM tagger_versions tv
+                WHERE tv.rules_version = allergen_predictions.rules_version
+                  AND tv.model_version = allergen_predictions.model_version)
+        """))
+        for col in ("rules_version", "model_version"):
+            conn.execute(text(f"ALTER TABLE allergen_predictions DROP COLUMN {col}"))
+        for idx in ("ix_allergen_predictions_parsed_row_id", "ix_allergen_predictions_menu_item_id"):
+            conn.execute(text(f"DROP INDEX IF EXISTS {idx}"))
+        if bind.dialect.name == "postgresql":
+            conn.execute(text("ALTER TABLE allergen_predictions ALTER COLUMN version_id SET NOT NULL, "
+                              "ADD FOREIGN KEY (version_id) REFERENCES tagger_versions (id)"))
+
+def _widen_prediction_version_id(bind):
+    # version_id was created as SMALLINT against tagger_versions' INTEGER key (SQLite doesn't care)
+    if bind.dialect.name != "postgresql": return
+    col = next(c for c in inspect(bind).get_columns("allergen_predictions") if c["name"] == "version_id")
+    if col["type"].__visit_name__.lower() == "integer": return
+    with bind.begin() as conn:
+        conn.execute(text("ALTER TABLE allergen_predictions ALTER COLUMN version_id TYPE INTEGER"))
+
+def _backfill_allergen_masks(bind):
+    # ensure_schema adds menu_items.allergen_mask as 0 on existing rows: derive it from menu_allergens,
+    # or the mask-based filters show every item from before the upgrade as free of every allergen
+    with Session(bind) as db:
+        allergen_mask.backfill(db)
+        db.commit()
+
+DATA_MIGRATIONS = [_fold_prediction_versions, _widen_prediction_version_id, _backfill_allergen_masks]
+
+def migrate(bind=engine, force: bool = False) -> bool:
+    """Bring the database up to the models. True if DDL ran, False if it was already current."""
+    if not force and is_current(bind): return False
+    Base.metadata.create_all(bind=bind)
+    ensure_schema(bind)
+    search.ensure_search(bind)
+    for step in DATA_MIGRATIONS: step(bind)
+    with bind.begin() as conn:
+        conn.execute(text("INSERT INTO schema_migrations (fingerprint) VALUES (:f) ON CONFLICT (fingerprint) DO NOTHING"),
+                     {"f": fingerprint()})
+    return True
@@ -8,17 +8,22 @@ from sqlalchemy import (
     Table,
     Column,
     Integer,
+    BigInteger,
     String,
     Text,
     DateTime,
     Numeric,
     ForeignKey,
     UniqueConstraint,
+    Index,
     func,
+    event,
+    inspect,
 )
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, Session, mapped_column, relationship
 
 from .db import Base
+from .services.allergen_mask import mask_of
 
 # ---------- Association tables ----------
 
@@ -77,6 +82,11 @@ class MenuItem(Base):
     item_name: Mapped[str] = mapped_column(String, nullable=False)
     description: Mapped[str] = mapped_column(Text, default="")
     price: Mapped[Decimal] = mapped_column(Numeric(10, 2), default=Decimal("0.00"))
+    content_hash: Mapped[str] = mapped_column(String(40), default="")  # see services.ingest.persist.content_hash
+    # bit (allergen_id - 1) set per row in menu_allergens; see services.allergen_mask
+    allergen_mask: Mapped[int] = mapped_column(BigInteger, default=0, server_default="0", nullable=False)
+    tagger_version: Mapped[str] = mapped_column(String, default="", server_default="", index=True)  # model_version of its predictions
+    external_id: Mapped[str | None] = mapped_column(String, nullable=True)  # caller's id (POS sync), see POST /api/menus/batch
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
 
     restaurant: Mapped["User"] = relationship("User", back_populates="menu_items")
@@ -84,6 +94,32 @@ class MenuItem(Base):
         "Allergen", secondary=menu_allergens, back_populates="menu_items"
     )
 
+    __table_args__ = (
+        # ingest_commit matches uploaded rows to existing items by case-folded name
+        Index("ix_menu_items_restaurant_name", "restaurant_id", func.lower(item_name)),
+        Index("uq_menu_items_restaurant_external", "restaurant_id", "external_id", unique=True),
+    )
+
+@event.listens_for(Session, "before_flush")
+def _sync_allergen_mask(session, flush_context, instances):
+    # keep MenuItem.allergen_mask in step with ORM edits of menu_allergens (either side of the relationship)
+    touched = set()
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, MenuItem) and inspect(obj).attrs.allergens.history.has_changes():
+            touched.add(obj)
+        elif isinstance(obj, Allergen):
+            h = inspect(obj).attrs.menu_items.history
+            touched.update(h.added or ()); touched.update(h.deleted or ())
+    for mi in touched:
+        mi.allergen_mask = mask_of(a.id for a in mi.allergens)
+
+class MenuVersion(Base):
+    """Per-restaurant menu version (restaurant_id 0 = all restaurants); see services.menu_cache."""
+    __tablename__ = "menu_versions"
+
+    restaurant_id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
 # ---------- Ingestion (files & parsed rows) ----------
 
 class FileUpload(Base):
@@ -95,6 +131,15 @@ class FileUpload(Base):
     filetype: Mapped[str] = mapped_column(String, nullable=False)  # 'csv' | 'pdf'
     sha256: Mapped[str] = mapped_column(String, index=True, nullable=False)
     pages: Mapped[int] = mapped_column(Integer, default=0)
+    # tagger version of the last complete ingest; identical re-uploads under it skip parse + tag
+    rules_version: Mapped[str] = mapped_column(String, default="")
+    model_version: Mapped[str] = mapped_column(String, default="")
+    issues: Mapped[str] = mapped_column(Text, default="[]")  # JSON list from that ingest
+    committed_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)  # last publish to menu_items
+    # last tag, cached preview or commit; services.retention ages files on it
+    used_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    # set when services.retention dropped its row predictions; the file must be uploaded again to commit
+    compacted_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
 
 class ParsedRow(Base):
@@ -107,32 +152,105 @@ class ParsedRow(Base):
     description: Mapped[str] = mapped_column(Text, default="")
     price: Mapped[Decimal] = mapped_column(Numeric(10, 2), default=Decimal("0.00"))
     parsing_meta: Mapped[str] = mapped_column(Text, default="")  # optional JSON-as-text
+    content_hash: Mapped[str] = mapped_column(String(40), default="")
+    tagger_version: Mapped[str] = mapped_column(String, default="", server_default="", index=True)  # model_version of its predictions
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
 
     __table_args__ = (
         UniqueConstraint("file_id", "row_index", name="uq_file_row"),
     )
 
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    restaurant_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    file_id: Mapped[int | None] = mapped_column(ForeignKey("files.id", ondelete="SET NULL"), nullable=True)
+    filename: Mapped[str] = mapped_column(String, nullable=False)
+    filetype: Mapped[str] = mapped_column(String, nullable=False)  # 'csv' | 'pdf'
+    sha256: Mapped[str] = mapped_column(String, nullable=False)
+    spool_path: Mapped[str] = mapped_column(String, default="")  # upload kept on disk until the job ends
+    status: Mapped[str] = mapped_column(String, nullable=False, default="queued", index=True)  # queued|running|done|failed
+    rows_processed: Mapped[int] = mapped_column(Integer, default=0)
+    timings: Mapped[str] = mapped_column(Text, default="{}")  # JSON {stage: ms}
+    result: Mapped[str] = mapped_column(Text, default="")  # JSON {preview, issues} once done
+    error: Mapped[str] = mapped_column(Text, default="")
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
 # ---------- Predictions (versioned) ----------
 
+class TaggerVersion(Base):
+    """Dictionary of tagger versions; predictions carry its small id instead of the two strings."""
+    __tablename__ = "tagger_versions"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    rules_version: Mapped[str] = mapped_column(String, nullable=False)
+    model_version: Mapped[str] = mapped_column(String, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("rules_version", "model_version", name="uq_tagger_version"),
+    )
+
 class AllergenPrediction(Base):
     __tablename__ = "allergen_predictions"
 
     id: Mapped[int] = mapped_column(primary_key=True)
+    # lookups by owner use the (owner, allergen_id) unique indexes below; no separate single-column ones
     parsed_row_id: Mapped[int | None] = mapped_column(
-        ForeignKey("parsed_rows.id", ondelete="CASCADE"), nullable=True, index=True
+        ForeignKey("parsed_rows.id", ondelete="CASCADE"), nullable=True
     )
     menu_item_id: Mapped[int | None] = mapped_column(
-        ForeignKey("menu_items.id", ondelete="CASCADE"), nullable=True, index=True
+        ForeignKey("menu_items.id", ondelete="CASCADE"), nullable=True
     )
     allergen_id: Mapped[int] = mapped_column(ForeignKey("allergens.id", ondelete="CASCADE"), index=True)
     score: Mapped[Decimal] = mapped_column(Numeric(5, 4), nullable=False)
     status: Mapped[str] = mapped_column(String, nullable=False)  # 'auto' | 'weak' | 'rejected'
-    rules_version: Mapped[str] = mapped_column(String, nullable=False)
-    model_version: Mapped[str] = mapped_column(String, nullable=False)
+    version_id: Mapped[int] = mapped_column(Integer, ForeignKey("tagger_versions.id"), nullable=False)
     created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
 
     __table_args__ = (
         UniqueConstraint("parsed_row_id", "allergen_id", name="uq_row_allergen"),
         UniqueConstraint("menu_item_id", "allergen_id", name="uq_item_allergen"),
     )
+
+class RetagRun(Base):
+    """Checkpoint of a re-tag pass towards one tagger version; see services.retag."""
+    __tablename__ = "retag_runs"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    model_version: Mapped[str] = mapped_column(String, nullable=False, index=True)  # target version
+    phase: Mapped[str] = mapped_column(String, nullable=False, default="parsed_rows")  # parsed_rows|menu_items|done
+    last_id: Mapped[int] = mapped_column(Integer, default=0)  # keyset position within the phase
+    rows_scanned: Mapped[int] = mapped_column(Integer, default=0)
+    rows_changed: Mapped[int] = mapped_column(Integer, default=0)
+    status: Mapped[str] = mapped_column(String, nullable=False, default="running")  # running|paused|done|failed
+    error: Mapped[str] = mapped_column(Text, default="")
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
+# ---------- Tagger result cache ----------
+
+class TagCacheEntry(Base):
+    __tablename__ = "tag_cache"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    text_hash: Mapped[str] = mapped_column(String(40), nullable=False)  # sha1 of normalized text
+    rules_version: Mapped[str] = mapped_column(String, nullable=False)
+    synonyms_version: Mapped[str] = mapped_column(String, nullable=False)
+    scores: Mapped[str] = mapped_column(Text, nullable=False)  # JSON {allergen: score}
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("text_hash", "rules_version", "synonyms_version", name="uq_tag_cache_key"),
+    )
+
+# ---------- Schema setup ----------
+
+class SchemaMigration(Base):
+    """Fingerprints of model schemas already applied to this database; see app.migrate."""
+    __tablename__ = "schema_migrations"
+
+    fingerprint: Mapped[str] = mapped_column(String(40), primary_key=True)
+    applied_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
@@ -1,32 +1,37 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from ..db import get_db
-from ..models import Allergen, User
+from sqlalchemy import text
+from ..db import get_db, get_async_db
+from ..models import User
 from ..schemas import AllergenOut, AllergySetIn
 from ..auth import get_current_user
+from ..services import user_allergens
+from ..services.allergen_registry import ALLERGENS, SEED_ALLERGENS
 
 router = APIRouter(prefix="/api/allergens", tags=["allergens"])
 
 @router.get("", response_model=list[AllergenOut])
-def list_allergens(db: Session = Depends(get_db)):
-    return db.query(Allergen).order_by(Allergen.id).all()
+async def list_allergens(run=Depends(get_async_db)):
+    return [{"id": aid, "name": name} for aid, name in await run(ALLERGENS.all)]
 
 @router.post("/seed")
 def seed_allergens(db: Session = Depends(get_db)):
-    seed = ["Peanuts","Tree Nuts","Dairy","Eggs","Gluten","Soy","Fish","Shellfish","Sesame"]
-    for name in seed:
-        if not db.query(Allergen).filter(Allergen.name==name).first():
-            db.add(Allergen(name=name))
+    db.execute(text("INSERT INTO allergens (name) VALUES (:name) ON CONFLICT (name) DO NOTHING"),
+               [{"name": n} for n in SEED_ALLERGENS])
     db.commit()
-    return {"ok": True, "count": db.query(Allergen).count()}
+    ALLERGENS.refresh(db)
+    return {"ok": True, "count": len(ALLERGENS.all())}
 
 @router.put("/me")
 def set_my_allergies(payload: AllergySetIn, user=Depends(get_current_user), db: Session = Depends(get_db)):
-    u = db.query(User).get(user["id"])
+    u = db.get(User, user["id"])
     if not u: raise HTTPException(status_code=404, detail="User not found")
-    u.allergies.clear()
-    if payload.allergyIds:
-        alls = db.query(Allergen).filter(Allergen.id.in_(payload.allergyIds)).all()
-        for a in alls: u.allergies.append(a)
+    # ids not in the allergens table are ignored, as before
+    ids = ALLERGENS.known_ids(payload.allergyIds, db)
+    db.execute(text("DELETE FROM user_allergies WHERE user_id = :uid"), {"uid": u.id})
+    if ids:
+        db.execute(text("INSERT INTO user_allergies (user_id, allergen_id) VALUES (:uid, :aid)"),
+                   [{"uid": u.id, "aid": aid} for aid in ids])
     db.commit()
+    user_allergens.invalidate(u.id)
     return {"ok": True}
@@ -1,12 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from ..db import get_db, Base, engine
+from ..db import get_db
 from ..models import User
 from ..schemas import UserCreate, UserLogin, TokenOut
 from ..auth import hash_password, verify_password, create_token
 
-Base.metadata.create_all(bind=engine)
-
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
 @router.post("/register", response_model=TokenOut)
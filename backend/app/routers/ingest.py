@@ -1,152 +1,138 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Query, Response
+from fastapi.responses import ORJSONResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import text
 from ..db import get_db
-from ..models import (
-    MenuItem, Allergen, FileUpload, ParsedRow, AllergenPrediction
-)
+from ..models import FileUpload, IngestJob
 from ..auth import get_current_user, require_role
-from ..services.tagging.pipeline import tag_text
-import pandas as pd, io, pdfplumber, re, hashlib
+from ..services.ingest.parse import MissingColumns
+from ..services.ingest.pdf import parse_pdf, PdfTimeout
+from ..services.ingest.pipeline import StageTimer, get_or_create_file, run_csv, run_pdf_rows, cached_preview, mark_tagged
+from ..services.ingest.commit import commit_file
+from ..services.ingest import jobs
+from ..services import menu_cache, metrics
+import os, json, hashlib
+from datetime import datetime
 
 router = APIRouter(prefix="/api/ingest", tags=["ingest"])
 
+READ_CHUNK_BYTES = 1 << 20
+PREVIEW_LIMIT = int(os.getenv("INGEST_PREVIEW_LIMIT", "200"))
+
 def sha256_bytes(data: bytes) -> str:
     return hashlib.sha256(data).hexdigest()
 
+# --- BACKGROUND MODE: spool upload, queue a job, poll /jobs/{id} ---
+def _spool_job(src, filename: str, filetype: str, restaurant_id: int, db: Session) -> IngestJob:
+    # blocking file + DB I/O: runs in the threadpool, off the event loop
+    timer = StageTimer()
+    path, hasher = jobs.spool_path(filename), hashlib.sha256()
+    with timer.stage("read"), open(path, "wb") as out:
+        while chunk := src.read(READ_CHUNK_BYTES):
+            hasher.update(chunk); out.write(chunk)
+    job = IngestJob(restaurant_id=restaurant_id, filename=filename, filetype=filetype,
+                    sha256=hasher.hexdigest(), spool_path=path, timings=json.dumps(timer.as_ms()))
+    db.add(job); db.commit()
+    return job
+
+async def _queue_job(file: UploadFile, filetype: str, user, db: Session, response: Response):
+    job = await run_in_threadpool(_spool_job, file.file, file.filename, filetype, user["id"], db)
+    jobs.submit(job.id)
+    response.status_code = 202
+    return {"jobId": job.id, "status": job.status}
+
+@router.get("/jobs/{job_id}")
+def ingest_job_status(job_id: int,
+                      user=Depends(require_role("restaurant")),
+                      db: Session = Depends(get_db)):
+    job = db.query(IngestJob).filter(IngestJob.id == job_id, IngestJob.restaurant_id == user["id"]).first()
+    if not job: raise HTTPException(404, "Job not found for this restaurant")
+    return ORJSONResponse(jobs.job_out(job))
+
 # --- CSV PREVIEW + PREDICT ---
 @router.post("/csv")
-async def ingest_csv(file: UploadFile = File(...),
+async def ingest_csv(response: Response,
+                     file: UploadFile = File(...),
+                     stream: bool = Query(False, description="Chunked mode: bounded memory, preview capped at INGEST_PREVIEW_LIMIT rows"),
+                     background: bool = Query(False, description="Return a job id at once; poll GET /api/ingest/jobs/{id}"),
                      user=Depends(require_role("restaurant")),
                      db: Session = Depends(get_db)):
     if not file.filename.lower().endswith(".csv"):
         raise HTTPException(status_code=400, detail="CSV file required")
-    content = await file.read()
-    h = sha256_bytes(content)
-
-    # idempotency: one FileUpload per identical file
-    fu = db.query(FileUpload).filter(FileUpload.sha256 == h, FileUpload.restaurant_id == user["id"]).first()
-    if not fu:
-        fu = FileUpload(restaurant_id=user["id"], filename=file.filename, filetype="csv", sha256=h, pages=1)
-        db.add(fu); db.flush()
-
-    df = pd.read_csv(io.BytesIO(content))
-    df.columns = [c.strip().lower() for c in df.columns]
-    missing = [c for c in ["item_name","price"] if c not in df.columns]
-    if missing: raise HTTPException(400, f"Missing columns: {missing}")
-
-    preview, issues = [], []
-    amap = {a.name.lower(): a for a in db.query(Allergen).all()}
-
-    for i, row in df.iterrows():
-        name = str(row.get("item_name","")).strip()
-        desc = str(row.get("description","") or "").strip()
-        price = row.get("price", 0)
+    if background:
+        return await _queue_job(file, "csv", user, db, response)
+    out = await run_in_threadpool(_ingest_csv, file.file, file.filename, user["id"], stream, db)
+    # previews can run to 100k rows: serialize straight to bytes, skipping jsonable_encoder
+    return ORJSONResponse(out)
+
+def _ingest_csv(src, filename: str, restaurant_id: int, stream: bool, db: Session) -> dict:
+    # hash, parse, tag, persist: blocking file, CPU and DB work, run in the threadpool
+    limit = PREVIEW_LIMIT if stream else None
+    timer = StageTimer()
+    hasher = hashlib.sha256()
+    # hash while reading; the upload itself stays spooled on disk
+    with timer.stage("hash"):
+        while chunk := src.read(READ_CHUNK_BYTES):
+            hasher.update(chunk)
+    src.seek(0)
+
+    fu = get_or_create_file(db, restaurant_id, filename, "csv", hasher.hexdigest())
+    # identical file already tagged by this tagger version: serve the stored preview
+    cached = cached_preview(db, fu, limit)
+    if cached:
+        preview, issues, total = cached
+    else:
         try:
-            price = float(price); assert price >= 0
-        except Exception:
-            issues.append(f"Row {i+1}: invalid price"); price = 0.0
-
-        if not name:
-            issues.append(f"Row {i+1}: item_name required")
-
-        # store parsed_row (idempotent per file_id,row_index)
-        pr = db.query(ParsedRow).filter(ParsedRow.file_id == fu.id, ParsedRow.row_index == i).first()
-        if not pr:
-            pr = ParsedRow(file_id=fu.id, row_index=i, item_name=name, description=desc, price=price, parsing_meta="")
-            db.add(pr); db.flush()
-        else:
-            pr.item_name, pr.description, pr.price = name, desc, price
-
-        # run tagger and store predictions
-        accepted, weak, meta = tag_text(name, desc)
-        def save(status, pairs):
-            for allergen_name, score in pairs:
-                aid = amap.get(allergen_name.lower()).id if amap.get(allergen_name.lower()) else None
-                if not aid: continue
-                # upsert prediction
-                db.execute(text("""
-                    INSERT INTO allergen_predictions (parsed_row_id, menu_item_id, allergen_id, score, status, rules_version, model_version)
-                    VALUES (:pr, NULL, :aid, :sc, :st, :rv, :mv)
-                    ON CONFLICT (parsed_row_id, allergen_id) DO UPDATE
-                    SET score=EXCLUDED.score, status=EXCLUDED.status, rules_version=EXCLUDED.rules_version, model_version=EXCLUDED.model_version
-                """), {"pr": pr.id, "aid": aid, "sc": float(score), "st": status, "rv": meta["rules_version"], "mv": meta["model_version"]})
-        save("auto", accepted)
-        save("weak", weak)
-
-        preview.append({
-            "item_name": name, "description": desc, "price": price,
-            "predicted_allergens": [a for a,_ in accepted+weak]
-        })
-
-    db.commit()
-    return {"fileId": fu.id, "preview": preview, "issues": issues}
+            preview, issues, total = run_csv(db, fu, src, timer, limit)
+        except MissingColumns as e:
+            raise HTTPException(400, str(e))
+        mark_tagged(fu, issues)
+
+    with timer.stage("commit"):
+        db.commit()
+    metrics.observe_ingest("csv", "ingest", timer, 0 if cached else total)
+    out = {"fileId": fu.id, "preview": preview, "issues": issues}
+    if stream: out.update(rows=total, truncated=total > len(preview))
+    return out
 
 # --- PDF PREVIEW + PREDICT (best-effort) ---
 @router.post("/pdf")
-async def ingest_pdf(file: UploadFile = File(...),
+async def ingest_pdf(response: Response,
+                     file: UploadFile = File(...),
+                     background: bool = Query(False, description="Return a job id at once; poll GET /api/ingest/jobs/{id}"),
                      user=Depends(require_role("restaurant")),
                      db: Session = Depends(get_db)):
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(400, "PDF file required")
-    content = await file.read()
-    h = sha256_bytes(content)
-
-    fu = db.query(FileUpload).filter(FileUpload.sha256 == h, FileUpload.restaurant_id == user["id"]).first()
-    if not fu:
-        fu = FileUpload(restaurant_id=user["id"], filename=file.filename, filetype="pdf", sha256=h, pages=0)
-        db.add(fu); db.flush()
-
-    preview, issues = [], []
-    amap = {a.name.lower(): a for a in db.query(Allergen).all()}
-
-    with pdfplumber.open(io.BytesIO(content)) as pdf:
-        fu.pages = len(pdf.pages)
-        row_idx = 0
-        for pageno, page in enumerate(pdf.pages):
-            text = page.extract_text() or ""
-            for raw in text.split("\n"):
-                line = raw.strip()
-                m = re.search(r"(\d+(?:\.\d{1,2})?)\s*$", line)
-                if not m: continue
-                price = float(m.group(1))
-                left = line[:m.start()].strip()
-                parts = [p.strip() for p in left.split(" - ", 1)]
-                name = parts[0] if parts else ""
-                desc = parts[1] if len(parts) > 1 else ""
-                if not name: continue
-
-                pr = db.query(ParsedRow).filter(ParsedRow.file_id == fu.id, ParsedRow.row_index == row_idx).first()
-                if not pr:
-                    pr = ParsedRow(file_id=fu.id, row_index=row_idx, item_name=name, description=desc, price=price,
-                                   parsing_meta=f'{{"page":{pageno+1}}}')
-                    db.add(pr); db.flush()
-                else:
-                    pr.item_name, pr.description, pr.price = name, desc, price
-
-                accepted, weak, meta = tag_text(name, desc)
-                def save(status, pairs):
-                    for allergen_name, score in pairs:
-                        aid = amap.get(allergen_name.lower()).id if amap.get(allergen_name.lower()) else None
-                        if not aid: continue
-                        db.execute(text("""
-                            INSERT INTO allergen_predictions (parsed_row_id, menu_item_id, allergen_id, score, status, rules_version, model_version)
-                            VALUES (:pr, NULL, :aid, :sc, :st, :rv, :mv)
-                            ON CONFLICT (parsed_row_id, allergen_id) DO UPDATE
-                            SET score=EXCLUDED.score, status=EXCLUDED.status, rules_version=EXCLUDED.rules_version, model_version=EXCLUDED.model_version
-                        """), {"pr": pr.id, "aid": aid, "sc": float(score), "st": status, "rv": meta["rules_version"], "mv": meta["model_version"]})
-
-                save("auto", accepted)
-                save("weak", weak)
-
-                preview.append({"item_name": name, "description": desc, "price": price,
-                                "predicted_allergens": [a for a,_ in accepted+weak]})
-                row_idx += 1
-
-    if not preview:
-        issues.append("Could not auto-detect items. Prefer CSV or provide text-based PDF.")
-    db.commit()
-    return {"fileId": fu.id, "preview": preview, "issues": issues}
+    if background:
+        return await _queue_job(file, "pdf", user, db, response)
+    timer = StageTimer()
+    with timer.stage("read"):
+        content = await file.read()
+    with timer.stage("hash"):
+        h = await run_in_threadpool(sha256_bytes, content)
+
+    # DB work and tagging run in the threadpool, parsing in the process pool: the event loop only waits
+    fu, cached = await run_in_threadpool(_pdf_file, db, user["id"], file.filename, h)
+    if cached:
+        preview, issues, _ = cached
+    else:
+        # page extraction + line parsing run in the process pool, merged back in page order
+        try:
+            with timer.stage("parse"):
+                rows, fu.pages = await parse_pdf(content)
+        except PdfTimeout as e:
+            raise HTTPException(422, str(e))
+        preview, issues = await run_in_threadpool(run_pdf_rows, db, fu, rows, timer)
+        mark_tagged(fu, issues)
+    with timer.stage("commit"):
+        await run_in_threadpool(db.commit)
+    metrics.observe_ingest("pdf", "ingest", timer, 0 if cached else len(rows))
+    return ORJSONResponse({"fileId": fu.id, "preview": preview, "issues": issues})
+
+def _pdf_file(db: Session, restaurant_id: int, filename: str, sha: str):
+    fu = get_or_create_file(db, restaurant_id, filename, "pdf", sha)
+    return fu, cached_preview(db, fu)
 
 # --- COMMIT: create items + auto-apply predictions ---
 @router.post("/commit")
@@ -155,37 +141,16 @@ def ingest_commit(fileId: int,
                   db: Session = Depends(get_db)):
     fu = db.query(FileUpload).filter(FileUpload.id == fileId, FileUpload.restaurant_id == user["id"]).first()
     if not fu: raise HTTPException(404, "File not found for this restaurant")
-
-    amap = {a.id: a for a in db.query(Allergen).all()}
-    rows = db.query(ParsedRow).filter(ParsedRow.file_id == fu.id).order_by(ParsedRow.row_index).all()
-
-    created = 0
-    for pr in rows:
-        if not pr.item_name: continue
-        mi = MenuItem(restaurant_id=user["id"], item_name=pr.item_name,
-                      description=pr.description or "", price=pr.price or 0)
-        db.add(mi); db.flush()
-
-        preds = db.query(AllergenPrediction).filter(AllergenPrediction.parsed_row_id == pr.id).all()
-        for pred in preds:
-            if pred.status in ("auto","weak"):
-                db.execute(text("""
-                    INSERT INTO menu_allergens (menu_id, allergen_id)
-                    VALUES (:mid, :aid)
-                    ON CONFLICT (menu_id, allergen_id) DO NOTHING
-                """), {"mid": mi.id, "aid": pred.allergen_id})
-
-        # (optional) copy predictions to item dimension for audit
-        for pred in preds:
-            db.execute(text("""
-                INSERT INTO allergen_predictions (parsed_row_id, menu_item_id, allergen_id, score, status, rules_version, model_version)
-                VALUES (NULL, :mi, :aid, :sc, :st, :rv, :mv)
-                ON CONFLICT (menu_item_id, allergen_id) DO UPDATE
-                SET score=EXCLUDED.score, status=EXCLUDED.status, rules_version=EXCLUDED.rules_version, model_version=EXCLUDED.model_version
-            """), {"mi": mi.id, "aid": pred.allergen_id, "sc": float(pred.score),
-                   "st": pred.status, "rv": pred.rules_version, "mv": pred.model_version})
-
-        created += 1
-
-    db.commit()
-    return {"ok": True, "created": created}
+    if fu.compacted_at is not None:
+        raise HTTPException(409, "This file's predictions were cleaned up; upload it again to commit")
+
+    timer = StageTimer()
+    with timer.stage("persist"):
+        counts = commit_file(db, fu.id, user["id"])
+        if counts["created"] or counts["updated"]:
+            menu_cache.bump(db, user["id"])
+        fu.committed_at = fu.used_at = datetime.utcnow()
+    with timer.stage("commit"):
+        db.commit()
+    metrics.observe_ingest(fu.filetype, "commit", timer, sum(counts.values()))
+    return {"ok": True, **counts}
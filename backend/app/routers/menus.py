@@ -1,13 +1,62 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import select, exists, and_, or_
-from ..db import get_db
-from ..models import MenuItem, Allergen, User, menu_allergens
-from ..schemas import MenuItemCreate, MenuItemOut
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from sqlalchemy import select, and_, exists, or_
+from sqlalchemy.exc import IntegrityError
+from ..db import SessionLocal, get_db, get_async_db
+from ..models import MenuItem, menu_allergens
+from ..services.allergen_registry import ALLERGENS
+from ..services.allergen_mask import MAX_ALLERGEN_ID, ids_of, mask_of, overflow
+from ..services import search, menu_cache, menu_upsert, user_allergens
+from ..schemas import MenuItemBatchIn, MenuItemCreate, MenuItemOut
 from ..auth import get_current_user, require_role
 
+import base64, hashlib, json, orjson, os
+
 router = APIRouter(prefix="/api/menus", tags=["menus"])
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+# rows fetched from the server-side cursor (and written) per chunk by GET /api/menus/export
+EXPORT_BATCH = int(os.getenv("MENU_EXPORT_BATCH", "1000"))
+
+# ---------- keyset cursors ----------
+def _fingerprint(*filters) -> str:
+    return hashlib.sha1(json.dumps(filters).encode()).hexdigest()[:12]
+
+def encode_cursor(last_id: int, fp: str, rank: float | None = None, version: int | None = None) -> str:
+    c = {"id": last_id, "f": fp}
+    if rank is not None: c.update(r=rank, v=version)
+    return base64.urlsafe_b64encode(json.dumps(c).encode()).decode().rstrip("=")
+
+def decode_cursor(token: str, fp: str) -> tuple[int, float | None, int | None]:
+    """
+    (last id, last search rank, menu version it was ranked under) from an `after` token; 400 if
+    malformed or issued for different filters.
+    """
+    try:
+        c = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        last_id, rank = int(c["id"]), (float(c["r"]) if "r" in c else None)
+        version = int(c["v"]) if c.get("v") is not None else None
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if c.get("f") != fp:
+        raise HTTPException(status_code=400, detail="Cursor does not match the current filters")
+    return last_id, rank, version
+
+def _excluded_ids(excludeAllergenIds: str | None) -> set[int]:
+    return {int(x.strip()) for x in (excludeAllergenIds or "").split(",") if x.strip().isdigit()}
+
+def _exclude_allergens(stmt, ids):
+    """Drop items tagged with any of `ids`: one bitwise predicate on the mask, plus a menu_allergens
+    check for the ids past its range."""
+    if excluded := mask_of(ids):
+        # WHERE (allergen_mask & :excluded) = 0
+        stmt = stmt.where(MenuItem.allergen_mask.op("&")(excluded) == 0)
+    if over := overflow(ids):
+        stmt = stmt.where(~exists().where(menu_allergens.c.menu_id == MenuItem.id,
+                                          menu_allergens.c.allergen_id.in_(over)))
+    return stmt
+
 # ---------- CREATE ----------
 @router.post(
     "",
@@ -35,85 +84,152 @@ def create_menu_item(
         price=payload.price or 0,
     )
     db.add(mi)
+    menu_cache.bump(db, user["id"])
     db.commit()
     db.refresh(mi)
     return {"id": mi.id}
 
+@router.post("/batch", dependencies=[Depends(require_role("restaurant"))])
+def upsert_menu_items(
+    payload: MenuItemBatchIn,
+    user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Create or update up to MENU_BATCH_MAX items in one transaction (POS sync). Items with an externalId
+    update the restaurant's item synced under it; the rest are created. All items are validated first
+    (422 lists every bad one, nothing is written), then tagged in one pass; allergenIds are ignored as
+    in POST /api/menus. Returns per-item {index, id, externalId, status, allergens}.
+    """
+    if len(payload.items) > menu_upsert.MENU_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {menu_upsert.MENU_BATCH_MAX} items per batch")
+    try:
+        rows = menu_upsert.validate(payload.items)
+    except menu_upsert.BatchInvalid as e:
+        raise HTTPException(status_code=422, detail=e.errors)
+    try:
+        results = menu_upsert.upsert_items(db, user["id"], rows)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Another sync wrote the same externalId; retry the batch")
+    counts = {k: sum(r["status"] == k for r in results) for k in ("created", "updated", "unchanged")}
+    return {**counts, "results": results}
+
 # ---------- LIST ----------
 @router.get("", response_model=list[MenuItemOut])
-def list_menu_items(
+async def list_menu_items(
     safeForUser: bool = Query(False, description="Exclude items containing the current user's allergens"),
     restaurantId: int | None = Query(None, description="Only items from this restaurant"),
     q: str | None = Query(None, description="Search term for name/description"),
     excludeAllergenIds: str | None = Query(None, description="Comma-separated allergen IDs to exclude"),
     page: int = Query(1, ge=1),
     pageSize: int = Query(50, ge=1, le=200),
+    after: str | None = Query(None, description="Cursor from a previous X-Next-Cursor header; replaces page"),
+    if_none_match: str | None = Header(None),
     user=Depends(get_current_user),
-    db: Session = Depends(get_db)
+    run=Depends(get_async_db)
 ):
     """
     Returns menu items with optional:
       - safeForUser filtering (excludes items intersecting user's allergens)
       - restaurantId filtering
-      - full-text-ish search on name/description
+      - full-text search on name/description (every word as a prefix, best matches first)
       - excludeAllergenIds filtering
-      - pagination
+      - pagination: page/pageSize (OFFSET), or keyset via `after` (WHERE id < :last_id, or
+        (rank, id) past the last row when searching). A full page sets X-Next-Cursor either way.
+        Search ranks move with any write to the menus (bm25 uses whole-table statistics), so a search
+        cursor is only valid for the menu version it was issued under: after a write it gets 409 and
+        the client starts again from the first page instead of silently skipping or repeating rows.
+    Responses are cached per (normalized params, excluded allergens, menu version) and carry an
+    ETag; a matching If-None-Match gets a bodiless 304. The body is serialized once with orjson and
+    cached as bytes (response_model documents the shape; it is not re-validated per request).
     """
-    # Base selectable with eager load to avoid N+1 on allergens
-    stmt = select(MenuItem).options(selectinload(MenuItem.allergens))
+    return await run(_list_menu_items, safeForUser, restaurantId, q, excludeAllergenIds,
+                     page, pageSize, after, if_none_match, user)
+
+def _list_menu_items(db: Session, safeForUser, restaurantId, q, excludeAllergenIds,
+                     page, pageSize, after, if_none_match, user):
+    stmt = select(MenuItem)
 
     # Scope to a restaurant if provided
     if restaurantId:
         stmt = stmt.where(MenuItem.restaurant_id == restaurantId)
 
-    # Search across name/description
-    if q:
+    # Search across name/description: the FTS index where the backend has one, ILIKE otherwise
+    rank = None
+    words = search.terms(q or "")
+    if words and search.supported(db.bind.dialect.name):
+        stmt, rank = search.apply(stmt, MenuItem, db.bind.dialect.name, words)
+    elif q:
         like = f"%{q.strip()}%"
         stmt = stmt.where(or_(MenuItem.item_name.ilike(like), MenuItem.description.ilike(like)))
 
     # Exclude by explicit allergen IDs (comma-separated -> list[int])
-    excl_ids: list[int] = []
-    if excludeAllergenIds:
-        excl_ids = [int(x.strip()) for x in excludeAllergenIds.split(",") if x.strip().isdigit()]
-        if excl_ids:
-            # WHERE NOT EXISTS (SELECT 1 FROM menu_allergens ma WHERE ma.menu_id = MenuItem.id AND ma.allergen_id IN (:ids))
-            stmt = stmt.where(
-                ~exists(
-                    select(menu_allergens.c.menu_id)
-                    .where(
-                        and_(
-                            menu_allergens.c.menu_id == MenuItem.id,
-                            menu_allergens.c.allergen_id.in_(excl_ids),
-                        )
-                    )
-                )
-            )
+    excl_ids = _excluded_ids(excludeAllergenIds)
 
     # Safe for logged-in user based on their saved allergen profile
     if safeForUser:
-        u = db.get(User, user["id"])
-        if not u:
+        ids = user_allergens.allergen_ids(db, user["id"])
+        if ids is None:
             raise HTTPException(status_code=404, detail="User not found")
+        excl_ids |= ids
+
+    # Both allergen filters become one predicate on the denormalized mask (ids past its range: menu_allergens)
+    stmt = _exclude_allergens(stmt, excl_ids)
+    excluded = (mask_of(excl_ids), overflow(excl_ids))
+
+    # Versioned response cache: any write to the restaurant's menu bumps the version in the key
+    # search is case-insensitive: one normalized q for the cache key and the cursor fingerprint
+    qn = (q or "").strip().lower()
+    key = (restaurantId, qn, excluded, page if not after else 0, pageSize, after)
+    fp = _fingerprint(restaurantId, qn, excluded)
+    last_id, last_rank, ranked_under = decode_cursor(after, fp) if after else (None, None, None)
+    # search ranks depend on every restaurant's items: pin cursors to the all-restaurants version
+    ranked_now = menu_cache.version(db, menu_cache.ALL) if rank is not None else None
+    if last_rank is not None and ranked_under != ranked_now:
+        raise HTTPException(status_code=409, detail="The menus changed since this search cursor was issued; "
+                                                    "start again from the first page")
+    tag = menu_cache.etag(key, menu_cache.version(db, restaurantId))
+    headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+    if menu_cache.etag_matches(if_none_match, tag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    cached = menu_cache.MENU_CACHE.get(tag)
+    if cached is not None:
+        body, next_cursor = cached
+        if next_cursor: headers[NEXT_CURSOR_HEADER] = next_cursor
+        return Response(body, media_type="application/json", headers=headers)
+
+    # Order by relevance when searching, newest first otherwise; then paginate
+    if rank is not None:
+        stmt = stmt.add_columns(rank).order_by(rank, MenuItem.id.desc())
+    else:
+        stmt = stmt.order_by(MenuItem.id.desc())
+    stmt = stmt.limit(pageSize)
+    if after:
+        if rank is not None and last_rank is not None:
+            stmt = stmt.where(or_(rank > last_rank, and_(rank == last_rank, MenuItem.id < last_id)))
+        else:
+            stmt = stmt.where(MenuItem.id < last_id)
+    else:
+        stmt = stmt.offset((page - 1) * pageSize)
 
-        # Fetch user's allergen IDs once (filtering by name is fine too, IDs are faster)
-        user_allergen_ids = [a.id for a in u.allergies]
-        if user_allergen_ids:
-            stmt = stmt.where(
-                ~exists(
-                    select(menu_allergens.c.menu_id)
-                    .where(
-                        and_(
-                            menu_allergens.c.menu_id == MenuItem.id,
-                            menu_allergens.c.allergen_id.in_(user_allergen_ids),
-                        )
-                    )
-                )
-            )
-
-    # Order newest first; then paginate
-    stmt = stmt.order_by(MenuItem.id.desc()).offset((page - 1) * pageSize).limit(pageSize)
-
-    items = db.scalars(stmt).all()
+    rows = db.execute(stmt).all()
+    items = [r[0] for r in rows]
+    next_cursor = None
+    if len(rows) == pageSize:
+        last = rows[-1]
+        next_cursor = (encode_cursor(last[0].id, fp, last[1], ranked_now) if rank is not None
+                       else encode_cursor(last[0].id, fp))
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+
+    # allergen ids for the whole page in one query (avoids N+1); names come from the registry
+    tags: dict[int, list[int]] = {}
+    if items:
+        for mid, aid in db.execute(select(menu_allergens.c.menu_id, menu_allergens.c.allergen_id)
+                                   .where(menu_allergens.c.menu_id.in_([mi.id for mi in items]))
+                                   .order_by(menu_allergens.c.allergen_id)):
+            tags.setdefault(mid, []).append(aid)
 
     def serialize(mi: MenuItem):
         return {
@@ -121,7 +237,60 @@ def list_menu_items(
             "item_name": mi.item_name,
             "description": mi.description or "",
             "price": float(mi.price or 0),
-            "allergens": [a.name for a in mi.allergens],
+            "allergens": [n for n in (ALLERGENS.name_for(aid, db) for aid in tags.get(mi.id, [])) if n],
         }
 
-    return [serialize(mi) for mi in items]
+    body = orjson.dumps([serialize(mi) for mi in items])
+    menu_cache.MENU_CACHE.put(tag, (body, next_cursor))
+    return Response(body, media_type="application/json", headers=headers)
+
+# ---------- EXPORT ----------
+@router.get("/export")
+def export_menu_items(
+    restaurantId: int | None = Query(None, description="Only items from this restaurant"),
+    excludeAllergenIds: str | None = Query(None, description="Comma-separated allergen IDs to exclude"),
+    user=Depends(get_current_user),
+):
+    """
+    Full catalog as NDJSON, one item per line with its allergen names, oldest first. Rows come off a
+    server-side cursor EXPORT_BATCH at a time and are written as they are read, so memory stays flat
+    however large the catalog; allergens are decoded from allergen_mask, plus one lookup per batch for
+    links to ids past the mask's range.
+    """
+    stmt = (select(MenuItem.id, MenuItem.restaurant_id, MenuItem.item_name, MenuItem.description,
+                   MenuItem.price, MenuItem.allergen_mask).order_by(MenuItem.id))
+    if restaurantId:
+        stmt = stmt.where(MenuItem.restaurant_id == restaurantId)
+    stmt = _exclude_allergens(stmt, _excluded_ids(excludeAllergenIds))
+    filename = f"menu-{restaurantId or 'all'}.ndjson"
+    return StreamingResponse(export_rows(stmt), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+def export_rows(stmt, batch: int | None = None):
+    # own session: the request's dependencies are torn down before the body is streamed
+    names: dict[int, list[str]] = {}
+    with SessionLocal() as db:
+        result = db.execute(stmt, execution_options={"yield_per": batch or EXPORT_BATCH})
+        for rows in result.partitions():
+            extra: dict[int, list[int]] = {}
+            for mid, aid in db.execute(select(menu_allergens.c.menu_id, menu_allergens.c.allergen_id)
+                                       .where(menu_allergens.c.menu_id.in_([r.id for r in rows]),
+                                              menu_allergens.c.allergen_id > MAX_ALLERGEN_ID)
+                                       .order_by(menu_allergens.c.allergen_id)):
+                extra.setdefault(mid, []).append(aid)
+            lines = []
+            for r in rows:
+                tags = names.get(r.allergen_mask)
+                if tags is None:
+                    tags = names[r.allergen_mask] = [n for n in (ALLERGENS.name_for(aid, db)
+                                                                 for aid in ids_of(r.allergen_mask or 0)) if n]
+                if r.id in extra:
+                    tags = tags + [n for n in (ALLERGENS.name_for(aid, db) for aid in extra[r.id]) if n]
+                lines.append(orjson.dumps({"id": r.id, "restaurant_id": r.restaurant_id, "item_name": r.item_name,
+                                           "description": r.description or "", "price": float(r.price or 0),
+                                           "allergens": tags}))
+            yield b"\n".join(lines) + b"\n"
+
+@router.get("/cache/stats", dependencies=[Depends(require_role("admin"))])
+def menu_cache_stats():
+    return menu_cache.stats()
@@ -0,0 +1,14 @@
+import os, secrets
+from fastapi import APIRouter, Header, HTTPException, Response
+from ..services import metrics
+
+router = APIRouter(prefix="/api", tags=["metrics"])
+
+# when set, scrapers must send "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+@router.get("/metrics")
+def prometheus_metrics(authorization: str | None = Header(None)):
+    if METRICS_TOKEN and not secrets.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
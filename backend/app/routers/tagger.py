@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.orm import Session
+from ..db import get_db
+from ..models import RetagRun
+from ..auth import require_role
+from ..services import retag
+from ..services.tagging import pipeline as tagger
+
+router = APIRouter(prefix="/api/tagger", tags=["tagger"], dependencies=[Depends(require_role("admin"))])
+
+@router.get("")
+def tagger_status():
+    st = tagger.current()
+    return {"modelVersion": st.model_version, "rulesVersion": st.rules_version, "synonymsVersion": st.synonyms_version}
+
+@router.post("/reload")
+def reload_rules():
+    try:
+        changed = tagger.reload()
+    except Exception as e:
+        raise HTTPException(422, f"Rules could not be loaded: {e}")
+    return {"changed": changed, "modelVersion": tagger.MODEL_VERSION}
+
+@router.post("/retag", status_code=202)
+def start_retag(force: bool = False, db: Session = Depends(get_db)):
+    """Queue a re-tag pass to the current version; resumes an unfinished run from its checkpoint."""
+    retag.submit(force)
+    return retag.run_out(db.query(RetagRun).order_by(RetagRun.id.desc()).first())
+
+@router.get("/retag")
+def retag_status(db: Session = Depends(get_db)):
+    return retag.run_out(db.query(RetagRun).order_by(RetagRun.id.desc()).first())
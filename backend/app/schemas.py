@@ -27,6 +27,12 @@ class MenuItemCreate(BaseModel):
     price: float = 0
     allergenIds: Optional[List[int]] = []
 
+class MenuItemUpsert(MenuItemCreate):
+    externalId: Optional[str] = None  # set: update the item synced under this id instead of creating one
+
+class MenuItemBatchIn(BaseModel):
+    items: List[MenuItemUpsert]
+
 class MenuItemOut(BaseModel):
     id: int
     item_name: str
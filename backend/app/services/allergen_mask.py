@@ -0,0 +1,43 @@
+from sqlalchemy import text
+
+# allergen id n -> bit n-1 of menu_items.allergen_mask (signed 64-bit, so ids 1..63). Links to ids
+# past that have no bit: filters check them against menu_allergens (see overflow()).
+MAX_ALLERGEN_ID = 63
+
+# mask recomputed from menu_allergens; SUM == bitwise OR because (menu_id, allergen_id) is unique
+MASK_SQL = f"""(SELECT COALESCE(SUM(CAST(1 AS BIGINT) << (ma.allergen_id - 1)), 0)
+               FROM menu_allergens ma WHERE ma.menu_id = menu_items.id AND ma.allergen_id <= {MAX_ALLERGEN_ID})"""
+
+def bit(allergen_id: int) -> int:
+    if not 0 < allergen_id <= MAX_ALLERGEN_ID:
+        raise ValueError(f"allergen id {allergen_id} does not fit menu_items.allergen_mask")
+    return 1 << (allergen_id - 1)
+
+def mask_of(allergen_ids) -> int:
+    """OR of the ids' bits; ids outside 1..MAX_ALLERGEN_ID have no bit and are skipped."""
+    m = 0
+    for aid in allergen_ids:
+        if 0 < aid <= MAX_ALLERGEN_ID: m |= bit(aid)
+    return m
+
+def overflow(allergen_ids) -> list[int]:
+    """The ids past MAX_ALLERGEN_ID, sorted: mask_of can't represent them."""
+    return sorted({aid for aid in allergen_ids if aid > MAX_ALLERGEN_ID})
+
+def ids_of(mask: int) -> list[int]:
+    """Allergen ids set in a mask, ascending."""
+    return [i + 1 for i in range(MAX_ALLERGEN_ID) if mask >> i & 1]
+
+def recompute_sql(where: str) -> str:
+    """UPDATE statement re-deriving allergen_mask for the menu_items rows matching `where`."""
+    return f"UPDATE menu_items SET allergen_mask = {MASK_SQL} WHERE {where}"
+
+def backfill(db) -> int:
+    """Fix every stored mask that disagrees with menu_allergens. Returns the number of rows changed."""
+    return db.execute(text(recompute_sql(f"allergen_mask <> {MASK_SQL}"))).rowcount
+
+def verify(db, limit: int = 20) -> list[tuple[int, int, int]]:
+    """(menu_item_id, stored, expected) for items whose mask is out of sync, at most `limit`."""
+    return [tuple(r) for r in db.execute(text(
+        f"SELECT id, allergen_mask, {MASK_SQL} FROM menu_items WHERE allergen_mask <> {MASK_SQL} ORDER BY id LIMIT :n"
+    ), {"n": limit})]
@@ -0,0 +1,98 @@
+import os, threading, time
+from sqlalchemy import bindparam, text
+
+SEED_ALLERGENS = ["Peanuts", "Tree Nuts", "Dairy", "Eggs", "Gluten", "Soy", "Fish", "Shellfish", "Sesame"]
+
+# extra spellings resolved to a canonical allergen (keys case-folded); singulars of plural names are automatic
+ALIASES = {
+    "peanut": "Peanuts", "groundnut": "Peanuts",
+    "tree nut": "Tree Nuts", "nuts": "Tree Nuts",
+    "milk": "Dairy", "lactose": "Dairy",
+    "egg": "Eggs",
+    "wheat": "Gluten",
+    "soya": "Soy", "soybean": "Soy",
+    "crustacean": "Shellfish", "crustaceans": "Shellfish",
+}
+
+REGISTRY_TTL_S = float(os.getenv("ALLERGEN_REGISTRY_TTL_S", "300"))
+RELOAD_ON_MISS_S = 30.0
+
+class AllergenRegistry:
+    """
+    Process-wide name <-> id map of the allergens table. Loaded on first use and reloaded after
+    REGISTRY_TTL_S, on an unknown name or id (at most every RELOAD_ON_MISS_S; known_ids always checks
+    the table), or via refresh() after a write.
+    Lookups between reloads do not touch the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: dict[str, int] = {}
+        self._names: dict[int, str] = {}
+        self._loaded_at: float | None = None
+
+    def _age(self) -> float:
+        return float("inf") if self._loaded_at is None else time.monotonic() - self._loaded_at
+
+    def refresh(self, db):
+        rows = db.execute(text("SELECT id, name FROM allergens")).all()
+        names = {aid: name for aid, name in rows}
+        by_key = {name.casefold(): aid for aid, name in rows}
+        # key -> canonical key: aliases, then singulars, then the names themselves
+        ids = {alias: canonical.casefold() for alias, canonical in ALIASES.items()}
+        for key in by_key:
+            if key.endswith("s"): ids.setdefault(key[:-1], key)
+            ids[key] = key
+        with self._lock:
+            self._ids = {k: by_key[v] for k, v in ids.items() if v in by_key}
+            self._names, self._loaded_at = names, time.monotonic()
+
+    def _ensure(self, db):
+        if db is not None and self._age() > REGISTRY_TTL_S:
+            self.refresh(db)
+
+    def _reload_on_miss(self, db) -> bool:
+        if db is None or self._age() <= RELOAD_ON_MISS_S: return False
+        self.refresh(db)
+        return True
+
+    def id_for(self, name: str, db=None) -> int | None:
+        """Allergen id for a name or alias (any case); None if unknown."""
+        self._ensure(db)
+        aid = self._ids.get((name or "").strip().casefold())
+        if aid is None and self._reload_on_miss(db):
+            aid = self._ids.get((name or "").strip().casefold())
+        return aid
+
+    def name_for(self, allergen_id: int, db=None) -> str | None:
+        """Allergen name for an id; None if unknown (callers drop it)."""
+        self._ensure(db)
+        name = self._names.get(allergen_id)
+        if name is None and self._reload_on_miss(db):
+            name = self._names.get(allergen_id)
+        return name
+
+    def known_ids(self, ids, db=None) -> list[int]:
+        """
+        The given ids that exist, de-duplicated, in input order. Ids the registry doesn't know are
+        checked against the table (one query), so an allergen added since the last load is kept.
+        """
+        self._ensure(db)
+        ids = list(dict.fromkeys(ids))
+        missing = [i for i in ids if i not in self._names]
+        found = set()
+        if missing and db is not None:
+            found = set(db.execute(text("SELECT id FROM allergens WHERE id IN :ids").bindparams(
+                bindparam("ids", expanding=True)), {"ids": missing}).scalars())
+            if found: self.refresh(db)
+        return [i for i in ids if i in self._names or i in found]
+
+    def all(self, db=None) -> list[tuple[int, str]]:
+        self._ensure(db)
+        return sorted(self._names.items())
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+ALLERGENS = AllergenRegistry()
@@ -0,0 +1,77 @@
+import contextvars, logging, os, time
+from sqlalchemy import event
+
+# Opt-in SQL profiling. DB_PROFILE=true adds X-DB-Queries / X-DB-Time-ms to every response (statements
+# the request ran through the app engines, executemany counted once); DB_SLOW_QUERY_MS > 0 logs each
+# statement slower than that with the request it ran for. Both off: no listeners, no middleware.
+# Headers go out with the response start, so streamed responses (no Content-Length, e.g. the NDJSON
+# export) would report only the statements run before the first chunk: they get no headers instead.
+DB_PROFILE = os.getenv("DB_PROFILE", "false").lower() == "true"
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "0"))
+ENABLED = DB_PROFILE or DB_SLOW_QUERY_MS > 0
+QUERIES_HEADER, TIME_HEADER = "X-DB-Queries", "X-DB-Time-ms"
+
+log = logging.getLogger(__name__)
+
+class RequestStats:
+    __slots__ = ("scope", "queries", "seconds")
+
+    def __init__(self, scope=None):
+        self.scope, self.queries, self.seconds = scope, 0, 0.0
+
+    @property
+    def route(self) -> str:
+        from .metrics import route_label
+        return f"{self.scope['method']} {route_label(self.scope)}" if self.scope else "-"
+
+# set per request by the middleware; copied into the threadpool that runs sync routes and dependencies
+_current: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar("db_profile", default=None)
+
+def _before(conn, cursor, statement, parameters, context, executemany):
+    if context is not None: context._prof_t0 = time.perf_counter()
+
+def _after(conn, cursor, statement, parameters, context, executemany):
+    t0 = getattr(context, "_prof_t0", None)
+    if t0 is None: return
+    elapsed = time.perf_counter() - t0
+    st = _current.get()
+    if st is not None:
+        st.queries += 1
+        st.seconds += elapsed
+    if DB_SLOW_QUERY_MS > 0 and elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        log.warning("slow query %.1fms [%s]: %s", elapsed * 1000, st.route if st else "-",
+                    " ".join(statement.split())[:500])
+
+def install(*engines):
+    for e in engines:
+        if e is None: continue
+        e = getattr(e, "sync_engine", e)
+        event.listen(e, "before_cursor_execute", _before)
+        event.listen(e, "after_cursor_execute", _after)
+
+def _streamed(start) -> bool:
+    # bodiless statuses carry no Content-Length either
+    return start["status"] not in (204, 304) and \
+        not any(k.lower() == b"content-length" for k, _ in start.get("headers", []))
+
+class DBProfileMiddleware:
+    """Plain ASGI: one RequestStats per HTTP request, reported in headers when DB_PROFILE is on."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        st = RequestStats(scope)
+        token = _current.set(st)
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and DB_PROFILE and not _streamed(message):
+                message["headers"] = list(message.get("headers", [])) + [
+                    (QUERIES_HEADER.lower().encode(), str(st.queries).encode()),
+                    (TIME_HEADER.lower().encode(), f"{st.seconds * 1000:.1f}".encode())]
+            await send(message)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
@@ -0,0 +1,114 @@
+import json
+from sqlalchemy import text
+from ..allergen_mask import recompute_sql
+from .persist import content_hash, _batches
+
+# the file's rows and the restaurant's items sharing a (case-folded) name with one of them
+_ROWS = text("""
+    SELECT id, lower(item_name), content_hash, item_name, description, price, tagger_version FROM parsed_rows
+    WHERE file_id = :fid AND item_name <> '' ORDER BY row_index
+""")
+_ITEMS = text("""
+    SELECT id, lower(item_name), content_hash FROM menu_items
+    WHERE restaurant_id = :rid AND lower(item_name) IN (SELECT lower(item_name) FROM parsed_rows WHERE file_id = :fid)
+    ORDER BY id
+""")
+
+_INSERT_NEW = """
+    INSERT INTO menu_items (restaurant_id, item_name, description, price, content_hash, tagger_version)
+    SELECT :rid, pr.item_name, COALESCE(pr.description, ''), COALESCE(pr.price, 0), pr.content_hash, pr.tagger_version
+    FROM parsed_rows pr WHERE pr.id IN {ids}
+    ORDER BY pr.row_index
+    RETURNING id
+"""
+
+_UPDATE = text("""
+    UPDATE menu_items SET item_name = :name, description = :desc, price = :price, content_hash = :h,
+                          tagger_version = :tv
+    WHERE id = :id
+""")
+
+# items written by this commit, each paired with a row of the file carrying its content (rows with
+# equal content_hash have equal predictions, so any of them will do)
+_TOUCHED = """
+    FROM menu_items mi
+    JOIN (SELECT content_hash, MIN(id) AS id FROM parsed_rows WHERE file_id = :fid GROUP BY content_hash) src
+      ON src.content_hash = mi.content_hash
+    JOIN allergen_predictions ap ON ap.parsed_row_id = src.id
+    WHERE mi.id IN {ids}
+"""
+
+_LINK = f"""
+    INSERT INTO menu_allergens (menu_id, allergen_id)
+    SELECT DISTINCT mi.id, ap.allergen_id {_TOUCHED} AND ap.status IN ('auto','weak')
+    ON CONFLICT (menu_id, allergen_id) DO NOTHING
+"""
+
+_AUDIT = f"""
+    INSERT INTO allergen_predictions (parsed_row_id, menu_item_id, allergen_id, score, status, version_id)
+    SELECT NULL, mi.id, ap.allergen_id, ap.score, ap.status, ap.version_id {_TOUCHED}
+    ON CONFLICT (menu_item_id, allergen_id) DO UPDATE
+    SET score=EXCLUDED.score, status=EXCLUDED.status, version_id=EXCLUDED.version_id
+"""
+
+def _id_set(db) -> str:
+    # one JSON array parameter instead of chunked IN lists: the statement count doesn't grow with the file
+    if db.get_bind().dialect.name == "postgresql":
+        return "(SELECT CAST(value AS INTEGER) FROM json_array_elements_text(CAST(:ids AS json)))"
+    return "(SELECT value FROM json_each(:ids))"
+
+def _backfill_hashes(db, table: str, where: str, params: dict):
+    # rows written before content_hash existed
+    rows = db.execute(text(f"SELECT id, item_name, description, price FROM {table} WHERE {where} AND content_hash = ''"),
+                      params).all()
+    for chunk in _batches([{"id": i, "h": content_hash(n, d, p)} for i, n, d, p in rows]):
+        db.execute(text(f"UPDATE {table} SET content_hash = :h WHERE id = :id"), chunk)
+
+def commit_file(db, file_id: int, restaurant_id: int) -> dict:
+    """
+    Publish a file's parsed rows as the restaurant's menu items, one item per row. A row whose
+    (case-insensitive name, content hash) matches an existing item is unchanged (repeats pair up one
+    to one); remaining rows take over remaining items of the same name as updates, with their
+    allergens replaced from the row's predictions; the rest are created.
+    Runs a fixed number of set-based statements regardless of file size.
+    """
+    p = {"fid": file_id, "rid": restaurant_id}
+    _backfill_hashes(db, "parsed_rows", "file_id = :fid", p)
+    _backfill_hashes(db, "menu_items", "restaurant_id = :rid", p)
+
+    exact, by_name = {}, {}
+    for mid, k, h in db.execute(_ITEMS, p):
+        exact.setdefault((k, h), []).append(mid)
+        by_name.setdefault(k, []).append(mid)
+    matched, left, unchanged = set(), [], 0
+    for row in db.execute(_ROWS, p).all():
+        same = exact.get((row[1], row[2]))
+        if same:
+            matched.add(same.pop(0)); unchanged += 1
+        else:
+            left.append(row)
+    free = {k: [m for m in ids if m not in matched] for k, ids in by_name.items()}
+    new_rows, changed = [], []
+    for rid, k, h, name, desc, price, tv in left:
+        if free.get(k):
+            changed.append({"id": free[k].pop(0), "name": name, "desc": desc or "", "price": price or 0, "h": h, "tv": tv})
+        else:
+            new_rows.append(rid)
+
+    ids = _id_set(db)
+    touched = []
+    if new_rows:
+        touched += db.execute(text(_INSERT_NEW.format(ids=ids)), {**p, "ids": json.dumps(new_rows)}).scalars().all()
+    if changed:
+        db.execute(_UPDATE, changed)
+        upd = {**p, "ids": json.dumps([c["id"] for c in changed])}
+        db.execute(text(f"DELETE FROM menu_allergens WHERE menu_id IN {ids}"), upd)
+        db.execute(text(f"DELETE FROM allergen_predictions WHERE menu_item_id IN {ids}"), upd)
+        touched += [c["id"] for c in changed]
+    if touched:
+        t = {**p, "ids": json.dumps(touched)}
+        db.execute(text(_LINK.format(ids=ids)), t)
+        db.execute(text(_AUDIT.format(ids=ids)), t)
+        db.execute(text(recompute_sql(f"id IN {ids}")), t)
+
+    return {"created": len(new_rows), "updated": len(changed), "unchanged": unchanged}
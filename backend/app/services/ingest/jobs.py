@@ -0,0 +1,121 @@
+import json, logging, os, tempfile, uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from ...db import SessionLocal
+from ...models import IngestJob
+from .. import metrics
+from .parse import MissingColumns
+from .pdf import parse_pdf_sync, PdfTimeout
+from .pipeline import StageTimer, get_or_create_file, run_csv, run_pdf_rows, cached_preview, mark_tagged
+
+JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))
+JOB_STALE_S = int(os.getenv("INGEST_JOB_STALE_S", "600"))
+SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "allergy-menu-ingest"))
+PREVIEW_LIMIT = int(os.getenv("INGEST_PREVIEW_LIMIT", "200"))
+
+log = logging.getLogger(__name__)
+_pool: ThreadPoolExecutor | None = None
+
+def spool_path(filename: str) -> str:
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    return os.path.join(SPOOL_DIR, f"{uuid.uuid4().hex}{os.path.splitext(filename)[1].lower()}")
+
+def submit(job_id: int):
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="ingest-job")
+    _pool.submit(run_job, job_id)
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def _claim(db, job_id: int) -> bool:
+    # only one worker (thread or process) gets to move a job out of 'queued'
+    res = db.execute(update(IngestJob).where(IngestJob.id == job_id, IngestJob.status == "queued")
+                     .values(status="running", error=""))
+    db.commit()
+    return res.rowcount == 1
+
+def run_job(job_id: int):
+    """parse -> tag -> persist for one queued job, committing after every chunk as progress."""
+    with SessionLocal() as db:
+        if not _claim(db, job_id): return
+        job = db.get(IngestJob, job_id)
+        timer = StageTimer()
+        # keep the upload-side stages (read/hash) recorded when the job was queued
+        timer.seconds.update({k: v / 1000 for k, v in json.loads(job.timings or "{}").items()})
+        try:
+            fu = get_or_create_file(db, job.restaurant_id, job.filename, job.filetype, job.sha256)
+            job.file_id = fu.id
+
+            def progress(total):
+                job.rows_processed, job.timings = total, json.dumps(timer.as_ms())
+                db.commit()
+
+            cached = cached_preview(db, fu, PREVIEW_LIMIT)
+            if cached:
+                preview, issues, total = cached
+            elif job.filetype == "csv":
+                with open(job.spool_path, "rb") as f:
+                    preview, issues, total = run_csv(db, fu, f, timer, PREVIEW_LIMIT, on_chunk=progress)
+            else:
+                with timer.stage("read"):
+                    with open(job.spool_path, "rb") as f: content = f.read()
+                with timer.stage("parse"):
+                    rows, fu.pages = parse_pdf_sync(content)
+                preview, issues = run_pdf_rows(db, fu, rows, timer, PREVIEW_LIMIT)
+                total = len(rows)
+            if not cached: mark_tagged(fu, issues)
+
+            job.status, job.rows_processed = "done", total
+            job.timings = json.dumps(timer.as_ms())
+            job.result = json.dumps({"preview": preview, "issues": issues,
+                                     "truncated": total > len(preview)})
+            with timer.stage("commit"):
+                db.commit()
+            metrics.observe_ingest(job.filetype, "ingest", timer, 0 if cached else total)
+        except Exception as e:
+            db.rollback()
+            if not isinstance(e, (MissingColumns, PdfTimeout)):
+                log.exception("ingest job %s failed", job_id)
+            db.execute(update(IngestJob).where(IngestJob.id == job_id)
+                       .values(status="failed", error=str(e) or type(e).__name__,
+                               timings=json.dumps(timer.as_ms())))
+            db.commit()
+        _discard_spool(db.get(IngestJob, job_id))
+
+def _discard_spool(job: IngestJob):
+    if job and job.status in ("done", "failed") and job.spool_path and os.path.exists(job.spool_path):
+        os.remove(job.spool_path)
+
+def recover_jobs():
+    """
+    Startup: resubmit queued jobs and jobs left 'running' by a dead worker (no progress for
+    INGEST_JOB_STALE_S); fail them cleanly when their spooled upload is gone.
+    """
+    stale = datetime.utcnow() - timedelta(seconds=JOB_STALE_S)
+    with SessionLocal() as db:
+        jobs = db.query(IngestJob).filter(
+            (IngestJob.status == "queued") | ((IngestJob.status == "running") & (IngestJob.updated_at < stale))
+        ).all()
+        resubmit = []
+        for job in jobs:
+            if job.spool_path and os.path.exists(job.spool_path):
+                job.status = "queued"; resubmit.append(job.id)
+            else:
+                job.status, job.error = "failed", "interrupted by restart and the upload is no longer available"
+        db.commit()
+    for job_id in resubmit:
+        submit(job_id)
+    return resubmit
+
+def job_out(job: IngestJob) -> dict:
+    out = {"jobId": job.id, "status": job.status, "filename": job.filename, "fileId": job.file_id,
+           "rowsProcessed": job.rows_processed, "timings": json.loads(job.timings or "{}")}
+    if job.status == "done": out.update(json.loads(job.result or "{}"))
+    if job.status == "failed": out["error"] = job.error
+    return out
@@ -0,0 +1,108 @@
+import asyncio, io, multiprocessing, os, re, time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+PDF_WORKERS = int(os.getenv("INGEST_PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_TIMEOUT_S = float(os.getenv("INGEST_PDF_TIMEOUT_S", "120"))
+PAGES_PER_TASK = int(os.getenv("INGEST_PDF_PAGES_PER_TASK", "4"))
+
+PRICE_RX = re.compile(r"(\d+(?:\.\d{1,2})?)\s*$")
+
+class PdfTimeout(TimeoutError):
+    pass
+
+# ---------- worker side (must stay picklable / top-level) ----------
+
+def parse_lines(page_text: str, pageno: int) -> list[tuple[int, str, str, float]]:
+    """'Name - description 12.50' lines -> (pageno, name, desc, price)."""
+    out = []
+    for raw in page_text.split("\n"):
+        line = raw.strip()
+        m = PRICE_RX.search(line)
+        if not m: continue
+        price = float(m.group(1))
+        left = line[:m.start()].strip()
+        parts = [p.strip() for p in left.split(" - ", 1)]
+        name = parts[0] if parts else ""
+        desc = parts[1] if len(parts) > 1 else ""
+        if not name: continue
+        out.append((pageno, name, desc, price))
+    return out
+
+def count_pages(content: bytes) -> int:
+    import pdfplumber
+    with pdfplumber.open(io.BytesIO(content)) as pdf:
+        return len(pdf.pages)
+
+def extract_range(content: bytes, start: int, stop: int, deadline: float | None = None) -> list[tuple[int, str, str, float]]:
+    """deadline: time.time() after which no further page is started (the caller has given up)."""
+    import pdfplumber
+    rows = []
+    with pdfplumber.open(io.BytesIO(content)) as pdf:
+        for pageno in range(start, min(stop, len(pdf.pages))):
+            if deadline is not None and time.time() > deadline:
+                raise PdfTimeout(f"PDF parsing passed its deadline at page {pageno + 1}")
+            rows += parse_lines(pdf.pages[pageno].extract_text() or "", pageno)
+    return rows
+
+# ---------- caller side ----------
+
+_pool: ProcessPoolExecutor | None = None
+
+def get_pool() -> ProcessPoolExecutor | None:
+    """Process pool for page extraction; None when INGEST_PDF_WORKERS=0 (threads only)."""
+    global _pool
+    if _pool is None and PDF_WORKERS > 0:
+        # spawn: forking a threaded uvicorn worker is not safe
+        _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown_pool(terminate: bool = False):
+    """terminate: also kill workers mid-task (shutdown alone lets running tasks finish)."""
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        procs = list((getattr(pool, "_processes", None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        if terminate:
+            for proc in procs: proc.terminate()
+
+def _to_rows(parts: list[list[tuple]]) -> list[dict]:
+    rows = []
+    for part in parts:
+        for pageno, name, desc, price in part:
+            rows.append({"row_index": len(rows), "item_name": name, "description": desc, "price": price,
+                         "parsing_meta": f'{{"page":{pageno+1}}}'})
+    return rows
+
+async def parse_pdf(content: bytes, timeout: float | None = None) -> tuple[list[dict], int]:
+    """
+    Extract menu rows from a PDF off the event loop: pages are split into ranges parsed in
+    parallel by the pool and merged back in page order. Returns (rows, page_count).
+    The timeout bounds CPU too: workers stop at the next page past the deadline, and on timeout
+    the pool is terminated (a single pathological page can't hold a worker) and recreated on next use.
+    """
+    loop = asyncio.get_running_loop()
+    limit = timeout or PDF_TIMEOUT_S
+    deadline = time.time() + limit
+    async def _run(pool):
+        pages = await loop.run_in_executor(pool, count_pages, content)
+        ranges = [(s, s + PAGES_PER_TASK) for s in range(0, pages, PAGES_PER_TASK)]
+        parts = await asyncio.gather(*(loop.run_in_executor(pool, extract_range, content, s, e, deadline)
+                                       for s, e in ranges))
+        return _to_rows(parts), pages
+    for attempt in (0, 1):
+        pool = get_pool()
+        try:
+            return await asyncio.wait_for(_run(pool), max(deadline - time.time(), 1e-6))
+        except (asyncio.TimeoutError, PdfTimeout):
+            if pool is not None and pool is _pool: shutdown_pool(terminate=True)
+            raise PdfTimeout(f"PDF parsing exceeded {limit:.0f}s")
+        except BrokenProcessPool:
+            # another parse timed out and recycled the pool under this one (or a worker died): retry once
+            if pool is _pool: shutdown_pool(terminate=True)
+            if attempt or time.time() > deadline: raise PdfTimeout(f"PDF parsing exceeded {limit:.0f}s")
+
+def parse_pdf_sync(content: bytes, timeout: float | None = None) -> tuple[list[dict], int]:
+    """Blocking variant for background job threads (no running event loop there)."""
+    return asyncio.run(parse_pdf(content, timeout))
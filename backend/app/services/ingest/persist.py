@@ -0,0 +1,73 @@
+import hashlib
+from sqlalchemy import text
+from ..allergen_registry import ALLERGENS
+from ..tagger_versions import version_id
+
+BATCH = 1000
+
+_UPSERT_ROW = text("""
+    INSERT INTO parsed_rows (file_id, row_index, item_name, description, price, parsing_meta, content_hash, tagger_version)
+    VALUES (:fid, :idx, :name, :desc, :price, :meta, :h, :mv)
+    ON CONFLICT (file_id, row_index) DO UPDATE
+    SET item_name=EXCLUDED.item_name, description=EXCLUDED.description, price=EXCLUDED.price,
+        content_hash=EXCLUDED.content_hash, tagger_version=EXCLUDED.tagger_version
+""")
+
+# predictions left over from an older tagger would otherwise be carried into menu_allergens on commit
+_DROP_STALE = text("""
+    DELETE FROM allergen_predictions
+    WHERE parsed_row_id IN (SELECT id FROM parsed_rows WHERE file_id = :fid AND row_index BETWEEN :lo AND :hi)
+      AND version_id <> :vid
+""")
+
+_UPSERT_PRED = text("""
+    INSERT INTO allergen_predictions (parsed_row_id, menu_item_id, allergen_id, score, status, version_id)
+    VALUES (:pr, NULL, :aid, :sc, :st, :vid)
+    ON CONFLICT (parsed_row_id, allergen_id) DO UPDATE
+    SET score=EXCLUDED.score, status=EXCLUDED.status, version_id=EXCLUDED.version_id
+""")
+
+def content_hash(name, description, price) -> str:
+    """Identity of a menu entry's visible content; parsed_rows and menu_items share it for diffing."""
+    key = f"{(name or '').strip()}\x1f{(description or '').strip()}\x1f{float(price or 0):.2f}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def _batches(items: list, size: int = BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def persist_rows(db, file_id: int, rows: list[dict], tagged: list, drop_stale: bool = False):
+    """
+    Bulk-upsert parsed rows and their predictions for one file.
+    rows: dicts with row_index, item_name, description, price, parsing_meta; tagged: tag_texts output.
+    Idempotent on (file_id, row_index) and (parsed_row_id, allergen_id). drop_stale: the file was
+    tagged before by another tagger version, remove those predictions for these rows.
+    """
+    if not rows: return
+    mv = tagged[0][2]["model_version"] if tagged else ""
+    for chunk in _batches(rows):
+        db.execute(_UPSERT_ROW, [{"fid": file_id, "idx": r["row_index"], "name": r["item_name"],
+                                  "desc": r["description"], "price": r["price"],
+                                  "meta": r.get("parsing_meta", ""),
+                                  "h": content_hash(r["item_name"], r["description"], r["price"]), "mv": mv}
+                                 for r in chunk])
+
+    lo, hi = rows[0]["row_index"], rows[-1]["row_index"]
+    ids = dict(db.execute(text(
+        "SELECT row_index, id FROM parsed_rows WHERE file_id = :fid AND row_index BETWEEN :lo AND :hi"
+    ), {"fid": file_id, "lo": lo, "hi": hi}).all())
+
+    meta = tagged[0][2] if tagged else None
+    vid = version_id(db, meta["rules_version"], meta["model_version"]) if meta else None
+    if drop_stale and meta:
+        db.execute(_DROP_STALE, {"fid": file_id, "lo": lo, "hi": hi, "vid": vid})
+
+    preds = []
+    for r, (accepted, weak, _) in zip(rows, tagged):
+        for status, pairs in (("auto", accepted), ("weak", weak)):
+            for allergen_name, score in pairs:
+                aid = ALLERGENS.id_for(allergen_name, db)
+                if aid is None: continue
+                preds.append({"pr": ids[r["row_index"]], "aid": aid, "sc": float(score), "st": status, "vid": vid})
+    for chunk in _batches(preds):
+        db.execute(_UPSERT_PRED, chunk)
@@ -0,0 +1,115 @@
+import json, time
+from datetime import datetime
+from contextlib import contextmanager
+from sqlalchemy import text
+from ...models import FileUpload, ParsedRow
+from ..allergen_registry import ALLERGENS
+from ..tagger_versions import version_id
+from ..tagging import pipeline as tagger
+from .parse import iter_csv_chunks
+from .persist import persist_rows
+
+class StageTimer:
+    """Accumulates wall time per pipeline stage (read, hash, parse, tag, persist, ...)."""
+
+    def __init__(self):
+        self.seconds: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - t0
+
+    def as_ms(self) -> dict[str, float]:
+        return {k: round(v * 1000, 1) for k, v in self.seconds.items()}
+
+def get_or_create_file(db, restaurant_id: int, filename: str, filetype: str, sha: str) -> FileUpload:
+    # idempotency: one FileUpload per identical file
+    fu = db.query(FileUpload).filter(FileUpload.sha256 == sha, FileUpload.restaurant_id == restaurant_id).first()
+    if not fu:
+        fu = FileUpload(restaurant_id=restaurant_id, filename=filename, filetype=filetype, sha256=sha,
+                        pages=1 if filetype == "csv" else 0)
+        db.add(fu); db.flush()
+    return fu
+
+def _tag_and_persist(db, fu, rows, timer, preview, preview_limit):
+    with timer.stage("tag"):
+        tagged = tagger.tag_texts([(r["item_name"], r["description"]) for r in rows], db=db)
+    with timer.stage("persist"):
+        persist_rows(db, fu.id, rows, tagged, drop_stale=bool(fu.rules_version) and not is_current(fu))
+    for r, (accepted, weak, _) in zip(rows, tagged):
+        if preview_limit is not None and len(preview) >= preview_limit: break
+        preview.append({"item_name": r["item_name"], "description": r["description"], "price": r["price"],
+                        "predicted_allergens": [a for a,_ in accepted+weak]})
+
+def run_csv(db, fu, fileobj, timer: StageTimer, preview_limit: int | None = None, on_chunk=None):
+    """
+    parse -> tag -> persist one chunk at a time. Returns (preview, issues, total_rows).
+    on_chunk(total_rows) runs after each chunk (background jobs commit + report progress there).
+    Raises parse.MissingColumns on a bad header.
+    """
+    preview, issues, total = [], [], 0
+    chunks = iter_csv_chunks(fileobj, issues)
+    while True:
+        with timer.stage("parse"):
+            rows = next(chunks, None)
+        if rows is None: break
+        _tag_and_persist(db, fu, rows, timer, preview, preview_limit)
+        total += len(rows)
+        if preview_limit is not None: del issues[preview_limit:]
+        if on_chunk: on_chunk(total)
+    return preview, issues, total
+
+def run_pdf_rows(db, fu, rows: list[dict], timer: StageTimer, preview_limit: int | None = None):
+    """Tag + persist rows already extracted by services.ingest.pdf. Returns (preview, issues)."""
+    preview, issues = [], []
+    _tag_and_persist(db, fu, rows, timer, preview, preview_limit)
+    if not preview:
+        issues.append("Could not auto-detect items. Prefer CSV or provide text-based PDF.")
+    return preview, issues
+
+# ---------- re-upload short-circuit ----------
+
+def is_current(fu: FileUpload) -> bool:
+    return bool(fu.rules_version) and fu.rules_version == tagger.RULES_VER and fu.model_version == tagger.MODEL_VERSION
+
+def mark_tagged(fu: FileUpload, issues: list):
+    fu.rules_version, fu.model_version, fu.issues = tagger.RULES_VER, tagger.MODEL_VERSION, json.dumps(issues)
+    fu.compacted_at, fu.used_at = None, datetime.utcnow()
+
+def cached_preview(db, fu: FileUpload, preview_limit: int | None = None):
+    """
+    Preview of an identical earlier upload rebuilt from parsed_rows + allergen_predictions,
+    without re-parsing or re-tagging. None unless its predictions are from the current tagger.
+    Marks the file used; the caller commits.
+    Returns (preview, issues, total_rows).
+    """
+    tagger.maybe_reload()
+    if not is_current(fu): return None
+    fu.used_at = datetime.utcnow()  # served again: keeps its predictions out of retention
+    total = db.query(ParsedRow).filter(ParsedRow.file_id == fu.id).count()
+    q = db.query(ParsedRow).filter(ParsedRow.file_id == fu.id).order_by(ParsedRow.row_index)
+    rows = (q.limit(preview_limit) if preview_limit is not None else q).all()
+    preds = {}
+    if rows:
+        res = db.execute(text("""
+            SELECT ap.parsed_row_id, ap.allergen_id, ap.status FROM allergen_predictions ap
+            JOIN parsed_rows pr ON pr.id = ap.parsed_row_id
+            WHERE pr.file_id = :fid AND pr.row_index BETWEEN :lo AND :hi
+              AND ap.status IN ('auto','weak') AND ap.version_id = :vid
+        """), {"fid": fu.id, "lo": rows[0].row_index, "hi": rows[-1].row_index,
+                                  "vid": version_id(db, tagger.RULES_VER, tagger.MODEL_VERSION)})
+        for row_id, aid, status in res:
+            name = ALLERGENS.name_for(aid, db)
+            if name: preds.setdefault(row_id, []).append((status, name))
+    # same order tag_text produces: accepted then weak, each in rules order
+    order = {a: i for i, a in enumerate(tagger.RULES)}
+    preview = [{"item_name": pr.item_name, "description": pr.description, "price": float(pr.price or 0),
+                "predicted_allergens": [n for _, n in sorted(preds.get(pr.id, []),
+                                                             key=lambda p: (p[0] != "auto", order.get(p[1], len(order))))]}
+               for pr in rows]
+    issues = json.loads(fu.issues or "[]")
+    return preview, issues[:preview_limit] if preview_limit is not None else issues, total
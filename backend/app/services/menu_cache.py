@@ -0,0 +1,32 @@
+import hashlib, json, os
+from sqlalchemy import text
+from .lru import LRUCache
+
+MENU_CACHE_SIZE = int(os.getenv("MENU_CACHE_SIZE", "2000"))
+
+# restaurant_id 0 is the all-restaurants listing; every bump moves it too
+ALL = 0
+
+MENU_CACHE = LRUCache(MENU_CACHE_SIZE)
+
+def bump(db, restaurant_id: int):
+    """Invalidate cached listings that can include this restaurant's items (call in the writing transaction)."""
+    db.execute(text("""
+        INSERT INTO menu_versions (restaurant_id, version) VALUES (:rid, 1), (:all, 1)
+        ON CONFLICT (restaurant_id) DO UPDATE SET version = menu_versions.version + 1
+    """), {"rid": restaurant_id, "all": ALL})
+
+def version(db, restaurant_id: int | None) -> int:
+    return db.execute(text("SELECT version FROM menu_versions WHERE restaurant_id = :rid"),
+                      {"rid": restaurant_id or ALL}).scalar() or 0
+
+def etag(key: tuple, ver: int) -> str:
+    # derived from the request key and menu version, so a 304 needs no query or serialization
+    return 'W/"' + hashlib.sha1(json.dumps([key, ver]).encode()).hexdigest()[:20] + '"'
+
+def etag_matches(if_none_match: str | None, tag: str) -> bool:
+    if not if_none_match: return False
+    return if_none_match.strip() == "*" or tag in [t.strip() for t in if_none_match.split(",")]
+
+def stats() -> dict:
+    return MENU_CACHE.stats()
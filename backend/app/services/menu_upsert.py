@@ -0,0 +1,116 @@
+import os
+from sqlalchemy import insert, text, bindparam
+from ..models import MenuItem
+from . import menu_cache
+from .allergen_mask import recompute_sql
+from .allergen_registry import ALLERGENS
+from .ingest.persist import content_hash, _batches
+from .tagger_versions import version_id
+from .tagging import pipeline as tagger
+
+MENU_BATCH_MAX = int(os.getenv("MENU_BATCH_MAX", "1000"))
+
+class BatchInvalid(ValueError):
+    def __init__(self, errors: list[dict]):
+        super().__init__(f"{len(errors)} invalid items")
+        self.errors = errors
+
+def _in(sql: str) -> text:
+    return text(sql).bindparams(bindparam("ids", expanding=True))
+
+_UPDATE = text("""
+    UPDATE menu_items SET item_name = :name, description = :desc, price = :price, content_hash = :h, tagger_version = :tv
+    WHERE id = :id
+""")
+_LINK = text("INSERT INTO menu_allergens (menu_id, allergen_id) VALUES (:m, :a) ON CONFLICT (menu_id, allergen_id) DO NOTHING")
+_AUDIT = text("""
+    INSERT INTO allergen_predictions (parsed_row_id, menu_item_id, allergen_id, score, status, version_id)
+    VALUES (NULL, :m, :a, :sc, :st, :vid)
+    ON CONFLICT (menu_item_id, allergen_id) DO UPDATE
+    SET score=EXCLUDED.score, status=EXCLUDED.status, version_id=EXCLUDED.version_id
+""")
+
+def validate(items) -> list[dict]:
+    """Normalized rows for MenuItemUpsert payloads; raises BatchInvalid listing every bad item."""
+    rows, errors, seen = [], [], {}
+    for i, it in enumerate(items):
+        name, ext = (it.item_name or "").strip(), (it.externalId or "").strip() or None
+        if not name: errors.append({"index": i, "error": "item_name is required"})
+        if it.price is None or it.price < 0: errors.append({"index": i, "error": "price must be >= 0"})
+        if ext is not None and ext in seen:
+            errors.append({"index": i, "error": f"externalId {ext!r} repeats item {seen[ext]}"})
+        if ext is not None: seen.setdefault(ext, i)
+        rows.append({"name": name, "desc": (it.description or "").strip(), "price": round(float(it.price or 0), 2), "ext": ext})
+    if errors: raise BatchInvalid(errors)
+    return rows
+
+def upsert_items(db, restaurant_id: int, rows: list[dict]) -> list[dict]:
+    """
+    Create or update a restaurant's items in one pass: one tag_texts call for the rows being written,
+    then bulk statements for items, menu_allergens, audit predictions and masks. Rows with an
+    externalId update the item that carries it (left alone if name/description/price are unchanged),
+    others are always created.
+    The caller commits. Returns one {index, id, externalId, status, allergens} per row.
+    """
+    exts = [r["ext"] for r in rows if r["ext"] is not None]
+    existing = {}
+    for chunk in _batches(exts):
+        existing.update({e: (i, h) for i, e, h in db.execute(_in(
+            "SELECT id, external_id, content_hash FROM menu_items WHERE restaurant_id = :rid AND external_id IN :ids"),
+            {"rid": restaurant_id, "ids": chunk})})
+
+    results, new, changed = [], [], []
+    for i, r in enumerate(rows):
+        r["h"] = content_hash(r["name"], r["desc"], r["price"])
+        old = existing.get(r["ext"])
+        status = "created" if old is None else ("unchanged" if old[1] == r["h"] else "updated")
+        results.append({"index": i, "id": old[0] if old else None, "externalId": r["ext"], "status": status, "allergens": []})
+        if status == "created": new.append(i)
+        elif status == "updated": changed.append(i)
+    written = new + changed
+
+    # unchanged items keep (and report) what they are tagged with now
+    same = {results[i]["id"]: i for i in range(len(rows)) if results[i]["status"] == "unchanged"}
+    for chunk in _batches(list(same)):
+        for mid, aid in db.execute(_in("SELECT menu_id, allergen_id FROM menu_allergens WHERE menu_id IN :ids "
+                                       "ORDER BY menu_id, allergen_id"), {"ids": chunk}):
+            name = ALLERGENS.name_for(aid, db)
+            if name: results[same[mid]]["allergens"].append(name)
+    if not written: return results
+
+    tagged = tagger.tag_texts([(rows[i]["name"], rows[i]["desc"]) for i in written], db=db)
+    meta = tagged[0][2]
+    if new:
+        # RETURNING order isn't guaranteed (and asking for it costs a statement per row on SQLite): match the
+        # ids back by (content, externalId); rows equal in both are interchangeable
+        t = MenuItem.__table__
+        pending = {}
+        for i in new: pending.setdefault((rows[i]["h"], rows[i]["ext"]), []).append(i)
+        for mid, h, ext in db.execute(insert(t).returning(t.c.id, t.c.content_hash, t.c.external_id), [
+                {"restaurant_id": restaurant_id, "item_name": rows[i]["name"], "description": rows[i]["desc"],
+                 "price": rows[i]["price"], "content_hash": rows[i]["h"], "external_id": rows[i]["ext"],
+                 "allergen_mask": 0, "tagger_version": meta["model_version"]} for i in new]):
+            results[pending[(h, ext)].pop(0)]["id"] = mid
+    if changed:
+        db.execute(_UPDATE, [{"id": results[i]["id"], "name": rows[i]["name"], "desc": rows[i]["desc"],
+                              "price": rows[i]["price"], "h": rows[i]["h"], "tv": meta["model_version"]} for i in changed])
+        for chunk in _batches([results[i]["id"] for i in changed]):
+            db.execute(_in("DELETE FROM menu_allergens WHERE menu_id IN :ids"), {"ids": chunk})
+            db.execute(_in("DELETE FROM allergen_predictions WHERE menu_item_id IN :ids"), {"ids": chunk})
+
+    vid = version_id(db, meta["rules_version"], meta["model_version"])
+    links, preds = [], []
+    for i, (accepted, weak, _) in zip(written, tagged):
+        for st, pairs in (("auto", accepted), ("weak", weak)):
+            for name, score in pairs:
+                aid = ALLERGENS.id_for(name, db)
+                if aid is None: continue  # not in the allergens table: nothing linked, nothing reported
+                results[i]["allergens"].append(name)
+                links.append({"m": results[i]["id"], "a": aid})
+                preds.append({"m": results[i]["id"], "a": aid, "sc": float(score), "st": st, "vid": vid})
+    for chunk in _batches(links): db.execute(_LINK, chunk)
+    for chunk in _batches(preds): db.execute(_AUDIT, chunk)
+    for chunk in _batches(sorted(results[i]["id"] for i in written)):
+        db.execute(_in(recompute_sql("id IN :ids")), {"ids": chunk})
+    menu_cache.bump(db, restaurant_id)
+    return results
@@ -0,0 +1,174 @@
+import bisect, os, threading, time
+
+# In-process request and pipeline metrics, rendered in the Prometheus text format at /api/metrics.
+# Everything is a dict update under a lock (no per-request allocations beyond the label tuple), so it
+# stays on in production. Each worker process keeps its own numbers; scrape every worker, or sum them.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names: return ""
+    esc = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, esc)) + "}"
+
+def _num(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labelnames = name, help, labels
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            out += self._samples()
+        return out
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, labels: tuple = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in self._values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, labels: tuple = (), value: float = 0.0):
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, labels: tuple, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            h = self._values.get(labels)
+            if h is None:
+                h = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            h[0][i] += 1
+            h[1] += value
+
+    def _samples(self):
+        out = []
+        for k, (counts, total) in self._values.items():
+            running = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                running += c
+                le_s = "+Inf" if le == float("inf") else _num(le)
+                out.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), k + (le_s,))} {running}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {_num(round(total, 6))}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {running}")
+        return out
+
+# ---------- metrics ----------
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served.")
+INGEST_STAGE = Histogram("ingest_stage_duration_seconds", "Ingest time per pipeline stage.",
+                         ("filetype", "step", "stage"), STAGE_BUCKETS)
+INGEST_ROWS = Counter("ingest_rows_total", "Rows processed by ingest (parse+tag+persist) and commit.", ("filetype", "step"))
+INGEST_SECONDS = Counter("ingest_seconds_total", "Wall time spent on those rows; rate(rows)/rate(seconds) is rows/s.",
+                         ("filetype", "step"))
+INGEST_RATE = Gauge("ingest_rows_per_second", "Throughput of the most recent ingest or commit.", ("filetype", "step"))
+
+_REGISTRY = [REQUESTS, LATENCY, IN_FLIGHT, INGEST_STAGE, INGEST_ROWS, INGEST_SECONDS, INGEST_RATE]
+
+def observe_ingest(filetype: str, step: str, timer, rows: int):
+    """Record a StageTimer's stages and the rows it covered (step: 'ingest' or 'commit')."""
+    if not METRICS_ENABLED: return
+    for stage, secs in timer.seconds.items():
+        INGEST_STAGE.observe((filetype, step, stage), secs)
+    total = sum(timer.seconds.values())
+    if rows:
+        INGEST_ROWS.inc((filetype, step), rows)
+        INGEST_SECONDS.inc((filetype, step), total)
+        if total > 0: INGEST_RATE.set((filetype, step), round(rows / total, 1))
+
+def _cache_lines() -> list[str]:
+    # the caches keep their own counters; read them at scrape time
+    from .tagging.cache import TAG_CACHE
+    from . import menu_cache, user_allergens
+    tag = TAG_CACHE.stats()
+    caches = {"tagger_lru": tag["lru"], "menu": menu_cache.stats(), "user_allergens": user_allergens.stats()}
+    out = []
+    for name, kind, help, get in (
+        ("cache_hits_total", "counter", "In-process cache hits.", lambda s: s["hits"]),
+        ("cache_misses_total", "counter", "In-process cache misses.", lambda s: s["misses"]),
+        ("cache_evictions_total", "counter", "In-process cache evictions.", lambda s: s["evictions"]),
+        ("cache_entries", "gauge", "Entries held by the in-process cache.", lambda s: s["size"]),
+        ("cache_hit_ratio", "gauge", "Lifetime hit ratio of the in-process cache.", lambda s: s["hit_rate"]),
+    ):
+        out += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+        out += [f'{name}{{cache="{c}"}} {_num(get(s))}' for c, s in caches.items()]
+    out += ["# HELP tagger_cache_db_hits_total Tag-cache lookups answered by the tag_cache table after an LRU miss.",
+            "# TYPE tagger_cache_db_hits_total counter", f"tagger_cache_db_hits_total {tag['db_hits']}",
+            "# HELP tagger_cache_db_misses_total Tag-cache lookups that had to score the text.",
+            "# TYPE tagger_cache_db_misses_total counter", f"tagger_cache_db_misses_total {tag['db_misses']}",
+            "# HELP tagger_cache_hit_ratio Share of tagger lookups served from either cache tier.",
+            "# TYPE tagger_cache_hit_ratio gauge", f"tagger_cache_hit_ratio {_num(tag['hit_rate'])}"]
+    return out
+
+def render() -> str:
+    lines = []
+    for m in _REGISTRY: lines += m.render()
+    return "\n".join(lines + _cache_lines()) + "\n"
+
+# ---------- ASGI middleware ----------
+
+_paths: dict = {}
+
+def route_label(scope) -> str:
+    """Path template of the route that served the request (set once routing ran), 'unmatched' otherwise."""
+    global _paths
+    endpoint = scope.get("endpoint")
+    if endpoint is None: return "unmatched"
+    path = _paths.get(endpoint)
+    if path is None:
+        _paths = {getattr(r, "endpoint", None): r.path for r in scope["app"].routes}
+        path = _paths.get(endpoint, "unmatched")
+    return path
+
+class MetricsMiddleware:
+    """
+    Per-route request count, latency histogram and in-flight gauge. Plain ASGI (no BaseHTTPMiddleware
+    task/stream overhead); routes are labelled by their path template, unmatched paths as one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        status = [500]
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start": status[0] = message["status"]
+            await send(message)
+        IN_FLIGHT.inc((), 1)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            IN_FLIGHT.inc((), -1)
+            method, route = scope["method"], route_label(scope)
+            REQUESTS.inc((method, route, str(status[0])))
+            LATENCY.observe((method, route), elapsed)
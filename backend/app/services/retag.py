@@ -0,0 +1,192 @@
+import logging, os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import text, bindparam
+from ..db import SessionLocal
+from ..models import RetagRun
+from . import menu_cache
+from .allergen_mask import recompute_sql
+from .allergen_registry import ALLERGENS
+from .tagger_versions import version_id
+from .tagging import pipeline as tagger
+from .tagging.cache import TAG_CACHE
+
+RETAG_BATCH = int(os.getenv("RETAG_BATCH", "500"))
+RETAG_STALE_S = int(os.getenv("RETAG_STALE_S", "600"))
+PHASES = ("parsed_rows", "menu_items", "done")
+
+log = logging.getLogger(__name__)
+_pool: ThreadPoolExecutor | None = None
+
+class RetagBusy(RuntimeError):
+    pass
+
+def _in(sql: str, *names: str) -> text:
+    return text(sql).bindparams(*(bindparam(n, expanding=True) for n in names))
+
+# rows of compacted files (services.retention) have no predictions left to bring up to date
+_ROWS = text("""
+    SELECT id, item_name, description FROM parsed_rows
+    WHERE id > :last AND tagger_version <> :mv
+      AND file_id NOT IN (SELECT id FROM files WHERE compacted_at IS NOT NULL)
+    ORDER BY id LIMIT :n
+""")
+# items never tagged (created by hand, no audit predictions) are left alone
+_ITEMS = text("""
+    SELECT id, restaurant_id, item_name, description FROM menu_items
+    WHERE id > :last AND tagger_version <> :mv
+      AND (tagger_version <> '' OR EXISTS (SELECT 1 FROM allergen_predictions ap WHERE ap.menu_item_id = menu_items.id))
+    ORDER BY id LIMIT :n
+""")
+
+_UPSERT_ROW_PRED = text("""
+    INSERT INTO allergen_predictions (parsed_row_id, menu_item_id, allergen_id, score, status, version_id)
+    VALUES (:owner, NULL, :aid, :sc, :st, :vid)
+    ON CONFLICT (parsed_row_id, allergen_id) DO UPDATE
+    SET score=EXCLUDED.score, status=EXCLUDED.status, version_id=EXCLUDED.version_id
+""")
+_UPSERT_ITEM_PRED = text("""
+    INSERT INTO allergen_predictions (parsed_row_id, menu_item_id, allergen_id, score, status, version_id)
+    VALUES (NULL, :owner, :aid, :sc, :st, :vid)
+    ON CONFLICT (menu_item_id, allergen_id) DO UPDATE
+    SET score=EXCLUDED.score, status=EXCLUDED.status, version_id=EXCLUDED.version_id
+""")
+
+def _desired(db, ids: list[int], tagged: list) -> dict[tuple[int, int], tuple[str, float]]:
+    out = {}
+    for owner, (accepted, weak, _) in zip(ids, tagged):
+        for status, pairs in (("auto", accepted), ("weak", weak)):
+            for name, score in pairs:
+                aid = ALLERGENS.id_for(name, db)
+                if aid is not None: out[(owner, aid)] = (status, round(float(score), 4))
+    return out
+
+def _sync_predictions(db, col: str, upsert, ids: list[int], desired: dict, st) -> set[int]:
+    """Write only the auto/weak predictions that differ; restamp the rest. Returns owners that changed."""
+    existing = {(o, a): (s, round(float(sc), 4)) for o, a, s, sc in db.execute(_in(
+        f"SELECT {col}, allergen_id, status, score FROM allergen_predictions "
+        f"WHERE {col} IN :ids AND status IN ('auto','weak')", "ids"), {"ids": ids})}
+    vid = version_id(db, st.rules_version, st.model_version)
+    ups = [{"owner": o, "aid": a, "st": s, "sc": sc, "vid": vid}
+           for (o, a), (s, sc) in desired.items() if existing.get((o, a)) != (s, sc)]
+    dels = [{"owner": o, "aid": a} for (o, a) in existing if (o, a) not in desired]
+    if ups: db.execute(upsert, ups)
+    if dels: db.execute(text(f"DELETE FROM allergen_predictions WHERE {col} = :owner AND allergen_id = :aid"), dels)
+    db.execute(_in(f"UPDATE allergen_predictions SET version_id = :vid WHERE {col} IN :ids AND version_id <> :vid", "ids"),
+               {"ids": ids, "vid": vid})
+    return {u["owner"] for u in ups} | {d["owner"] for d in dels}
+
+def _rows_batch(db, run: RetagRun, st, batch: int) -> int:
+    rows = db.execute(_ROWS, {"last": run.last_id, "mv": st.model_version, "n": batch}).all()
+    if not rows: return 0
+    ids = [r.id for r in rows]
+    tagged = tagger.tag_texts([(r.item_name, r.description) for r in rows], db=db, state=st)
+    changed = _sync_predictions(db, "parsed_row_id", _UPSERT_ROW_PRED, ids, _desired(db, ids, tagged), st)
+    db.execute(_in("UPDATE parsed_rows SET tagger_version = :mv WHERE id IN :ids", "ids"), {"ids": ids, "mv": st.model_version})
+    run.last_id, run.rows_scanned, run.rows_changed = ids[-1], run.rows_scanned + len(ids), run.rows_changed + len(changed)
+    return len(ids)
+
+def _items_batch(db, run: RetagRun, st, batch: int) -> int:
+    items = db.execute(_ITEMS, {"last": run.last_id, "mv": st.model_version, "n": batch}).all()
+    if not items: return 0
+    ids = [i.id for i in items]
+    tagged = tagger.tag_texts([(i.item_name, i.description) for i in items], db=db, state=st)
+    desired = _desired(db, ids, tagged)
+    changed = _sync_predictions(db, "menu_item_id", _UPSERT_ITEM_PRED, ids, desired, st)
+
+    links = set(map(tuple, db.execute(_in("SELECT menu_id, allergen_id FROM menu_allergens WHERE menu_id IN :ids", "ids"),
+                                      {"ids": ids}).all()))
+    add = [{"m": m, "a": a} for (m, a) in desired if (m, a) not in links]
+    drop = [{"m": m, "a": a} for (m, a) in links if (m, a) not in desired]
+    if add: db.execute(text("INSERT INTO menu_allergens (menu_id, allergen_id) VALUES (:m, :a) "
+                            "ON CONFLICT (menu_id, allergen_id) DO NOTHING"), add)
+    if drop: db.execute(text("DELETE FROM menu_allergens WHERE menu_id = :m AND allergen_id = :a"), drop)
+    relinked = sorted({x["m"] for x in add + drop})
+    if relinked:
+        db.execute(_in(recompute_sql("id IN :ids"), "ids"), {"ids": relinked})
+        for rid in sorted({i.restaurant_id for i in items if i.id in set(relinked)}):
+            menu_cache.bump(db, rid)
+    db.execute(_in("UPDATE menu_items SET tagger_version = :mv WHERE id IN :ids", "ids"), {"ids": ids, "mv": st.model_version})
+    run.last_id, run.rows_scanned = ids[-1], run.rows_scanned + len(ids)
+    run.rows_changed += len(changed | set(relinked))
+    return len(ids)
+
+def _stamp_files(db, st):
+    # files whose rows are all current again can serve identical re-uploads from storage
+    db.execute(text("""
+        UPDATE files SET rules_version = :rv, model_version = :mv
+        WHERE rules_version <> '' AND model_version <> :mv
+          AND NOT EXISTS (SELECT 1 FROM parsed_rows pr WHERE pr.file_id = files.id AND pr.tagger_version <> :mv)
+    """), {"rv": st.rules_version, "mv": st.model_version})
+
+def start_or_resume(db, st, force: bool = False) -> RetagRun:
+    """The unfinished run for this tagger version (resumed from its checkpoint) or a new one."""
+    run = (db.query(RetagRun).filter(RetagRun.model_version == st.model_version, RetagRun.status != "done")
+           .order_by(RetagRun.id.desc()).first())
+    stale = datetime.utcnow() - timedelta(seconds=RETAG_STALE_S)
+    if run and run.status == "running" and run.updated_at and run.updated_at > stale and not force:
+        raise RetagBusy(f"re-tag run {run.id} is already in progress")
+    if run is None:
+        run = RetagRun(model_version=st.model_version, phase="parsed_rows", last_id=0)
+        db.add(run)
+    run.status, run.error = "running", ""
+    db.commit()
+    return run
+
+def retag(db, batch: int | None = None, max_batches: int | None = None, force: bool = False, on_batch=None) -> RetagRun:
+    """
+    Bring parsed_rows and tagged menu_items to the current tagger version in keyset batches, one
+    transaction per batch with the checkpoint in the same commit. Resumable after a crash; stops
+    early (status paused) after max_batches.
+    """
+    tagger.maybe_reload()
+    st = tagger.current()
+    run = start_or_resume(db, st, force)
+    try:
+        done = 0
+        while run.phase != "done" and (max_batches is None or done < max_batches):
+            step = _rows_batch if run.phase == "parsed_rows" else _items_batch
+            if step(db, run, st, batch or RETAG_BATCH) == 0:
+                if run.phase == "parsed_rows": _stamp_files(db, st)
+                run.phase, run.last_id = PHASES[PHASES.index(run.phase) + 1], 0
+            else:
+                done += 1
+            if run.phase == "done":
+                run.status = "done"
+                # everything stored is on this version now; scores cached under older ones are dead weight
+                TAG_CACHE.purge(db, st.rules_version, st.synonyms_version)
+            db.commit()
+            if on_batch: on_batch(run)
+        if run.phase != "done":
+            run.status = "paused"
+            db.commit()
+    except Exception as e:
+        db.rollback()
+        log.exception("re-tag run %s failed", run.id)
+        run.status, run.error = "failed", str(e) or type(e).__name__
+        db.commit()
+    return run
+
+def _run_background(force: bool):
+    with SessionLocal() as db:
+        try:
+            retag(db, force=force)
+        except RetagBusy:
+            pass
+
+def submit(force: bool = False):
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retag")
+    _pool.submit(_run_background, force)
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def run_out(run: RetagRun | None) -> dict:
+    if run is None: return {"status": "idle", "modelVersion": tagger.MODEL_VERSION}
+    return {"runId": run.id, "modelVersion": run.model_version, "status": run.status, "phase": run.phase,
+            "rowsScanned": run.rows_scanned, "rowsChanged": run.rows_changed, "error": run.error or None}
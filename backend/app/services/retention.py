@@ -0,0 +1,87 @@
+import logging, os
+from datetime import datetime, timedelta
+from sqlalchemy import text, bindparam
+from sqlalchemy.exc import DBAPIError
+
+# Parsed-row predictions are only needed to preview and commit a file. Once a file was last tagged,
+# previewed or committed more than PREDICTION_RETENTION_DAYS ago they are dropped; menu items keep
+# their own copy.
+PREDICTION_RETENTION_DAYS = float(os.getenv("PREDICTION_RETENTION_DAYS", "30"))
+RETENTION_BATCH_FILES = int(os.getenv("RETENTION_BATCH_FILES", "50"))
+
+log = logging.getLogger(__name__)
+
+_CANDIDATES = text("""
+    SELECT f.id FROM files f
+    WHERE f.compacted_at IS NULL AND COALESCE(f.used_at, f.committed_at, f.created_at) < :cutoff AND f.id > :last
+      AND NOT EXISTS (SELECT 1 FROM ingest_jobs j WHERE j.file_id = f.id AND j.status IN ('queued','running'))
+    ORDER BY f.id LIMIT :n
+""")
+_ROW_PREDS = "SELECT id FROM parsed_rows WHERE file_id IN :ids"
+_COUNT = text(f"SELECT COUNT(*) FROM allergen_predictions WHERE parsed_row_id IN ({_ROW_PREDS})").bindparams(
+    bindparam("ids", expanding=True))
+_DELETE = text(f"DELETE FROM allergen_predictions WHERE parsed_row_id IN ({_ROW_PREDS})").bindparams(
+    bindparam("ids", expanding=True))
+# a compacted file no longer counts as tagged: an identical re-upload parses and tags it again
+_MARK = text("""
+    UPDATE files SET compacted_at = :now, rules_version = '', model_version = '' WHERE id IN :ids
+""").bindparams(bindparam("ids", expanding=True))
+
+def prediction_storage(bind) -> dict[str, int]:
+    """Bytes used by allergen_predictions and each of its indexes ({} where the database can't say)."""
+    try:
+        with bind.connect() as conn:
+            if bind.dialect.name == "sqlite":
+                rows = conn.execute(text("""
+                    SELECT s.name, SUM(d.pgsize) FROM dbstat d JOIN sqlite_schema s ON s.name = d.name
+                    WHERE s.tbl_name = 'allergen_predictions' GROUP BY s.name
+                """)).all()
+            elif bind.dialect.name == "postgresql":
+                rows = conn.execute(text("""
+                    SELECT c.relname, pg_relation_size(c.oid) FROM pg_class c
+                    WHERE c.oid = 'allergen_predictions'::regclass
+                       OR c.oid IN (SELECT indexrelid FROM pg_index WHERE indrelid = 'allergen_predictions'::regclass)
+                """)).all()
+            else:
+                return {}
+    except DBAPIError:  # SQLite built without the dbstat table
+        return {}
+    return {name: int(size or 0) for name, size in rows}
+
+def vacuum(bind):
+    """Hand freed pages back: SQLite rewrites the file, Postgres marks the space reusable."""
+    with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM" if bind.dialect.name == "sqlite" else "VACUUM ANALYZE allergen_predictions"))
+
+def compact(db, days: float | None = None, dry_run: bool = False, do_vacuum: bool = False, now: datetime | None = None) -> dict:
+    """
+    Drop the parsed-row predictions of files not tagged, previewed or committed in the last `days`
+    (files from before used_at fall back to committed_at / created_at), RETENTION_BATCH_FILES files
+    per transaction. Returns counts and the bytes
+    allergen_predictions + its indexes took before and after.
+    """
+    bind = db.get_bind()
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=PREDICTION_RETENTION_DAYS if days is None else days)
+    before = prediction_storage(bind)
+    files = predictions = last = 0
+    while True:
+        ids = db.execute(_CANDIDATES, {"cutoff": cutoff, "last": last, "n": RETENTION_BATCH_FILES}).scalars().all()
+        if not ids: break
+        last = ids[-1]
+        if dry_run:
+            predictions += db.execute(_COUNT, {"ids": ids}).scalar()
+        else:
+            predictions += db.execute(_DELETE, {"ids": ids}).rowcount
+            db.execute(_MARK, {"ids": ids, "now": now})
+            db.commit()
+        files += len(ids)
+    if do_vacuum and not dry_run:
+        db.close()
+        vacuum(bind)
+    after = prediction_storage(bind)
+    reclaimed = sum(before.values()) - sum(after.values())
+    if files and not dry_run:
+        log.info("retention: %d predictions of %d files dropped, %d bytes reclaimed", predictions, files, reclaimed)
+    return {"cutoff": cutoff, "files": files, "predictions": predictions, "dry_run": dry_run,
+            "before": before, "after": after, "reclaimed_bytes": reclaimed}
@@ -0,0 +1,79 @@
+import re
+from sqlalchemy import Float, cast, column, func, literal_column, table, text
+
+# Full-text index over menu_items (item_name, description), kept current by the database itself so
+# ORM writes and the raw-SQL ingest commit are both covered:
+#   SQLite:     external-content FTS5 table + triggers
+#   PostgreSQL: generated tsvector column + GIN index
+# Other backends fall back to ILIKE in list_menu_items.
+
+_SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS menu_items_fts USING fts5(
+           item_name, description, content='menu_items', content_rowid='id',
+           tokenize='unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS menu_items_fts_ai AFTER INSERT ON menu_items BEGIN
+           INSERT INTO menu_items_fts(rowid, item_name, description) VALUES (new.id, new.item_name, new.description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS menu_items_fts_ad AFTER DELETE ON menu_items BEGIN
+           INSERT INTO menu_items_fts(menu_items_fts, rowid, item_name, description)
+           VALUES ('delete', old.id, old.item_name, old.description);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS menu_items_fts_au AFTER UPDATE OF item_name, description ON menu_items BEGIN
+           INSERT INTO menu_items_fts(menu_items_fts, rowid, item_name, description)
+           VALUES ('delete', old.id, old.item_name, old.description);
+           INSERT INTO menu_items_fts(rowid, item_name, description) VALUES (new.id, new.item_name, new.description);
+       END""",
+]
+
+_PG_DDL = [
+    """ALTER TABLE menu_items ADD COLUMN IF NOT EXISTS search_vector tsvector
+           GENERATED ALWAYS AS (to_tsvector('simple', coalesce(item_name, '') || ' ' || coalesce(description, ''))) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_menu_items_search ON menu_items USING GIN (search_vector)",
+]
+
+_fts = table("menu_items_fts", column("rowid"), column("rank"))
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+def supported(dialect_name: str) -> bool:
+    return dialect_name in ("sqlite", "postgresql")
+
+def ensure_search(bind):
+    """Create the search index for this backend if missing; a new SQLite index is filled from menu_items."""
+    name = bind.dialect.name
+    if not supported(name): return
+    with bind.begin() as conn:
+        if name == "sqlite":
+            fresh = not conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'menu_items_fts'")).first()
+            for ddl in _SQLITE_DDL: conn.execute(text(ddl))
+            if fresh: _rebuild(conn, name)
+        else:
+            for ddl in _PG_DDL: conn.execute(text(ddl))
+
+def _rebuild(conn, name: str):
+    if name == "sqlite":
+        conn.execute(text("INSERT INTO menu_items_fts(menu_items_fts) VALUES ('rebuild')"))
+    else:
+        conn.execute(text("REINDEX INDEX ix_menu_items_search"))
+
+def rebuild(bind):
+    """Re-derive the whole index from menu_items (after bulk loads that bypassed the database, restores, ...)."""
+    ensure_search(bind)
+    if supported(bind.dialect.name):
+        with bind.begin() as conn: _rebuild(conn, bind.dialect.name)
+
+def terms(q: str) -> list[str]:
+    return _WORD.findall(q.lower())
+
+def apply(stmt, entity, dialect_name: str, words: list[str]):
+    """
+    Restrict `stmt` to items matching every word as a prefix. Returns (stmt, rank) where rank is a
+    column expression that sorts best matches first when ordered ascending.
+    """
+    if dialect_name == "sqlite":
+        query = " ".join('"' + w.replace('"', '""') + '"*' for w in words)
+        stmt = stmt.join(_fts, _fts.c.rowid == entity.id).where(literal_column("menu_items_fts").op("MATCH")(query))
+        return stmt, _fts.c.rank  # bm25: lower is better
+    tsq = func.to_tsquery("simple", " & ".join(w + ":*" for w in words))
+    vec = literal_column("menu_items.search_vector")
+    stmt = stmt.where(vec.op("@@")(tsq))
+    return stmt, -cast(func.ts_rank(vec, tsq), Float)
@@ -0,0 +1,41 @@
+import threading
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+# (rules_version, model_version) -> tagger_versions.id. Ids only enter the process map once the
+# transaction that may have inserted them committed, so a rolled-back insert never leaks an id.
+_ids: dict[tuple[str, str], int] = {}
+_lock = threading.Lock()
+_PENDING = "tagger_version_ids"
+
+_INSERT = text("""
+    INSERT INTO tagger_versions (rules_version, model_version) VALUES (:rv, :mv)
+    ON CONFLICT (rules_version, model_version) DO NOTHING RETURNING id
+""")
+_SELECT = text("SELECT id FROM tagger_versions WHERE rules_version = :rv AND model_version = :mv")
+
+def version_id(db, rules_version: str, model_version: str) -> int:
+    """Id of a tagger version, added to the dictionary on first use (in db's transaction)."""
+    key = (rules_version, model_version)
+    vid = _ids.get(key) or db.info.get(_PENDING, {}).get(key)
+    if vid is None:
+        p = {"rv": rules_version, "mv": model_version}
+        vid = db.execute(_SELECT, p).scalar()
+        if vid is None:
+            # nothing returned on a conflict: another transaction added it meanwhile
+            vid = db.execute(_INSERT, p).scalar() or db.execute(_SELECT, p).scalar_one()
+        db.info.setdefault(_PENDING, {})[key] = vid
+    return vid
+
+def clear():
+    with _lock: _ids.clear()
+
+@event.listens_for(Session, "after_commit")
+def _publish(session):
+    pending = session.info.pop(_PENDING, None)
+    if pending:
+        with _lock: _ids.update(pending)
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop(_PENDING, None)
@@ -0,0 +1,83 @@
+import hashlib, json, os
+from sqlalchemy import text, bindparam
+from ..lru import LRUCache
+
+CACHE_SIZE = int(os.getenv("TAGGER_CACHE_SIZE", "20000"))
+CACHE_DB = os.getenv("TAGGER_CACHE_DB", "true").lower() == "true"
+_IN_CHUNK = 500
+_SELECT = text(
+    "SELECT text_hash, scores FROM tag_cache "
+    "WHERE rules_version = :rv AND synonyms_version = :sv AND text_hash IN :hs"
+).bindparams(bindparam("hs", expanding=True))
+
+def text_hash(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+class TagCache:
+    """
+    Two-tier memo of rule scores keyed by (normalized text hash, rules_version, synonyms_version):
+    a bounded in-process LRU in front of the shared `tag_cache` table.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE, use_db: bool = CACHE_DB):
+        self.lru = LRUCache(maxsize)
+        self.use_db = use_db
+        self.versions = None
+        self.db_hits = self.db_misses = 0
+
+    def _check_versions(self, versions):
+        # new rules/synonyms: the LRU only holds the current version's scores. Table rows stay keyed by
+        # version (workers mid-deploy or mid-reload may still use the old one); purge() drops them.
+        if versions != self.versions:
+            self.lru.clear()
+            self.versions = versions
+
+    def purge(self, db, rules_version: str, synonyms_version: str) -> int:
+        """Delete table rows scored under any other version (maintenance: run after a re-tag completes)."""
+        if db is None or not self.use_db: return 0
+        return db.execute(text("DELETE FROM tag_cache WHERE rules_version <> :rv OR synonyms_version <> :sv"),
+                          {"rv": rules_version, "sv": synonyms_version}).rowcount
+
+    def get_many(self, db, hashes, rules_version: str, synonyms_version: str) -> dict[str, dict]:
+        versions = (rules_version, synonyms_version)
+        self._check_versions(versions)
+        found, missing = {}, []
+        for h in hashes:
+            sc = self.lru.get((h, *versions))
+            if sc is None: missing.append(h)
+            else: found[h] = sc
+        if missing and db is not None and self.use_db:
+            for i in range(0, len(missing), _IN_CHUNK):
+                chunk = missing[i:i + _IN_CHUNK]
+                rows = db.execute(_SELECT, {"rv": rules_version, "sv": synonyms_version, "hs": chunk}).all()
+                for h, raw in rows:
+                    found[h] = json.loads(raw)
+                    self.lru.put((h, *versions), found[h])
+            hit = sum(1 for h in missing if h in found)
+            self.db_hits += hit; self.db_misses += len(missing) - hit
+        return found
+
+    def put_many(self, db, entries: dict[str, dict], rules_version: str, synonyms_version: str):
+        self._check_versions((rules_version, synonyms_version))
+        for h, sc in entries.items():
+            self.lru.put((h, rules_version, synonyms_version), sc)
+        if entries and db is not None and self.use_db:
+            db.execute(text("""
+                INSERT INTO tag_cache (text_hash, rules_version, synonyms_version, scores)
+                VALUES (:h, :rv, :sv, :sc)
+                ON CONFLICT (text_hash, rules_version, synonyms_version) DO NOTHING
+            """), [{"h": h, "rv": rules_version, "sv": synonyms_version, "sc": json.dumps(sc)}
+                   for h, sc in entries.items()])
+
+    def clear(self):
+        self.lru.clear()
+        self.versions = None
+        self.db_hits = self.db_misses = 0
+
+    def stats(self) -> dict:
+        s = self.lru.stats()
+        lookups = s["hits"] + s["misses"]
+        return {"lru": s, "db_hits": self.db_hits, "db_misses": self.db_misses,
+                "hit_rate": round((s["hits"] + self.db_hits) / lookups, 4) if lookups else 0.0}
+
+TAG_CACHE = TagCache()
@@ -0,0 +1,183 @@
+from collections import deque
+import numpy as np
+from rapidfuzz import fuzz, process
+from .normalize import normalize
+from .scorer_rules import PHRASE_BOOST, CTX_POS, CTX_NEG
+
+# global adjustments applied after per-allergen scoring (mirrors score_rules)
+VEGAN_ALLERGENS = ("Dairy", "Eggs", "Fish", "Shellfish")
+GLUTEN_FREE = ("gluten-free", "gluten free", "no gluten")
+
+class Automaton:
+    """Aho-Corasick automaton: reports every pattern occurring in a text in one scan."""
+
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(patterns))
+        self.goto, self.fail, self.out = [{}], [0], [set()]
+        for pid, pat in enumerate(self.patterns):
+            s = 0
+            for ch in pat:
+                nxt = self.goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[s][ch] = nxt
+                    self.goto.append({}); self.fail.append(0); self.out.append(set())
+                s = nxt
+            self.out[s].add(pid)
+        # BFS over the trie to build failure links
+        queue = deque(self.goto[0].values())
+        while queue:
+            s = queue.popleft()
+            for ch, nxt in self.goto[s].items():
+                queue.append(nxt)
+                f = self.fail[s]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                if s: self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] |= self.out[self.fail[nxt]]
+        self.out = [frozenset(o) for o in self.out]
+
+    def find(self, text: str) -> set[str]:
+        goto, fail, out = self.goto, self.fail, self.out
+        s, hits = 0, set()
+        for ch in text:
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            if out[s]: hits |= out[s]
+        return {self.patterns[i] for i in hits}
+
+class CompiledMatcher:
+    """
+    score_rules compiled once per rules version.
+    One automaton scan finds exact keyword hits, context/negation phrases and the
+    vegan/gluten-free markers; rapidfuzz only runs for keywords without an exact hit
+    that can still raise their allergen's score.
+    """
+
+    def __init__(self, rules: dict[str, list[str]], version: str = ""):
+        self.version = version
+        self.allergens = []
+        patterns = ["vegan", *GLUTEN_FREE]
+        for allergen, kws in rules.items():
+            entries = []
+            for kw in kws:
+                pos = [(pat.format(kw=kw), boost) for pat, boost in CTX_POS]
+                neg = [(pat.format(kw=kw), pen) for pat, pen in CTX_NEG]
+                patterns += [kw] + [p for p, _ in pos] + [p for p, _ in neg]
+                entries.append((kw, PHRASE_BOOST if " " in kw else None, pos, neg))
+            self.allergens.append((allergen, entries))
+        self.automaton = Automaton(patterns)
+        self._build_tables()
+
+    def _build_tables(self):
+        # flat keyword axis for score_many: pattern -> [(kind, kw column, ctx slot)]
+        self.columns = [a for a, _ in self.allergens]
+        self.columns += [a for a in (*VEGAN_ALLERGENS, "Gluten") if a not in self.columns]
+        self.kws, self.kw_col, self.slots = [], [], {}
+        for col, (_, entries) in enumerate(self.allergens):
+            for kw, phrase, pos, neg in entries:
+                k = len(self.kws)
+                self.kws.append(kw); self.kw_col.append(col)
+                self.slots.setdefault(kw, []).append(("kw", k, 0))
+                for j, (p, _) in enumerate(pos): self.slots.setdefault(p, []).append(("pos", k, j))
+                for j, (p, _) in enumerate(neg): self.slots.setdefault(p, []).append(("neg", k, j))
+        self.kw_col = np.asarray(self.kw_col, dtype=np.intp)
+        self.phrase = np.asarray([" " in kw for kw in self.kws], dtype=bool)
+
+    def _kw_score(self, kw, phrase, pos, neg, hits, t, best):
+        # boosts/penalties are applied in the same order as score_rules so floats match exactly
+        ctx = sum(b for p, b in pos if p in hits) - sum(n for p, n in neg if p in hits)
+        if kw in hits:
+            s = 1.0  # partial_ratio of an exact substring is 100
+        else:
+            cutoff = (best - ctx) / (phrase or 1.0) * 100 - 1e-9
+            s = fuzz.partial_ratio(kw, t, score_cutoff=max(cutoff, 0)) / 100.0
+        if phrase: s *= phrase
+        for p, boost in pos:
+            if p in hits: s += boost
+        for p, pen in neg:
+            if p in hits: s = max(0.0, s - pen)
+        return min(s, 1.0)
+
+    def score(self, text: str) -> dict[str, float]:
+        t = normalize(text)
+        hits = self.automaton.find(t)
+        scores = {}
+        for allergen, entries in self.allergens:
+            best = 0.0
+            # exact hits first: they usually settle the allergen at 1.0 and prune the fuzzy pass
+            for kw, phrase, pos, neg in sorted(entries, key=lambda e: e[0] not in hits):
+                if best >= 1.0: break
+                best = max(best, self._kw_score(kw, phrase, pos, neg, hits, t, best))
+            scores[allergen] = min(best, 1.0)
+        if "vegan" in hits:
+            for a in VEGAN_ALLERGENS:
+                scores[a] = max(0.0, scores.get(a,0)-0.6)
+        if any(p in hits for p in GLUTEN_FREE):
+            scores["Gluten"] = max(0.0, scores.get("Gluten",0)-0.6)
+        return scores
+
+    def score_many(self, texts: list[str], chunk: int = 2048) -> list[dict[str, float]]:
+        """
+        Batch version of score(): one rapidfuzz cdist over rows x keywords, then the
+        boosts/penalties as NumPy array ops in the same order as score_rules.
+        """
+        out = []
+        for i in range(0, len(texts), chunk):
+            out += self._score_chunk([normalize(t) for t in texts[i:i + chunk]])
+        return out
+
+    def _score_chunk(self, ts: list[str]) -> list[dict[str, float]]:
+        R, K, C = len(ts), len(self.kws), len(self.columns)
+        exact = np.zeros((R, K), dtype=bool)
+        pos = np.zeros((len(CTX_POS), R, K), dtype=bool)
+        neg = np.zeros((len(CTX_NEG), R, K), dtype=bool)
+        vegan, gluten_free = np.zeros(R, dtype=bool), np.zeros(R, dtype=bool)
+        for r, t in enumerate(ts):
+            for p in self.automaton.find(t):
+                if p == "vegan": vegan[r] = True
+                if p in GLUTEN_FREE: gluten_free[r] = True
+                for kind, k, j in self.slots.get(p, ()):
+                    if kind == "kw": exact[r, k] = True
+                    elif kind == "pos": pos[j, r, k] = True
+                    else: neg[j, r, k] = True
+
+        best = np.zeros((R, C))
+        if K and R:
+            s = process.cdist(self.kws, ts, scorer=fuzz.partial_ratio, dtype=np.float64, workers=-1).T / 100.0
+            s = np.where(exact, 1.0, s)
+            s = np.where(self.phrase, s * PHRASE_BOOST, s)
+            for j, (_, boost) in enumerate(CTX_POS):
+                s = np.where(pos[j], s + boost, s)
+            for j, (_, pen) in enumerate(CTX_NEG):
+                s = np.where(neg[j], np.maximum(0.0, s - pen), s)
+            s = np.minimum(s, 1.0)
+            np.maximum.at(best.T, self.kw_col, s.T)
+        best = np.minimum(best, 1.0)
+
+        cols = {a: c for c, a in enumerate(self.columns)}
+        for a in VEGAN_ALLERGENS:
+            best[vegan, cols[a]] = np.maximum(0.0, best[vegan, cols[a]] - 0.6)
+        best[gluten_free, cols["Gluten"]] = np.maximum(0.0, best[gluten_free, cols["Gluten"]] - 0.6)
+
+        # extra columns only exist in score() output once an adjustment touched them
+        n = len(self.allergens)
+        rows = []
+        for r in range(R):
+            d = dict(zip(self.columns[:n], best[r, :n].tolist()))
+            for c in range(n, C):
+                a = self.columns[c]
+                if (vegan[r] and a in VEGAN_ALLERGENS) or (gluten_free[r] and a == "Gluten"):
+                    d[a] = best[r, c].item()
+            rows.append(d)
+        return rows
+
+_COMPILED: dict[str, CompiledMatcher] = {}
+
+def compile_rules(rules: dict[str, list[str]], version: str) -> CompiledMatcher:
+    """Return the matcher for `version`, compiling it on first use."""
+    m = _COMPILED.get(version)
+    if m is None:
+        m = _COMPILED[version] = CompiledMatcher(rules, version)
+    return m
@@ -1,30 +1,129 @@
-import os
-from .rules import load_rules, load_synonyms
-from .scorer_rules import score_rules
-
-RULES, RULES_VER = load_rules()
-SYN, SYN_VER = load_synonyms()
+import logging, os, threading, time
+from typing import NamedTuple
+from . import rules as rules_mod
+from .rules import load_rules, load_synonyms, SynonymRewriter
+from .normalize import normalize
+from .cache import TAG_CACHE, text_hash
 
 TAU_HIGH = float(os.getenv("TAGGER_TAU_HIGH", "0.90"))
 TAU_LOW  = float(os.getenv("TAGGER_TAU_LOW",  "0.50"))
-MODEL_VERSION = f"rules@{RULES_VER}"
+# rules files are stat'ed at most this often by tag calls; 0 disables hot reload
+RELOAD_CHECK_S = float(os.getenv("TAGGER_RELOAD_CHECK_S", "2"))
+
+log = logging.getLogger(__name__)
+
+class TaggerState(NamedTuple):
+    """One compiled tagger version; tag calls read a single snapshot so a reload never mixes versions."""
+    rules: dict
+    rules_version: str
+    synonyms: dict
+    synonyms_version: str
+    rewriter: SynonymRewriter
+    matcher: object
+    model_version: str
+
+def _build() -> TaggerState:
+    from .matcher import compile_rules  # numpy + rapidfuzz: imported with the first tagger use
+    rules, rv = load_rules()
+    syn, sv = load_synonyms()
+    return TaggerState(rules, rv, syn, sv, SynonymRewriter(syn), compile_rules(rules, rv), f"rules@{rv}+syn@{sv}")
+
+def _publish(st: TaggerState):
+    # module-level names kept for callers that read the current version directly
+    global _STATE, RULES, RULES_VER, SYN, SYN_VER, SYN_RW, MATCHER, MODEL_VERSION
+    _STATE = st
+    RULES, RULES_VER, SYN, SYN_VER, SYN_RW, MATCHER, MODEL_VERSION = (
+        st.rules, st.rules_version, st.synonyms, st.synonyms_version, st.rewriter, st.matcher, st.model_version)
+
+def _mtimes() -> tuple:
+    return tuple(os.stat(p).st_mtime_ns if os.path.exists(p) else 0 for p in rules_mod.rules_paths())
+
+_STATE: TaggerState | None = None
+_lock = threading.Lock()
+_seen_mtimes, _next_check = (), 0.0
+
+def current() -> TaggerState:
+    """The live tagger version. Rules are loaded and compiled on first use, not at import."""
+    global _seen_mtimes
+    if _STATE is None:
+        with _lock:
+            if _STATE is None:
+                _seen_mtimes = _mtimes()
+                _publish(_build())
+    return _STATE
+
+_LAZY = {"RULES", "RULES_VER", "SYN", "SYN_VER", "SYN_RW", "MATCHER", "MODEL_VERSION"}
+
+def __getattr__(name: str):
+    # tagger.MODEL_VERSION & co. before anything was tagged: load the tagger, then they are plain globals
+    if name in _LAZY:
+        current()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def reload() -> bool:
+    """Recompile from the rules files and swap the new version in. True if the version changed."""
+    global _seen_mtimes
+    old = current()
+    with _lock:
+        _seen_mtimes = _mtimes()
+        st = _build()
+        if st.model_version == old.model_version: return False
+        _publish(st)
+    log.info("tagger reloaded: %s", st.model_version)
+    return True
+
+def maybe_reload():
+    """Hot reload: cheap mtime check (throttled), recompiling only when a rules file changed."""
+    global _next_check
+    if _STATE is None or RELOAD_CHECK_S <= 0 or time.monotonic() < _next_check: return
+    _next_check = time.monotonic() + RELOAD_CHECK_S
+    if _mtimes() == _seen_mtimes: return
+    try:
+        reload()
+    except Exception:
+        # half-saved or invalid file: keep serving the current version, retry on the next change
+        log.exception("tagger reload failed; keeping %s", _STATE.model_version)
 
 def expand_synonyms(text: str) -> str:
-    if not SYN: return text or ""
-    t = text or ""
-    for canonical, variants in SYN.items():
-        for v in variants:
-            t = t.replace(v.lower(), canonical.lower())
-    return t
-
-def tag_text(item_name: str, description: str):
-    base = (item_name or "") + " " + (description or "")
-    base = expand_synonyms(base)
-    rule_scores = score_rules(base, RULES)
+    return current().rewriter(text)
 
+def _split(rule_scores: dict[str, float], st: TaggerState | None = None):
+    st = st or current()
     accepted, weak = [], []
     for a, s in rule_scores.items():
         if s >= TAU_HIGH: accepted.append((a, s))
         elif s >= TAU_LOW: weak.append((a, s))
-    meta = {"rules_version": RULES_VER, "model_version": MODEL_VERSION, "synonyms_version": SYN_VER}
+    meta = {"rules_version": st.rules_version, "model_version": st.model_version, "synonyms_version": st.synonyms_version}
     return accepted, weak, meta
+
+def _score_cached(bases: list[str], db=None, st: TaggerState | None = None) -> list[dict[str, float]]:
+    # scores depend only on the normalized text, so that is what the cache is keyed on
+    st = st or current()
+    norms = [normalize(b) for b in bases]
+    hashes = [text_hash(t) for t in norms]
+    found = TAG_CACHE.get_many(db, list(dict.fromkeys(hashes)), st.rules_version, st.synonyms_version)
+    todo = {h: t for h, t in zip(hashes, norms) if h not in found}
+    if todo:
+        texts = list(todo.values())
+        fresh = [st.matcher.score(texts[0])] if len(texts) == 1 else st.matcher.score_many(texts)
+        new = dict(zip(todo, fresh))
+        TAG_CACHE.put_many(db, new, st.rules_version, st.synonyms_version)
+        found.update(new)
+    return [found[h] for h in hashes]
+
+def tag_text(item_name: str, description: str, db=None):
+    maybe_reload()
+    st = current()
+    base = st.rewriter((item_name or "") + " " + (description or ""))
+    return _split(_score_cached([base], db, st)[0], st)
+
+def tag_texts(rows: list[tuple[str, str]], db=None, state: TaggerState | None = None):
+    """
+    Batch tag_text: rows of (item_name, description) scored in one vectorized pass.
+    state pins a specific tagger version (re-tag passes); otherwise the current one, hot-reloaded.
+    """
+    if state is None: maybe_reload()
+    st = state or current()
+    bases = [st.rewriter((name or "") + " " + (desc or "")) for name, desc in rows]
+    return [_split(sc, st) for sc in _score_cached(bases, db, st)]
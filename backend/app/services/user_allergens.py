@@ -0,0 +1,30 @@
+import os
+from sqlalchemy import text
+from .lru import LRUCache
+
+# Per-process cache of each user's allergen ids. PUT /api/allergens/me invalidates it in the worker
+# that served the write; the TTL bounds how long other workers can serve the old set.
+USER_ALLERGEN_TTL_S = float(os.getenv("USER_ALLERGEN_TTL_S", "300"))
+USER_ALLERGEN_CACHE_SIZE = int(os.getenv("USER_ALLERGEN_CACHE_SIZE", "10000"))
+
+_CACHE = LRUCache(USER_ALLERGEN_CACHE_SIZE, ttl=USER_ALLERGEN_TTL_S)
+
+def allergen_ids(db, user_id: int) -> frozenset[int] | None:
+    """The user's allergen ids, or None when the user does not exist. One query on a miss."""
+    ids = _CACHE.get(user_id)
+    if ids is None:
+        rows = db.execute(text("""
+            SELECT u.id, ua.allergen_id FROM users u
+            LEFT JOIN user_allergies ua ON ua.user_id = u.id
+            WHERE u.id = :uid
+        """), {"uid": user_id}).all()
+        if not rows: return None
+        ids = frozenset(aid for _, aid in rows if aid is not None)
+        _CACHE.put(user_id, ids)
+    return ids
+
+def invalidate(user_id: int):
+    _CACHE.pop(user_id)
+
+def stats() -> dict:
+    return _CACHE.stats()
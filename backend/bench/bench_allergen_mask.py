@@ -0,0 +1,56 @@
+"""
+Benchmark: safe-for-user filtering via allergen_mask vs the correlated NOT EXISTS on menu_allergens.
+
+    cd backend && python -m bench.bench_allergen_mask [items] [database_url]
+
+Builds a synthetic menu in a scratch database (a temp SQLite file unless a URL is given; the
+tables in that database are dropped first) and times the list_menu_items query shapes.
+"""
+import os, random, sys, tempfile, timeit
+from sqlalchemy import create_engine, select, exists, and_, text, func
+from sqlalchemy.orm import Session
+from app.db import Base
+from app.models import MenuItem, menu_allergens
+from app.services.allergen_mask import mask_of, backfill
+
+ALLERGENS = ["Peanuts", "Tree Nuts", "Dairy", "Eggs", "Gluten", "Soy", "Fish", "Shellfish", "Sesame"]
+
+def build(engine, n: int, seed: int = 7):
+    Base.metadata.drop_all(engine); Base.metadata.create_all(engine)
+    rnd = random.Random(seed)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (id, name, email, password_hash, role) VALUES (1, 'r', 'r@x', '-', 'restaurant')"))
+        conn.execute(text("INSERT INTO allergens (id, name) VALUES (:id, :name)"),
+                     [{"id": i, "name": a} for i, a in enumerate(ALLERGENS, 1)])
+        for lo in range(0, n, 10_000):
+            ids = range(lo + 1, min(n, lo + 10_000) + 1)
+            conn.execute(text("INSERT INTO menu_items (id, restaurant_id, item_name, description, price, content_hash) "
+                              "VALUES (:id, 1, :name, '', 10, '')"), [{"id": i, "name": f"Dish {i}"} for i in ids])
+            conn.execute(text("INSERT INTO menu_allergens (menu_id, allergen_id) VALUES (:m, :a)"),
+                         [{"m": i, "a": a} for i in ids
+                          for a in rnd.sample(range(1, len(ALLERGENS) + 1), rnd.choice([0, 0, 1, 1, 2, 3]))])
+    with Session(engine) as db:
+        backfill(db); db.commit()
+
+def queries(excluded_ids: list[int]):
+    not_exists = ~exists(select(menu_allergens.c.menu_id).where(and_(
+        menu_allergens.c.menu_id == MenuItem.id, menu_allergens.c.allergen_id.in_(excluded_ids))))
+    bitwise = MenuItem.allergen_mask.op("&")(mask_of(excluded_ids)) == 0
+    return {"not_exists": not_exists, "mask": bitwise}
+
+def main(n: int = 200_000, url: str | None = None):
+    url = url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    engine = create_engine(url)
+    build(engine, n)
+    preds = queries([1, 3, 5])  # peanuts, dairy, gluten
+    with Session(engine) as db:
+        for label, shape in (("page", lambda w: select(MenuItem.id).where(w).order_by(MenuItem.id.desc()).offset(5000).limit(50)),
+                             ("count", lambda w: select(func.count()).select_from(MenuItem).where(w))):
+            res = {k: db.execute(shape(w)).all() for k, w in preds.items()}
+            assert res["not_exists"] == res["mask"], "plans disagree"
+            t = {k: min(timeit.repeat(lambda: db.execute(shape(w)).all(), number=1, repeat=5)) for k, w in preds.items()}
+            print(f"items={n} {label}: not_exists={t['not_exists']*1e3:.1f}ms mask={t['mask']*1e3:.1f}ms "
+                  f"speedup={t['not_exists']/t['mask']:.2f}x")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000, sys.argv[2] if len(sys.argv) > 2 else None)
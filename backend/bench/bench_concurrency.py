@@ -0,0 +1,99 @@
+"""
+Benchmark: GET /api/menus reader throughput while an ingest is writing.
+
+    cd backend && python -m bench.bench_concurrency [--readers 8] [--seconds 10] [--rows 20000]
+
+Starts uvicorn on a scratch SQLite database (or DATABASE_URL if set), loads a menu, then measures
+readers alone and readers racing a loop of CSV upload + commit. The server inherits the environment,
+so compare configurations by re-running, e.g.:
+
+    SQLITE_PRAGMAS=false python -m bench.bench_concurrency   # rollback journal, no busy_timeout
+    DB_ASYNC=true python -m bench.bench_concurrency          # asyncio engine for the read routes
+"""
+import argparse, os, socket, statistics, subprocess, sys, tempfile, threading, time
+import httpx
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _csv(rows: int, tag: str) -> bytes:
+    return ("item_name,description,price\n" + "".join(
+        f"{tag} dish {i},grilled with peanut sauce and rice {i % 97},{5 + i % 20}\n" for i in range(rows))).encode()
+
+def _register(c: httpx.Client, role: str) -> dict:
+    r = c.post("/api/auth/register", json={"name": role, "email": f"{role}@bench.local", "password": "pw", "role": role})
+    r.raise_for_status()
+    return {"Authorization": f"Bearer {r.json()['token']}"}
+
+def _ingest(c: httpx.Client, headers: dict, rows: int, tag: str):
+    fid = c.post("/api/ingest/csv", headers=headers, files={"file": ("m.csv", _csv(rows, tag), "text/csv")}).json()["fileId"]
+    c.post("/api/ingest/commit", params={"fileId": fid}, headers=headers).raise_for_status()
+
+def _readers(base: str, headers: dict, n: int, seconds: float) -> tuple[int, list[float], int]:
+    lat, errors, stop = [], [0], time.perf_counter() + seconds
+    def worker(k: int):
+        with httpx.Client(base_url=base, timeout=60) as c:
+            page = k
+            while time.perf_counter() < stop:
+                page = page % 40 + 1  # spread over pages so the response cache doesn't answer everything
+                t0 = time.perf_counter()
+                r = c.get("/api/menus", params={"safeForUser": True, "page": page, "pageSize": 50}, headers=headers)
+                lat.append(time.perf_counter() - t0)
+                if r.status_code != 200: errors[0] += 1
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(n)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return len(lat), lat, errors[0]
+
+def _report(label: str, seconds: float, res):
+    n, lat, errors = res
+    lat = sorted(lat) or [0.0]
+    print(f"{label:<18} {n/seconds:8.1f} req/s  p50={statistics.median(lat)*1e3:6.1f}ms  "
+          f"p95={lat[int(len(lat)*0.95)-1]*1e3:7.1f}ms  errors={errors}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--readers", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--rows", type=int, default=20000, help="rows per ingest upload")
+    args = ap.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port),
+                               "--log-level", "warning"], env=env)
+    try:
+        with httpx.Client(base_url=base, timeout=120) as c:
+            for _ in range(100):
+                try:
+                    if c.get("/api/health").status_code == 200: break
+                except httpx.TransportError:
+                    time.sleep(0.1)
+            c.post("/api/allergens/seed")
+            owner, customer = _register(c, "restaurant"), _register(c, "customer")
+            c.put("/api/allergens/me", json={"allergyIds": [1]}, headers=customer)
+            _ingest(c, owner, args.rows, "base")
+
+            print(f"db={env['DATABASE_URL'].split(':')[0]} readers={args.readers} async={env.get('DB_ASYNC', 'false')} "
+                  f"sqlite_pragmas={env.get('SQLITE_PRAGMAS', 'true')}")
+            _report("readers only", args.seconds, _readers(base, customer, args.readers, args.seconds))
+
+            done, batches = threading.Event(), [0]
+            def writer():
+                with httpx.Client(base_url=base, timeout=300) as w:
+                    while not done.is_set():
+                        _ingest(w, owner, args.rows, f"w{batches[0]}"); batches[0] += 1
+            t = threading.Thread(target=writer); t.start()
+            res = _readers(base, customer, args.readers, args.seconds)
+            done.set(); t.join()
+            _report("readers + ingest", args.seconds, res)
+            print(f"ingest batches completed: {batches[0]}")
+    finally:
+        server.terminate(); server.wait()
+
+if __name__ == "__main__":
+    main()
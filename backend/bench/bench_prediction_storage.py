@@ -0,0 +1,141 @@
+"""
+Benchmark: allergen_predictions storage before/after the tagger_versions dictionary and retention.
+
+    cd backend && python -m bench.bench_prediction_storage [predictions] [database_url]
+
+Seeds a scratch database (a temp SQLite file unless a URL is given; its tables are dropped first)
+with ~`predictions` rows (default 1,000,000) in the old layout - rules_version/model_version strings
+on every row, single-column owner indexes - spread over parsed rows of old and recent files plus
+the menu-item copies made on commit. Then measures table + index bytes after each step:
+  legacy    as seeded
+  migrated  app.migrate folds the strings into tagger_versions and drops the redundant indexes
+  retained  services.retention drops parsed-row predictions of files idle for 30+ days
+Each step is followed by VACUUM so the numbers are live pages, not free lists.
+"""
+import os, random, sys, tempfile, time
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from app.db import Base
+from app.migrate import migrate
+from app.services import retention, tagger_versions
+
+FILES, ROWS_PER_ITEM_PRED = 200, 2
+VERSIONS = [("0b6e3a91d2c4", "rules@0b6e3a91d2c4+syn@9c41e07b5a3d"),
+            ("5d2f8c07e1ab", "rules@5d2f8c07e1ab+syn@9c41e07b5a3d"),
+            ("f1ba13ad3744", "rules@f1ba13ad3744+syn@0e12a0bac264")]
+
+_LEGACY = """
+    CREATE TABLE allergen_predictions (
+        id {pk},
+        parsed_row_id INTEGER REFERENCES parsed_rows (id) ON DELETE CASCADE,
+        menu_item_id INTEGER REFERENCES menu_items (id) ON DELETE CASCADE,
+        allergen_id INTEGER NOT NULL REFERENCES allergens (id) ON DELETE CASCADE,
+        score NUMERIC(5, 4) NOT NULL,
+        status VARCHAR NOT NULL,
+        rules_version VARCHAR NOT NULL,
+        model_version VARCHAR NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        CONSTRAINT uq_row_allergen UNIQUE (parsed_row_id, allergen_id),
+        CONSTRAINT uq_item_allergen UNIQUE (menu_item_id, allergen_id)
+    )
+"""
+
+def _preds(rnd, owners, owner_col: str):
+    for o in owners:
+        rv, mv = rnd.choices(VERSIONS, weights=(1, 2, 7))[0]
+        for aid in rnd.sample(range(1, 10), rnd.randint(1, 4)):
+            yield {"pr": o if owner_col == "pr" else None, "mi": o if owner_col == "mi" else None, "aid": aid,
+                   "sc": round(rnd.uniform(0.5, 1), 4), "st": rnd.choice(("auto", "auto", "weak")), "rv": rv, "mv": mv}
+
+def _insert_preds(conn, preds):
+    batch = []
+    for p in preds:
+        batch.append(p)
+        if len(batch) == 10_000:
+            conn.execute(text("INSERT INTO allergen_predictions (parsed_row_id, menu_item_id, allergen_id, score, status, "
+                              "rules_version, model_version) VALUES (:pr, :mi, :aid, :sc, :st, :rv, :mv)"), batch)
+            batch = []
+    if batch:
+        conn.execute(text("INSERT INTO allergen_predictions (parsed_row_id, menu_item_id, allergen_id, score, status, "
+                          "rules_version, model_version) VALUES (:pr, :mi, :aid, :sc, :st, :rv, :mv)"), batch)
+
+def build_legacy(engine, n: int, seed: int = 7):
+    """~n predictions (2.5 per owner): 4/5 on parsed rows, 1/5 menu-item copies; 70% of files are 60 days old."""
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite": conn.execute(text("DROP TABLE IF EXISTS menu_items_fts"))
+    Base.metadata.drop_all(engine); Base.metadata.create_all(engine)
+    tagger_versions.clear()
+    rnd = random.Random(seed)
+    rows = int(n * 0.8 / 2.5)
+    items = int(n * 0.2 / 2.5)
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE allergen_predictions"))
+        conn.execute(text(_LEGACY.format(pk="SERIAL PRIMARY KEY" if engine.dialect.name == "postgresql" else "INTEGER PRIMARY KEY")))
+        for col in ("parsed_row_id", "menu_item_id", "allergen_id"):
+            conn.execute(text(f"CREATE INDEX ix_allergen_predictions_{col} ON allergen_predictions ({col})"))
+        conn.execute(text("INSERT INTO users (id, name, email, password_hash, role) VALUES (1, 'r', 'r@x', '-', 'restaurant')"))
+        conn.execute(text("INSERT INTO allergens (id, name) VALUES (:id, :name)"),
+                     [{"id": i, "name": f"A{i}"} for i in range(1, 10)])
+        files = []
+        for f in range(1, FILES + 1):
+            old = rnd.random() < 0.7
+            created = now - timedelta(days=60 if old else 2)
+            files.append({"id": f, "sha": f"{f:064x}", "created": created,
+                          "committed": created + timedelta(hours=1) if rnd.random() < 0.6 else None})
+        conn.execute(text("INSERT INTO files (id, restaurant_id, filename, filetype, sha256, pages, rules_version, "
+                          "model_version, issues, created_at, committed_at) VALUES (:id, 1, 'menu.csv', 'csv', :sha, 1, "
+                          f"'{VERSIONS[-1][0]}', '{VERSIONS[-1][1]}', '[]', :created, :committed)"), files)
+        per_file = rows // FILES
+        for lo in range(0, rows, 10_000):
+            conn.execute(text("INSERT INTO parsed_rows (id, file_id, row_index, item_name, description, price, parsing_meta, "
+                              "content_hash) VALUES (:id, :f, :ri, :name, '', 10, '', '')"),
+                         [{"id": i, "f": min(FILES, i // per_file + 1), "ri": i, "name": f"Dish {i}"}
+                          for i in range(lo + 1, min(rows, lo + 10_000) + 1)])
+        for lo in range(0, items, 10_000):
+            conn.execute(text("INSERT INTO menu_items (id, restaurant_id, item_name, description, price, content_hash) "
+                              "VALUES (:id, 1, :name, '', 10, '')"),
+                         [{"id": i, "name": f"Dish {i}"} for i in range(lo + 1, min(items, lo + 10_000) + 1)])
+        _insert_preds(conn, _preds(rnd, range(1, rows + 1), "pr"))
+        _insert_preds(conn, _preds(rnd, range(1, items + 1), "mi"))
+        return conn.execute(text("SELECT COUNT(*) FROM allergen_predictions")).scalar()
+
+def _sizes(engine, label: str, report: dict):
+    retention.vacuum(engine)
+    report[label] = retention.prediction_storage(engine)
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    url = sys.argv[2] if len(sys.argv) > 2 else f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'predictions.db')}"
+    engine = create_engine(url, future=True)
+    t0 = time.perf_counter()
+    total = build_legacy(engine, n)
+    print(f"seeded {total} predictions in {time.perf_counter() - t0:.1f}s ({engine.dialect.name})")
+    report = {}
+    _sizes(engine, "legacy", report)
+
+    t0 = time.perf_counter()
+    migrate(engine, force=True)
+    print(f"migrate (fold versions, drop owner indexes): {time.perf_counter() - t0:.1f}s")
+    _sizes(engine, "migrated", report)
+
+    t0 = time.perf_counter()
+    with Session(engine) as db:
+        r = retention.compact(db, days=30)
+    print(f"retention: dropped {r['predictions']} predictions of {r['files']} files in {time.perf_counter() - t0:.1f}s")
+    _sizes(engine, "retained", report)
+
+    if not report["legacy"]:
+        print("this database does not report per-object sizes")
+        return
+    names = sorted(set().union(*report.values()), key=lambda k: (k != "allergen_predictions", k))
+    print(f"\n{'bytes':<45}" + "".join(f"{k:>14}" for k in report))
+    for name in names:
+        print(f"{name:<45}" + "".join(f"{report[k].get(name, 0):>14,}" for k in report))
+    totals = [sum(v.values()) for v in report.values()]
+    print(f"{'total':<45}" + "".join(f"{t:>14,}" for t in totals))
+    print(f"{'vs legacy':<45}" + "".join(f"{t / totals[0]:>14.0%}" for t in totals))
+
+if __name__ == "__main__":
+    main()
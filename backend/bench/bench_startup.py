@@ -0,0 +1,81 @@
+"""
+Benchmark: worker cold start.
+
+    cd backend && python -m bench.bench_startup [--runs 7] [--top 12] [--out startup.json]
+
+Each run is a fresh interpreter against a scratch SQLite database (already migrated), timing:
+  startup.import_app_main   import app.main (what uvicorn does before serving)
+  startup.migrate_noop      the DB_MIGRATE_ON_STARTUP check once the schema is applied
+  startup.first_tag         first tag_text call (loads and compiles the rules lazily)
+  startup.first_csv_parse   first CSV chunk (imports pandas lazily)
+and records which heavy modules the import alone pulled in. --top lists the slowest imports from
+`python -X importtime`. --out writes the bench.suite JSON format, so runs can be diffed with
+`python -m bench.suite compare`.
+"""
+import argparse, datetime, json, os, statistics, subprocess, sys, tempfile
+
+HEAVY = ("pandas", "numpy", "rapidfuzz", "pdfplumber")
+
+_PROBE = r"""
+import io, json, sys, time
+t = time.perf_counter(); import app.main; t_import = time.perf_counter() - t
+loaded = [m for m in HEAVY if m in sys.modules]
+from app.migrate import migrate
+t = time.perf_counter(); migrate(); t_migrate = time.perf_counter() - t
+from app.services.tagging import pipeline as tagger
+t = time.perf_counter(); tagger.tag_text("Pad Thai", "rice noodles, peanut sauce"); t_tag = time.perf_counter() - t
+from app.services.ingest.parse import iter_csv_chunks
+t = time.perf_counter(); next(iter_csv_chunks(io.BytesIO(b"item_name,price\na,1\n"), [])); t_csv = time.perf_counter() - t
+print(json.dumps({"import_app_main": t_import, "migrate_noop": t_migrate, "first_tag": t_tag,
+                  "first_csv_parse": t_csv, "loaded": loaded}))
+"""
+
+def _probe(env) -> dict:
+    out = subprocess.run([sys.executable, "-c", f"HEAVY = {HEAVY!r}\n" + _PROBE], env=env, capture_output=True,
+                         text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def _importtime(env, top: int):
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], env=env,
+                         capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "self" in line: continue
+        _, cum, name = line.split("|")
+        if "." not in name.strip(): rows.append((int(cum), name.strip()))  # top-level packages only
+    print(f"slowest top-level imports (cumulative):")
+    for cum, name in sorted(rows, reverse=True)[:top]:
+        print(f"  {cum/1000:8.1f}ms  {name}")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=7)
+    ap.add_argument("--top", type=int, default=12)
+    ap.add_argument("--out")
+    args = ap.parse_args()
+
+    env = dict(os.environ, DATABASE_URL=os.getenv("DATABASE_URL") or
+               f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}", DB_MIGRATE_ON_STARTUP="true")
+    _probe(env)  # applies the schema and warms the OS file cache
+    runs = [_probe(env) for _ in range(args.runs)]
+
+    results = {}
+    for key in ("import_app_main", "migrate_noop", "first_tag", "first_csv_parse"):
+        s = sorted(r[key] for r in runs)
+        results[f"startup.{key}"] = {"n": len(s), "min_ms": round(s[0] * 1e3, 3),
+                                     "median_ms": round(statistics.median(s) * 1e3, 3),
+                                     "mean_ms": round(statistics.fmean(s) * 1e3, 3)}
+        print(f"startup.{key:<18} median={results[f'startup.{key}']['median_ms']:8.1f}ms  min={s[0]*1e3:8.1f}ms")
+    loaded = sorted({m for r in runs for m in r["loaded"]})
+    print("heavy modules loaded by `import app.main`: " + (", ".join(loaded) or "none"))
+    if args.top: _importtime(env, args.top)
+
+    if args.out:
+        meta = {"created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                "python": sys.version.split()[0], "runs": args.runs, "heavy_loaded_at_import": loaded}
+        with open(args.out, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=1, sort_keys=True)
+        print(f"wrote {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Benchmark suite for the hot paths, on seeded synthetic data (bench.synth) in a local SQLite database.
+
+    cd backend && python -m bench.suite run [--sizes 1000,10000,100000] [--out results.json]
+    python -m bench.suite compare base.json new.json [--threshold 0.15]
+
+run times, in process and through the same service code the routers call:
+  tagger.*          score_rules / tag_text / tag_texts per row, cold and warm tag cache
+  ingest.csv[n]     parse -> tag -> persist of an n-row CSV (stage split from StageTimer)
+  ingest.pdf[n]     the same for an n-row text PDF, page extraction included
+  ingest.commit[n]  commit of the CSV file into menu_items
+  menus.list[n]...  list_menu_items on the resulting table for every filter combination
+                    (restaurant, q, safe, exclude), response cache cleared before each call,
+                    plus the cached path and page 50 via OFFSET vs cursor
+Each size starts from an empty database. Results go to a JSON file (bench/results/<utc>.json by
+default); compare prints the median ratio per case and exits 1 if anything slowed down by more
+than --threshold, so it can gate a deploy. Point DATABASE_URL (or --db) elsewhere to bench another
+database; its tables are dropped.
+"""
+import argparse, datetime, hashlib, io, itertools, json, os, platform, sqlite3, statistics, subprocess, sys, tempfile, time
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+def summarize(samples: list[float], rows: int | None = None, **extra) -> dict:
+    s = sorted(samples)
+    out = {"n": len(s), "min_ms": round(s[0] * 1e3, 3), "median_ms": round(statistics.median(s) * 1e3, 3),
+           "p95_ms": round(s[max(0, int(len(s) * 0.95) - 1)] * 1e3, 3), "mean_ms": round(statistics.fmean(s) * 1e3, 3)}
+    if rows:
+        out.update(rows=rows, per_row_us=round(statistics.median(s) / rows * 1e6, 3),
+                   rows_per_s=round(rows / statistics.median(s), 1))
+    out.update(extra)
+    return out
+
+def timed(fn, repeat: int, setup=None) -> list[float]:
+    samples = []
+    for _ in range(repeat):
+        if setup: setup()
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        return ""
+
+# ---------- run ----------
+
+def run(args) -> dict:
+    # the app reads DATABASE_URL at import time
+    os.environ["DATABASE_URL"] = args.db or os.getenv("DATABASE_URL") or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    from app.services.tagging import pipeline as tagger
+    from app.services.ingest.pdf import parse_pdf_sync, shutdown_pool
+    from .synth import to_pdf
+
+    results = {}
+    def record(name: str, res: dict):
+        results[name] = res
+        print(f"{name:<58} median={res['median_ms']:>10.3f}ms"
+              + (f"  {res['per_row_us']:.1f}us/row" if "per_row_us" in res else ""), flush=True)
+
+    if "tagger" in args.only:
+        bench_tagger(args, tagger, record)
+    if "pdf" in args.only and args.pdf_sizes:
+        parse_pdf_sync(to_pdf([]))  # start the extraction pool outside the timings
+    try:
+        for n in args.sizes:
+            bench_size(n, args, record)
+    finally:
+        shutdown_pool()
+
+    meta = {"created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "git": _git_rev(), "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(), "cpus": os.cpu_count(), "db": os.environ["DATABASE_URL"].split(":")[0],
+            "model_version": tagger.MODEL_VERSION,
+            "args": {k: sorted(v) if isinstance(v, set) else v for k, v in vars(args).items() if k not in ("cmd", "out")}}
+    return {"meta": meta, "results": results}
+
+def _rows(n: int, args, seed_offset: int = 0):
+    from .synth import menu_rows
+    return menu_rows(n, allergen_density=args.allergen_density, words=tuple(args.words), seed=args.seed + seed_offset)
+
+def bench_tagger(args, tagger, record):
+    from app.services.tagging.cache import TAG_CACHE
+    from app.services.tagging.scorer_rules import score_rules
+    rows = _rows(args.tag_rows, args)
+    pairs = [(r["item_name"], r["description"]) for r in rows]
+    bases = [tagger.expand_synonyms(f"{a} {b}") for a, b in pairs]
+    n, rep = len(pairs), args.repeat_tagger
+    # score_rules is the reference fuzzy scorer; tag_text/tag_texts go through the compiled matcher
+    record("tagger.score_rules", summarize(timed(lambda: [score_rules(b, tagger.RULES) for b in bases], rep), n))
+    cold = TAG_CACHE.lru.clear
+    record("tagger.tag_text", summarize(timed(lambda: [tagger.tag_text(a, b) for a, b in pairs], rep, cold), n))
+    record("tagger.tag_texts", summarize(timed(lambda: tagger.tag_texts(pairs), rep, cold), n))
+    record("tagger.tag_texts.cached", summarize(timed(lambda: tagger.tag_texts(pairs), rep), n))
+
+def _reset_db(args):
+    from sqlalchemy import text
+    from app.db import engine, Base
+    from app.migrate import migrate
+    from app.services.allergen_registry import ALLERGENS, SEED_ALLERGENS
+    from app.services.tagging.cache import TAG_CACHE
+    from app.services import menu_cache, tagger_versions
+    from .synth import profiles
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite": conn.execute(text("DROP TABLE IF EXISTS menu_items_fts"))
+    Base.metadata.drop_all(engine)
+    tagger_versions.clear()
+    migrate(engine)
+    users = [{"id": 1, "role": "restaurant"}, {"id": 2, "role": "restaurant"}]
+    users += [{"id": 3 + i, "role": "customer"} for i in range(args.users)]
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO allergens (name) VALUES (:name)"), [{"name": a} for a in SEED_ALLERGENS])
+        conn.execute(text("INSERT INTO users (id, name, email, password_hash, role) VALUES (:id, :role, :email, '-', :role)"),
+                     [dict(u, email=f"u{u['id']}@bench.local") for u in users])
+        aids = [i for i, in conn.execute(text("SELECT id FROM allergens ORDER BY id"))]
+        links = [{"u": 3 + i, "a": a} for i, p in enumerate(profiles(args.users, aids, args.profile_density, args.seed))
+                 for a in p]
+        if links: conn.execute(text("INSERT INTO user_allergies (user_id, allergen_id) VALUES (:u, :a)"), links)
+    with engine.connect() as conn:
+        ALLERGENS.refresh(conn)
+    TAG_CACHE.lru.clear()
+    menu_cache.MENU_CACHE.clear()
+    return [u["id"] for u in users if u["role"] == "customer"]
+
+def _ingest(db, rid: int, filename: str, data: bytes, pdf: bool):
+    from app.services.ingest.pdf import parse_pdf_sync
+    from app.services.ingest.pipeline import StageTimer, get_or_create_file, run_csv, run_pdf_rows, mark_tagged
+    timer = StageTimer()
+    t0 = time.perf_counter()
+    fu = get_or_create_file(db, rid, filename, "pdf" if pdf else "csv", hashlib.sha256(data).hexdigest())
+    if pdf:
+        with timer.stage("extract"):
+            rows, fu.pages = parse_pdf_sync(data)
+        _, issues = run_pdf_rows(db, fu, rows, timer, preview_limit=200)
+    else:
+        _, issues, _ = run_csv(db, fu, io.BytesIO(data), timer, preview_limit=200)
+    mark_tagged(fu, issues)
+    db.commit()
+    return fu.id, time.perf_counter() - t0, timer.as_ms()
+
+def _commit(db, fid: int, rid: int) -> tuple[dict, float]:
+    from app.services.ingest.commit import commit_file
+    from app.services import menu_cache
+    t0 = time.perf_counter()
+    out = commit_file(db, fid, rid)
+    menu_cache.bump(db, rid)
+    db.commit()
+    return out, time.perf_counter() - t0
+
+def bench_size(n: int, args, record):
+    from sqlalchemy import func, select
+    from app.db import SessionLocal
+    from app.models import MenuItem
+    from .synth import to_csv, to_pdf
+
+    customers = _reset_db(args)
+    with SessionLocal() as db:
+        if "ingest" in args.only or "list" in args.only:
+            fid, secs, stages = _ingest(db, 1, f"bench-{n}.csv", to_csv(_rows(n, args)), pdf=False)
+            if "ingest" in args.only: record(f"ingest.csv[{n}]", summarize([secs], n, stages_ms=stages))
+            out, secs = _commit(db, fid, 1)
+            if "ingest" in args.only: record(f"ingest.commit[{n}]", summarize([secs], n, **out))
+        # a second restaurant's menu (from the PDF when that size is benched) so restaurant filters select half
+        other = _rows(n, args, seed_offset=1)
+        if "pdf" in args.only and n in args.pdf_sizes:
+            fid, secs, stages = _ingest(db, 2, f"bench-{n}.pdf", to_pdf(other), pdf=True)
+            record(f"ingest.pdf[{n}]", summarize([secs], n, stages_ms=stages))
+        else:
+            fid, _, _ = _ingest(db, 2, f"bench-{n}-2.csv", to_csv(other), pdf=False)
+        _commit(db, fid, 2)
+        items = db.execute(select(func.count()).select_from(MenuItem)).scalar()
+    if "list" in args.only:
+        bench_list(n, items, customers, args, record)
+
+def bench_list(n: int, items: int, customers: list[int], args, record):
+    from app.db import SessionLocal
+    from app.routers.menus import _list_menu_items, NEXT_CURSOR_HEADER
+    from app.services import menu_cache, user_allergens
+
+    users = itertools.cycle(customers)
+    def call(restaurant=None, q=None, safe=False, exclude=None, page=1, after=None):
+        with SessionLocal() as db:
+            return _list_menu_items(db, safe, restaurant, q, exclude, page, args.page_size, after, None, {"id": next(users)})
+    def cold():
+        menu_cache.MENU_CACHE.clear()
+        for uid in customers: user_allergens.invalidate(uid)
+
+    for restaurant in (None, 1):
+        for q in (None, args.q):
+            for safe in (False, True):
+                for exclude in (None, args.exclude):
+                    flags = [k for k, v in (("restaurant", restaurant), ("q", q), ("safe", safe), ("exclude", exclude)) if v]
+                    name = f"menus.list[{n}]{{{','.join(flags) or '-'}}}"
+                    record(name, summarize(timed(lambda: call(restaurant, q, safe, exclude), args.repeat_list, cold),
+                                           items=items))
+    record(f"menus.list[{n}]{{cached}}", summarize(timed(call, args.repeat_list), items=items))
+    deep = max(1, min(50, items // args.page_size))
+    record(f"menus.list[{n}]{{page={deep}}}",
+           summarize(timed(lambda: call(page=deep), args.repeat_list, cold), items=items))
+    cursor = None
+    for _ in range(deep - 1):
+        cursor = call(after=cursor).headers.get(NEXT_CURSOR_HEADER)
+        if not cursor: break
+    if cursor:
+        record(f"menus.list[{n}]{{cursor@{deep}}}",
+               summarize(timed(lambda: call(after=cursor), args.repeat_list, cold), items=items))
+
+# ---------- compare ----------
+
+def compare(base: dict, new: dict, threshold: float, min_ms: float) -> list[tuple[str, str]]:
+    """Print per-case median ratios; returns [(case, verdict)] for cases slower by more than threshold."""
+    b, c = base["results"], new["results"]
+    print(f"base {base['meta'].get('git') or '?'} ({base['meta'].get('created')})  ->  "
+          f"new {new['meta'].get('git') or '?'} ({new['meta'].get('created')})")
+    worse = []
+    for name in sorted(set(b) | set(c)):
+        if name not in c: print(f"  {name:<58} removed"); continue
+        if name not in b: print(f"  {name:<58} new      {c[name]['median_ms']:>10.3f}ms"); continue
+        if b[name].get("rows") != c[name].get("rows"): print(f"  {name:<58} not comparable (row counts differ)"); continue
+        old, cur = b[name]["median_ms"], c[name]["median_ms"]
+        ratio = cur / old if old else float("inf")
+        verdict = ""
+        if cur - old > min_ms and ratio > 1 + threshold: verdict = "REGRESSION"
+        elif old - cur > min_ms and ratio < 1 - threshold: verdict = "faster"
+        print(f"  {name:<58} {old:>10.3f}ms -> {cur:>10.3f}ms  x{ratio:5.2f}  {verdict}")
+        if verdict == "REGRESSION": worse.append((name, f"x{ratio:.2f}"))
+    return worse
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench.suite")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sizes = lambda s: [int(x) for x in s.split(",") if x.strip()]
+
+    r = sub.add_parser("run", help="run the benchmarks and write a JSON result file")
+    r.add_argument("--sizes", type=sizes, default=[1000, 10_000, 100_000], help="menu rows per run (comma-separated)")
+    r.add_argument("--pdf-sizes", type=sizes, default=None, help="sizes that also bench PDF ingest (default: --sizes)")
+    r.add_argument("--only", type=lambda s: set(s.split(",")), default={"tagger", "ingest", "pdf", "list"},
+                   help="subset of tagger,ingest,pdf,list")
+    r.add_argument("--seed", type=int, default=7)
+    r.add_argument("--allergen-density", type=float, default=0.3, help="share of rows mentioning an allergen keyword")
+    r.add_argument("--words", type=int, nargs=2, default=[4, 24], metavar=("MIN", "MAX"), help="description length in words")
+    r.add_argument("--users", type=int, default=500)
+    r.add_argument("--profile-density", type=float, default=0.15, help="chance each allergen is on a user's profile")
+    r.add_argument("--tag-rows", type=int, default=2000)
+    r.add_argument("--repeat-tagger", type=int, default=3)
+    r.add_argument("--repeat-list", type=int, default=20)
+    r.add_argument("--page-size", type=int, default=50)
+    r.add_argument("--q", default="chicken", help="search term for the q= cases")
+    r.add_argument("--exclude", default="1,3", help="excludeAllergenIds for the exclude cases")
+    r.add_argument("--db", help="database URL (default: DATABASE_URL, else a temp SQLite file); tables are dropped")
+    r.add_argument("--out", help="result file (default: bench/results/<utc timestamp>.json)")
+
+    c = sub.add_parser("compare", help="compare two result files")
+    c.add_argument("base"); c.add_argument("new")
+    c.add_argument("--threshold", type=float, default=0.15, help="relative slowdown that counts as a regression")
+    c.add_argument("--min-ms", type=float, default=0.5, help="ignore differences smaller than this (noise)")
+
+    args = ap.parse_args(argv)
+    if args.cmd == "compare":
+        with open(args.base) as f1, open(args.new) as f2:
+            worse = compare(json.load(f1), json.load(f2), args.threshold, args.min_ms)
+        if worse:
+            print(f"{len(worse)} regression(s) over {args.threshold:.0%}: " + ", ".join(f"{n} {r}" for n, r in worse))
+            sys.exit(1)
+        return
+
+    if args.pdf_sizes is None: args.pdf_sizes = args.sizes
+    out = run(args)
+    path = args.out or os.path.join(RESULTS_DIR, datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(out, f, indent=1, sort_keys=True)
+    print(f"wrote {path}")
+
+if __name__ == "__main__":
+    main()
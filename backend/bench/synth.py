@@ -0,0 +1,76 @@
+"""
+Seeded synthetic data for the benchmarks: menus (rows, CSV, text PDF) and users' allergen profiles.
+
+    from bench.synth import menu_rows, to_csv, to_pdf, profiles
+    rows = menu_rows(10_000, allergen_density=0.3, words=(4, 24), seed=7)
+
+Same arguments, same data, so two benchmark runs measure the same work.
+"""
+import csv, io, random
+from app.services.tagging.rules import load_rules
+
+FILLER = ["grilled", "rice", "noodles", "with", "sauce", "fresh", "herbs", "served", "crispy", "house",
+          "chicken", "tomato", "basil", "garlic", "onion", "pepper", "lemon", "roasted", "seasonal",
+          "greens", "spicy", "slow", "cooked", "potatoes", "mushroom", "broth", "salad", "smoked"]
+DISHES = ["bowl", "plate", "curry", "wrap", "salad", "soup", "platter", "skewers", "tart", "stew"]
+
+def menu_rows(n: int, allergen_density: float = 0.3, words: tuple[int, int] = (4, 24), seed: int = 7) -> list[dict]:
+    """
+    n menu rows; each description has words[0]..words[1] filler words and, with probability
+    allergen_density, one or two keywords from the tagger rules (so the tagger has work to do).
+    """
+    rules, _ = load_rules()
+    keywords = [kw for kws in rules.values() for kw in kws]
+    rnd = random.Random(seed)
+    rows = []
+    for i in range(n):
+        desc = [rnd.choice(FILLER) for _ in range(rnd.randint(*words))]
+        if rnd.random() < allergen_density:
+            for _ in range(rnd.choice((1, 1, 2))):
+                desc.insert(rnd.randrange(len(desc) + 1), rnd.choice(keywords))
+        name = f"{rnd.choice(FILLER).title()} {rnd.choice(DISHES)} {i}"
+        rows.append({"item_name": name, "description": " ".join(desc), "price": round(rnd.uniform(4, 40), 2)})
+    return rows
+
+def to_csv(rows: list[dict]) -> bytes:
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(["item_name", "description", "price"])
+    for r in rows: w.writerow([r["item_name"], r["description"], f"{r['price']:.2f}"])
+    return buf.getvalue().encode()
+
+def _pdf_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def to_pdf(rows: list[dict], per_page: int = 40) -> bytes:
+    """
+    Text PDF in the layout services.ingest.pdf parses ("Name - description 12.50" per line),
+    written directly so the benchmarks need no PDF library beyond pdfplumber.
+    """
+    pages = [rows[i:i + per_page] for i in range(0, len(rows), per_page)] or [[]]
+    n = len(pages)
+    # objects: 1 catalog, 2 pages, 3 font, then (page, content) per page
+    objs = [b"<< /Type /Catalog /Pages 2 0 R >>",
+            ("<< /Type /Pages /Count %d /Kids [%s] >>" % (n, " ".join(f"{4 + 2 * k} 0 R" for k in range(n)))).encode(),
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    for k, page in enumerate(pages):
+        lines = "".join(f"({_pdf_escape(r['item_name'] + ' - ' + r['description'][:90])} {r['price']:.2f}) Tj T*\n"
+                        for r in page)
+        stream = f"BT /F1 7 Tf 9 TL 20 820 Td\n{lines}ET".encode("latin-1", "replace")
+        objs.append((f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                     f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * k} 0 R >>").encode())
+        objs.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for i, body in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    out += b"".join(b"%010d 00000 n \n" % o for o in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref)
+    return bytes(out)
+
+def profiles(n: int, allergen_ids: list[int], density: float = 0.15, seed: int = 7) -> list[list[int]]:
+    """n users' allergen profiles: each allergen is on a profile with probability `density`."""
+    rnd = random.Random(seed)
+    return [[a for a in allergen_ids if rnd.random() < density] for _ in range(n)]
@@ -0,0 +1,102 @@
+import os, sys, tempfile
+
+# point the app at a throwaway SQLite file before anything imports app.db
+_tmp = tempfile.mkdtemp(prefix="allergy-menu-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+# per-request statement counts in X-DB-Queries, for assert_max_queries
+os.environ.setdefault("DB_PROFILE", "true")
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+def load_corpus() -> list[tuple[str, str]]:
+    with open(os.path.join(FIXTURES, "menu_corpus.txt"), encoding="utf-8") as f:
+        return [tuple(p.strip() for p in (line.rstrip("\n") + "|").split("|")[:2]) for line in f if line.strip()]
+
+import itertools, pytest
+from fastapi.testclient import TestClient
+
+_ids = itertools.count(1)
+
+@pytest.fixture(scope="session", autouse=True)
+def app():
+    from app.main import app
+    from app.migrate import migrate
+    migrate()  # lifespan only runs under `with TestClient(...)`
+    return app
+
+@pytest.fixture(scope="session")
+def client(app):
+    c = TestClient(app)
+    c.post("/api/allergens/seed")
+    return c
+
+def register(client, role="restaurant") -> dict:
+    n = next(_ids)
+    r = client.post("/api/auth/register", json={"name": f"{role}{n}", "email": f"{role}{n}@example.com",
+                                                "password": "pw", "role": role})
+    assert r.status_code == 200, r.text
+    return {"Authorization": f"Bearer {r.json()['token']}"}
+
+@pytest.fixture
+def restaurant(client):
+    return register(client, "restaurant")
+
+@pytest.fixture
+def customer(client):
+    return register(client, "customer")
+
+def csv_upload(rows: list[tuple[str, str, float]], name="menu.csv"):
+    body = "item_name,description,price\n" + "".join(f'"{n}","{d}",{p}\n' for n, d, p in rows)
+    return {"file": (name, body.encode(), "text/csv")}
+
+class count_statements:
+    """Count SQL statements (an executemany counts once) sent through the app engines."""
+
+    def __enter__(self):
+        from sqlalchemy import event
+        from app.db import engine, async_engine
+        self.count, self.statements = 0, []
+        self._engines = [engine] + ([async_engine.sync_engine] if async_engine is not None else [])
+        for e in self._engines:
+            event.listen(e, "before_cursor_execute", self._on_execute)
+        return self
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+        self.statements.append(statement)
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        for e in self._engines:
+            event.remove(e, "before_cursor_execute", self._on_execute)
+
+def assert_max_queries(response, n: int):
+    """Lock in an endpoint's query budget: fail if the request behind `response` ran more than n statements."""
+    assert "X-DB-Queries" in response.headers, \
+        f"{response.request.method} {response.request.url.path}: no X-DB-Queries header (DB_PROFILE off, or a streamed response)"
+    queries = int(response.headers["X-DB-Queries"])
+    assert queries <= n, f"{response.request.method} {response.request.url.path}: {queries} SQL statements, budget {n}"
+    return queries
+
+def make_pdf(pages: list[list[str]]) -> bytes:
+    """Minimal text-only PDF (Helvetica, one line per entry) for ingest tests."""
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        ops = "BT /F1 11 Tf 14 TL 40 800 Td " + " ".join(
+            "(" + l.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ") Tj T*" for l in lines) + " ET"
+        objs.append(f"<< /Length {len(ops)} >>\nstream\n{ops}\nendstream")
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {len(objs)} 0 R "
+                    f"/Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out, offsets = b"%PDF-1.4\n", []
+    for i, o in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{o}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objs)+1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{off:010d} 00000 n \n" for off in offsets).encode()
+    out += f"trailer\n<< /Size {len(objs)+1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
@@ -0,0 +1,733 @@
+import os, pytest
+from sqlalchemy import text
+from conftest import assert_max_queries, csv_upload, count_statements, make_pdf, register
+
+MENU = [("Pad Thai", "Rice noodles with peanut sauce", 12.5),
+        ("Cheesecake", "Cream cheese, graham crust", 7),
+        ("Green Salad", "Mixed leaves, vinaigrette", 6)]
+
+def test_health(client):
+    assert client.get("/api/health").json() == {"ok": True}
+
+def test_ingest_csv_preview_and_commit(client, restaurant):
+    r = client.post("/api/ingest/csv", files=csv_upload(MENU), headers=restaurant)
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert [p["item_name"] for p in body["preview"]] == [n for n, _, _ in MENU]
+    assert "Peanuts" in body["preview"][0]["predicted_allergens"]
+
+    r = client.post("/api/ingest/commit", params={"fileId": body["fileId"]}, headers=restaurant)
+    assert r.status_code == 200, r.text
+    assert r.json()["created"] == 3
+
+def test_ingest_csv_statement_count_is_independent_of_rows(client, restaurant):
+    # once per process (allergen registry, tagger version id); not what this test measures
+    client.post("/api/ingest/csv", files=csv_upload([("Warm Up", "peanut", 1)], "warm.csv"), headers=restaurant)
+    counts = {}
+    for n in (10, 1500):
+        rows = [(f"Dish {n}-{i}", f"with peanut sauce and noodles {i}", 9.5) for i in range(n)]
+        with count_statements() as q:
+            r = client.post("/api/ingest/csv", files=csv_upload(rows), headers=restaurant)
+        assert r.status_code == 200, r.text
+        counts[n] = q.count
+    # batched upserts: a handful of statements per 1000 rows instead of several per row
+    assert counts[10] <= 10 and counts[1500] <= 30
+
+def test_ingest_csv_reupload_is_idempotent(client, restaurant):
+    from app.db import SessionLocal
+    from app.models import ParsedRow, AllergenPrediction
+    up = csv_upload(MENU)
+    fid = client.post("/api/ingest/csv", files=up, headers=restaurant).json()["fileId"]
+    assert client.post("/api/ingest/csv", files=csv_upload(MENU), headers=restaurant).json()["fileId"] == fid
+    with SessionLocal() as db:
+        rows = db.query(ParsedRow).filter(ParsedRow.file_id == fid).all()
+        assert sorted(r.row_index for r in rows) == [0, 1, 2]
+        preds = db.query(AllergenPrediction).filter(AllergenPrediction.parsed_row_id.in_([r.id for r in rows])).all()
+        assert len({(p.parsed_row_id, p.allergen_id) for p in preds}) == len(preds) > 0
+
+def test_ingest_csv_stream_mode(client, restaurant, monkeypatch):
+    from app.services.ingest import parse
+    monkeypatch.setattr(parse, "CSV_CHUNK_ROWS", 7)
+    rows = [(f"Stream {i}", "peanut sauce" if i % 2 else "plain rice", -1 if i == 20 else 4) for i in range(50)]
+    r = client.post("/api/ingest/csv", params={"stream": True}, files=csv_upload(rows, "big.csv"), headers=restaurant)
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body["rows"] == 50 and body["issues"] == ["Row 21: invalid price"]
+    full = client.post("/api/ingest/csv", files=csv_upload(rows, "big.csv"), headers=restaurant).json()
+    assert full["fileId"] == body["fileId"] and len(full["preview"]) == 50
+    assert body["preview"] == full["preview"][:len(body["preview"])]
+
+def test_ingest_csv_missing_columns(client, restaurant):
+    r = client.post("/api/ingest/csv", files={"file": ("x.csv", b"name,cost\na,1\n", "text/csv")}, headers=restaurant)
+    assert r.status_code == 400 and "Missing columns" in r.json()["detail"]
+
+def test_ingest_pdf_pages_parsed_in_order(client, restaurant):
+    pages = [[f"Dish {p}-{i} - with peanut sauce {i + 1}.50" for i in range(3)] + ["Lunch specials"] for p in range(6)]
+    r = client.post("/api/ingest/pdf", files={"file": ("menu.pdf", make_pdf(pages), "application/pdf")}, headers=restaurant)
+    assert r.status_code == 200, r.text
+    preview = r.json()["preview"]
+    assert [p["item_name"] for p in preview] == [f"Dish {p}-{i}" for p in range(6) for i in range(3)]
+    assert preview[0]["price"] == 1.5 and "Peanuts" in preview[0]["predicted_allergens"]
+
+def test_ingest_work_runs_off_the_event_loop(client, restaurant, monkeypatch):
+    import asyncio
+    from app.routers import ingest
+    on_loop = []
+    def watch(fn):
+        def wrapped(*a, **kw):
+            try: asyncio.get_running_loop(); on_loop.append(fn.__name__)
+            except RuntimeError: pass
+            return fn(*a, **kw)
+        return wrapped
+    for name in ("run_csv", "run_pdf_rows", "get_or_create_file"):
+        monkeypatch.setattr(ingest, name, watch(getattr(ingest, name)))
+    r = client.post("/api/ingest/csv", params={"stream": True}, files=csv_upload(MENU, "loop.csv"), headers=restaurant)
+    assert r.status_code == 200 and r.json()["rows"] == 3 and "truncated" in r.json()
+    assert "rows" not in client.post("/api/ingest/csv", files=csv_upload(MENU, "loop.csv"), headers=restaurant).json()
+    pdf = make_pdf([["Loop Noodles - with peanut sauce 8.50"]])
+    assert client.post("/api/ingest/pdf", files={"file": ("loop.pdf", pdf, "application/pdf")}, headers=restaurant).status_code == 200
+    assert on_loop == []
+
+def test_ingest_pdf_timeout(client, restaurant, monkeypatch):
+    import time
+    from app.services.ingest import pdf
+    doc = make_pdf([["A - b 1.00"], ["C - d 2.00"]])
+    with pytest.raises(pdf.PdfTimeout):  # workers stop at the next page once the caller gave up
+        pdf.extract_range(doc, 0, 2, deadline=time.time() - 1)
+
+    assert client.post("/api/ingest/pdf", files={"file": ("warm.pdf", make_pdf([["W - x 1.00"]]), "application/pdf")},
+                       headers=restaurant).status_code == 200  # pool workers started
+    pool = pdf.get_pool()
+    busy = list(pool._processes.values()) if pool else []
+    assert busy or pdf.PDF_WORKERS == 0
+    monkeypatch.setattr(pdf, "PDF_TIMEOUT_S", 1e-6)
+    r = client.post("/api/ingest/pdf", files={"file": ("slow.pdf", doc, "application/pdf")}, headers=restaurant)
+    assert r.status_code == 422 and "exceeded" in r.json()["detail"]
+    # the timed-out pool's workers are killed, not left running the parse; the next upload gets a fresh pool
+    for proc in busy: proc.join(5)
+    assert not any(proc.is_alive() for proc in busy) and (pool is None or pdf.get_pool() is not pool)
+    monkeypatch.setattr(pdf, "PDF_TIMEOUT_S", 120)
+    r = client.post("/api/ingest/pdf", files={"file": ("ok.pdf", make_pdf([["A - b 1.00", "C - d 2.00"]]),
+                                                       "application/pdf")}, headers=restaurant)
+    assert r.status_code == 200 and len(r.json()["preview"]) == 2 and pdf.get_pool() is not pool
+
+def _wait_job(client, headers, job_id, timeout=20):
+    import time
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        body = client.get(f"/api/ingest/jobs/{job_id}", headers=headers).json()
+        if body["status"] in ("done", "failed"): return body
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} still {body['status']}")
+
+def test_ingest_background_jobs(client, restaurant, customer):
+    r = client.post("/api/ingest/csv", params={"background": True}, files=csv_upload(MENU, "bg.csv"), headers=restaurant)
+    assert r.status_code == 202, r.text
+    body = _wait_job(client, restaurant, r.json()["jobId"])
+    assert body["status"] == "done" and body["rowsProcessed"] == 3 and body["fileId"]
+    assert {"read", "parse", "tag", "persist"} <= set(body["timings"])
+    assert [p["item_name"] for p in body["preview"]] == [n for n, _, _ in MENU]
+
+    pdf = make_pdf([["Satay - peanut sauce 9.00"], ["Miso Soup - miso, tofu 4.50"]])
+    r = client.post("/api/ingest/pdf", params={"background": True}, files={"file": ("bg.pdf", pdf, "application/pdf")},
+                    headers=restaurant)
+    body = _wait_job(client, restaurant, r.json()["jobId"])
+    assert body["status"] == "done" and body["rowsProcessed"] == 2
+
+    r = client.post("/api/ingest/csv", params={"background": True},
+                    files={"file": ("bad.csv", b"name\nx\n", "text/csv")}, headers=restaurant)
+    body = _wait_job(client, restaurant, r.json()["jobId"])
+    assert body["status"] == "failed" and "Missing columns" in body["error"]
+    assert client.get(f"/api/ingest/jobs/{body['jobId']}", headers=register(client)).status_code == 404
+
+def test_ingest_jobs_recovered_after_restart(client, restaurant):
+    from datetime import datetime, timedelta
+    from app.db import SessionLocal
+    from app.models import IngestJob
+    from app.services.ingest import jobs
+    path = jobs.spool_path("left.csv")
+    with open(path, "wb") as f: f.write(csv_upload(MENU)["file"][1])
+    rid = _user_id(restaurant)
+    old = datetime.utcnow() - timedelta(hours=1)
+    with SessionLocal() as db:
+        alive = IngestJob(restaurant_id=rid, filename="left.csv", filetype="csv", sha256="abc", spool_path=path,
+                          status="running", updated_at=old)
+        lost = IngestJob(restaurant_id=rid, filename="gone.csv", filetype="csv", sha256="def",
+                         spool_path=path + ".missing", status="running", updated_at=old)
+        db.add_all([alive, lost]); db.commit()
+        ids = alive.id, lost.id
+    assert ids[0] in jobs.recover_jobs()
+    assert _wait_job(client, restaurant, ids[0])["rowsProcessed"] == 3
+    assert _wait_job(client, restaurant, ids[1])["status"] == "failed"
+    assert not os.path.exists(path)
+
+def _user_id(headers) -> int:
+    import jwt
+    return jwt.decode(headers["Authorization"].split()[1], options={"verify_signature": False})["id"]
+
+def test_identical_reupload_served_from_stored_predictions(client, restaurant, monkeypatch):
+    from app.services.ingest import pipeline
+    from app.services.tagging import pipeline as tagger
+    rows = MENU + [("No Price", "plain", "abc")]
+    first = client.post("/api/ingest/csv", files=csv_upload(rows, "weekly.csv"), headers=restaurant).json()
+
+    def boom(*a, **k): raise AssertionError("re-tagged an unchanged file")
+    monkeypatch.setattr(tagger, "tag_texts", boom)
+    with count_statements() as q:
+        again = client.post("/api/ingest/csv", files=csv_upload(rows, "weekly.csv"), headers=restaurant).json()
+    assert again == first and q.count <= 6
+    streamed = client.post("/api/ingest/csv", params={"stream": True}, files=csv_upload(rows, "weekly.csv"),
+                           headers=restaurant).json()
+    assert streamed["rows"] == 4 and streamed["preview"] == first["preview"]
+
+    # a new tagger version re-tags
+    monkeypatch.setattr(tagger, "RULES_VER", "changed")
+    with pytest.raises(AssertionError, match="re-tagged"):
+        client.post("/api/ingest/csv", files=csv_upload(rows, "weekly.csv"), headers=restaurant)
+
+def _commit(client, headers, rows, name):
+    up = client.post("/api/ingest/csv", files=csv_upload(rows, name), headers=headers).json()
+    r = client.post("/api/ingest/commit", params={"fileId": up["fileId"]}, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json(), {p["item_name"]: set(p["predicted_allergens"]) for p in up["preview"]}
+
+def _menu_allergens(headers) -> dict[str, set[str]]:
+    from app.db import SessionLocal
+    from app.models import MenuItem
+    with SessionLocal() as db:
+        items = db.query(MenuItem).filter(MenuItem.restaurant_id == _user_id(headers)).all()
+        return {mi.item_name: {a.name for a in mi.allergens} for mi in items}
+
+def test_ingest_commit_is_diff_aware(client, restaurant):
+    counts, predicted = _commit(client, restaurant, MENU, "v1.csv")
+    assert counts == {"ok": True, "created": 3, "updated": 0, "unchanged": 0}
+    before = _menu_allergens(restaurant)
+    assert before == predicted and "Peanuts" in before[MENU[0][0]]
+
+    # committing the same file again writes nothing
+    assert _commit(client, restaurant, MENU, "v1.csv")[0]["unchanged"] == 3
+    assert _menu_allergens(restaurant) == before
+
+    # one description changed (matched case-insensitively), one dish added
+    name, _, price = MENU[0]
+    v2 = [(name.upper(), "steamed rice", price)] + MENU[1:] + [("Prawn Toast", "shrimp on bread", 6.0)]
+    counts, predicted = _commit(client, restaurant, v2, "v2.csv")
+    assert counts == {"ok": True, "created": 1, "updated": 1, "unchanged": 2}
+    after = _menu_allergens(restaurant)
+    assert set(after) == {name.upper(), *[n for n, _, _ in MENU[1:]], "Prawn Toast"}
+    # the changed item's allergens are replaced by its new predictions
+    assert after[name.upper()] == predicted[name.upper()] and after["Prawn Toast"] == predicted["Prawn Toast"]
+
+def test_ingest_commit_keeps_same_name_dishes(client, restaurant):
+    from app.db import SessionLocal
+    from app.models import MenuItem
+    menu = [("Curry", "chicken and peanuts", 12.0), ("Curry", "tofu and cashew", 11.0), ("Curry", "chicken and peanuts", 12.0)]
+    assert _commit(client, restaurant, menu, "dup.csv")[0] == {"ok": True, "created": 3, "updated": 0, "unchanged": 0}
+    assert _commit(client, restaurant, menu, "dup.csv")[0]["unchanged"] == 3
+    # only the second curry changed; it takes over one of the items named Curry
+    v2 = [menu[0], ("Curry", "tofu and sesame", 11.0), menu[2]]
+    counts, _ = _commit(client, restaurant, v2, "dup2.csv")
+    assert counts == {"ok": True, "created": 0, "updated": 1, "unchanged": 2}
+    up = client.post("/api/ingest/csv", files=csv_upload(v2[1:2], "one.csv"), headers=restaurant).json()
+    with SessionLocal() as db:
+        items = db.query(MenuItem).filter(MenuItem.restaurant_id == _user_id(restaurant)).all()
+        assert sorted(mi.description for mi in items) == ["chicken and peanuts", "chicken and peanuts", "tofu and sesame"]
+        assert [{a.name for a in mi.allergens} for mi in items if mi.description == "tofu and sesame"] == \
+            [set(up["preview"][0]["predicted_allergens"])]
+
+def test_ingest_commit_statement_count_is_independent_of_rows(client, restaurant):
+    # once per process (allergen registry, tagger version id); not what this test measures
+    client.post("/api/ingest/csv", files=csv_upload([("Warm Up", "peanut", 1)], "warm.csv"), headers=restaurant)
+    counts = {}
+    for n in (10, 1500):
+        rows = [(f"Dish {n}-{i}", f"with peanut sauce and noodles {i}", 9.5) for i in range(n)]
+        fid = client.post("/api/ingest/csv", files=csv_upload(rows), headers=restaurant).json()["fileId"]
+        with count_statements() as q:
+            r = client.post("/api/ingest/commit", params={"fileId": fid}, headers=restaurant)
+        assert r.json()["created"] == n
+        counts[n] = q.count
+    assert counts[1500] == counts[10], counts
+
+def test_allergen_mask_tracks_menu_allergens(client, restaurant, customer):
+    from app.db import SessionLocal
+    from app.models import Allergen, MenuItem
+    from app.services import allergen_mask
+    _commit(client, restaurant, MENU, "mask.csv")
+    with SessionLocal() as db:
+        assert allergen_mask.verify(db) == []
+        # ORM edits on either side of the relationship keep the mask in sync
+        mi = db.query(MenuItem).filter(MenuItem.restaurant_id == _user_id(restaurant)).first()
+        sesame = db.query(Allergen).filter(Allergen.name == "Sesame").one()
+        mi.allergens = [sesame]; db.commit()
+        assert mi.allergen_mask == allergen_mask.bit(sesame.id)
+        sesame.menu_items.remove(mi); db.commit()
+        assert allergen_mask.verify(db) == [] and mi.allergen_mask == 0
+
+        db.execute(text("UPDATE menu_items SET allergen_mask = 0"))
+        assert allergen_mask.verify(db) != []
+        allergen_mask.backfill(db)
+        assert allergen_mask.verify(db) == []
+        db.commit()
+
+    allergens = {a["name"]: a["id"] for a in client.get("/api/allergens").json()}
+    client.put("/api/allergens/me", json={"allergyIds": [allergens["Peanuts"]]}, headers=customer)
+    rid = _user_id(restaurant)
+    safe = client.get("/api/menus", params={"safeForUser": True, "restaurantId": rid}, headers=customer).json()
+    assert safe and all("Peanuts" not in m["allergens"] for m in safe)
+    excl = client.get("/api/menus", params={"excludeAllergenIds": f"{allergens['Dairy']},999", "restaurantId": rid},
+                      headers=customer).json()
+    every = client.get("/api/menus", params={"restaurantId": rid}, headers=customer).json()
+    assert [m["id"] for m in excl] == [m["id"] for m in every if "Dairy" not in m["allergens"]]
+
+    # an allergen id past the mask's range (e.g. after burnt sequence values) has no bit; the filters
+    # check it against menu_allergens instead of ignoring it
+    from app.services import menu_cache, user_allergens
+    with SessionLocal() as db:
+        db.execute(text("INSERT INTO allergens (id, name) VALUES (64, 'Lupin')"))
+        db.execute(text("INSERT INTO user_allergies (user_id, allergen_id) VALUES (:u, 64)"), {"u": _user_id(customer)})
+        mi = db.get(MenuItem, safe[0]["id"])
+        mi.allergens.append(db.get(Allergen, 64))
+        menu_cache.bump(db, rid); db.commit()
+        assert mi.allergen_mask == allergen_mask.mask_of(a.id for a in mi.allergens if a.id != 64)
+        assert allergen_mask.verify(db) == []
+        user_allergens.invalidate(_user_id(customer))
+    r = client.get("/api/menus", params={"safeForUser": True, "restaurantId": rid}, headers=customer)
+    assert r.status_code == 200 and [m["id"] for m in r.json()] == [m["id"] for m in safe[1:]]
+    excl = client.get("/api/menus", params={"excludeAllergenIds": "64", "restaurantId": rid}, headers=customer).json()
+    assert [m["id"] for m in excl] == [m["id"] for m in every if m["id"] != mi.id]
+    with SessionLocal() as db:
+        for t in ("menu_allergens", "user_allergies"): db.execute(text(f"DELETE FROM {t} WHERE allergen_id = 64"))
+        db.execute(text("DELETE FROM allergens WHERE id = 64"))
+        menu_cache.bump(db, rid); db.commit()
+    user_allergens.invalidate(_user_id(customer))
+
+def test_menus_batch_upsert(client, restaurant, customer, monkeypatch):
+    from app.services.tagging import pipeline as tagger
+    def tags(it): return [a for a, _ in sum(tagger.tag_text(it["item_name"], it["description"])[:2], [])]
+    rid = _user_id(restaurant)
+    items = [{"item_name": "Pad Thai", "description": "Rice noodles with peanut sauce", "price": 9, "externalId": "pos-1"},
+             {"item_name": "Garden Salad", "description": "lettuce", "price": 7, "externalId": "pos-2"},
+             {"item_name": "Special", "description": "", "price": 5}]
+    r = client.post("/api/menus/batch", json={"items": items}, headers=restaurant)
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert (body["created"], body["updated"], body["unchanged"]) == (3, 0, 0)
+    assert [x["allergens"] for x in body["results"]] == [tags(it) for it in items] and "Peanuts" in tags(items[0])
+    ids = [x["id"] for x in body["results"]]
+
+    # externalId upserts; items without one are always new
+    items[1]["description"] = "lettuce, sesame dressing"
+    r = client.post("/api/menus/batch", json={"items": items}, headers=restaurant).json()
+    assert [(x["id"], x["status"]) for x in r["results"]][:2] == [(ids[0], "unchanged"), (ids[1], "updated")]
+    assert sorted(r["results"][0]["allergens"]) == sorted(tags(items[0])) and r["results"][2]["id"] not in ids
+    assert _menu_allergens(restaurant) == {it["item_name"]: set(tags(it)) for it in items}
+    listed = client.get("/api/menus", params={"restaurantId": rid, "excludeAllergenIds": "1"}, headers=customer)
+    assert sorted(m["item_name"] for m in listed.json()) == \
+        sorted(it["item_name"] for it in items + items[2:] if "Peanuts" not in tags(it))
+
+    # validated together: every bad item reported, nothing written
+    bad = [{"item_name": " ", "price": 1}, {"item_name": "A", "price": 1, "externalId": "x"},
+           {"item_name": "B", "price": 1, "externalId": "x"}]
+    r = client.post("/api/menus/batch", json={"items": bad}, headers=restaurant)
+    assert r.status_code == 422 and [e["index"] for e in r.json()["detail"]] == [0, 2]
+    assert len(_menu_allergens(restaurant)) == 3
+
+    # a tag with no allergens row is neither linked nor reported
+    from app.services.allergen_registry import ALLERGENS
+    id_for = ALLERGENS.id_for
+    monkeypatch.setattr(ALLERGENS, "id_for", lambda name, db=None: None if name == "Peanuts" else id_for(name, db))
+    item = {"item_name": "Satay", "description": "peanut sauce and egg", "price": 8}
+    res = client.post("/api/menus/batch", json={"items": [item]}, headers=restaurant).json()["results"][0]
+    monkeypatch.undo()
+    assert "Peanuts" in tags(item) and res["allergens"] == [a for a in tags(item) if a != "Peanuts"]
+    assert _menu_allergens(restaurant)["Satay"] == set(res["allergens"])
+
+    # one transaction of bulk statements, whatever the batch size
+    small = client.post("/api/menus/batch", json={"items": [{"item_name": f"S{i}", "description": "egg", "price": 1,
+                                                              "externalId": f"s{i}"} for i in range(3)]}, headers=restaurant)
+    big = client.post("/api/menus/batch", json={"items": [{"item_name": f"B{i}", "description": "egg", "price": 1,
+                                                            "externalId": f"b{i}"} for i in range(60)]}, headers=restaurant)
+    assert small.headers["X-DB-Queries"] == big.headers["X-DB-Queries"]
+    assert_max_queries(big, 14)
+
+def test_menus_keyset_pagination(client, restaurant):
+    rid = _user_id(restaurant)
+    _commit(client, restaurant, [(f"Cursor Dish {i}", "", 5) for i in range(7)], "cursor.csv")
+    params = {"restaurantId": rid, "pageSize": 3}
+    first = client.get("/api/menus", params=params, headers=restaurant)
+    seen, cursor = [m["id"] for m in first.json()], first.headers["X-Next-Cursor"]
+    # items added mid-scroll don't shift the next pages
+    _commit(client, restaurant, [("Late Arrival", "", 5)], "late.csv")
+    while cursor:
+        r = client.get("/api/menus", params={**params, "after": cursor}, headers=restaurant)
+        seen += [m["id"] for m in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+    offset = [m["id"] for p in (1, 2, 3) for m in client.get("/api/menus", params={**params, "page": p},
+                                                             headers=restaurant).json()]
+    assert len(seen) == 7 and seen == sorted(seen, reverse=True) and offset[1:] == seen
+
+    assert client.get("/api/menus", params={**params, "after": "garbage"}, headers=restaurant).status_code == 400
+    other = client.get("/api/menus", params={**params, "q": "dish", "after": first.headers["X-Next-Cursor"]},
+                       headers=restaurant)
+    assert other.status_code == 400
+
+def test_menus_full_text_search(client, restaurant):
+    rid = _user_id(restaurant)
+    _commit(client, restaurant, [("Tofu Stir Fry", "wok tossed vegetables", 9),
+                                 ("Veggie Curry", "tofu, chickpeas and spinach", 11),
+                                 ("Tofu Tofu Bowl", "silken tofu over rice", 10),
+                                 ("Burger", "beef patty", 12)], "search.csv")
+    def ids(**params):
+        return [m["item_name"] for m in client.get("/api/menus", params={"restaurantId": rid, **params},
+                                                   headers=restaurant).json()]
+    hits = ids(q="tof")  # prefix match
+    assert set(hits) == {"Tofu Stir Fry", "Veggie Curry", "Tofu Tofu Bowl"} and hits[0] == "Tofu Tofu Bowl"
+    assert ids(q="TOFU rice") == ["Tofu Tofu Bowl"]
+    assert ids(q="wok") == ["Tofu Stir Fry"]
+
+    # index follows updates from create + commit
+    client.post("/api/menus", json={"item_name": "Smoked Tofu Salad", "price": 8}, headers=restaurant)
+    assert "Smoked Tofu Salad" in ids(q="smok")
+    _commit(client, restaurant, [("Burger", "grilled portobello", 12)], "search2.csv")
+    assert ids(q="portobello") == ["Burger"] and ids(q="beef") == []
+
+    # cursor paging over ranked results
+    first = client.get("/api/menus", params={"restaurantId": rid, "q": "tofu", "pageSize": 2}, headers=restaurant)
+    rest = client.get("/api/menus", params={"restaurantId": rid, "q": "tofu", "pageSize": 2,
+                                            "after": first.headers["X-Next-Cursor"]}, headers=restaurant)
+    assert [m["item_name"] for m in first.json() + rest.json()] == ids(q="tofu")
+    # the same query in another casing shares the cached page, and its cursor pages the other casing
+    params = {"restaurantId": rid, "pageSize": 3}
+    lower = client.get("/api/menus", params={**params, "q": "tofu"}, headers=restaurant)
+    cased = client.get("/api/menus", params={**params, "q": "Tofu"}, headers=restaurant)
+    assert cased.json() == lower.json() and cased.headers["X-Next-Cursor"] == lower.headers["X-Next-Cursor"]
+    r = client.get("/api/menus", params={**params, "q": "Tofu", "after": cased.headers["X-Next-Cursor"]},
+                   headers=restaurant)
+    assert r.status_code == 200 and [m["item_name"] for m in lower.json() + r.json()] == ids(q="tofu")
+
+    # ranks move with any write: a search cursor from before one is refused rather than skipping rows
+    client.post("/api/menus", json={"item_name": "Tofu Katsu", "price": 11}, headers=restaurant)
+    stale = client.get("/api/menus", params={**params, "q": "tofu", "after": lower.headers["X-Next-Cursor"]},
+                       headers=restaurant)
+    assert stale.status_code == 409
+    again = client.get("/api/menus", params={**params, "q": "tofu"}, headers=restaurant)
+    rest = client.get("/api/menus", params={**params, "q": "tofu", "after": again.headers["X-Next-Cursor"]},
+                      headers=restaurant)
+    assert [m["item_name"] for m in again.json() + rest.json()] == ids(q="tofu") and "Tofu Katsu" in ids(q="tofu")
+    # plain listings keep their id cursors across writes
+    plain = client.get("/api/menus", params=params, headers=restaurant)
+    client.post("/api/menus", json={"item_name": "Miso Soup", "price": 4}, headers=restaurant)
+    assert client.get("/api/menus", params={**params, "after": plain.headers["X-Next-Cursor"]},
+                      headers=restaurant).status_code == 200
+
+def test_menus_response_cache_and_etag(client, restaurant, customer):
+    from app.services.menu_cache import MENU_CACHE
+    rid = _user_id(restaurant)
+    _commit(client, restaurant, MENU, "etag.csv")
+    params = {"restaurantId": rid, "safeForUser": True}
+    first = client.get("/api/menus", params=params, headers=customer)
+    tag = first.headers["ETag"]
+
+    hits = MENU_CACHE.hits
+    with count_statements() as q:
+        again = client.get("/api/menus", params=params, headers=customer)
+    assert again.json() == first.json() and again.headers["ETag"] == tag
+    assert MENU_CACHE.hits == hits + 1 and not any("menu_items" in s for s in q.statements)
+    assert client.get("/api/menus", params=params, headers={**customer, "If-None-Match": tag}).status_code == 304
+
+    # the user's allergen set is part of the key
+    allergens = {a["name"]: a["id"] for a in client.get("/api/allergens").json()}
+    client.put("/api/allergens/me", json={"allergyIds": [allergens["Dairy"]]}, headers=customer)
+    assert client.get("/api/menus", params=params, headers=customer).headers["ETag"] != tag
+
+    # writes to the restaurant's menu bump its version
+    client.put("/api/allergens/me", json={"allergyIds": []}, headers=customer)
+    tag = client.get("/api/menus", params=params, headers=customer).headers["ETag"]
+    client.post("/api/menus", json={"item_name": "New Special", "price": 5}, headers=restaurant)
+    fresh = client.get("/api/menus", params=params, headers={**customer, "If-None-Match": tag})
+    assert fresh.status_code == 200 and fresh.json()[0]["item_name"] == "New Special"
+    tag = fresh.headers["ETag"]
+    _commit(client, restaurant, [("Cheesecake", "now with berries", 8)], "etag2.csv")
+    assert client.get("/api/menus", params=params, headers={**customer, "If-None-Match": tag}).status_code == 200
+
+    assert client.get("/api/menus/cache/stats", headers=customer).status_code == 403
+
+def test_safe_for_user_reads_cached_allergen_profile(client, restaurant, customer):
+    rid = _user_id(restaurant)
+    _commit(client, restaurant, MENU, "profile.csv")
+    allergens = {a["name"]: a["id"] for a in client.get("/api/allergens").json()}
+    client.put("/api/allergens/me", json={"allergyIds": [allergens["Peanuts"]]}, headers=customer)
+    params = {"restaurantId": rid, "safeForUser": True}
+    client.get("/api/menus", params=params, headers=customer)
+    with count_statements() as q:
+        r = client.get("/api/menus", params={**params, "pageSize": 7}, headers=customer)
+    assert not any("user_allergies" in s or "FROM users" in s for s in q.statements), q.statements
+    assert r.json() and all("Peanuts" not in m["allergens"] for m in r.json())
+
+    # PUT /me takes effect on the next request
+    client.put("/api/allergens/me", json={"allergyIds": [allergens["Dairy"]]}, headers=customer)
+    safe = client.get("/api/menus", params={**params, "pageSize": 7}, headers=customer).json()
+    every = client.get("/api/menus", params={"restaurantId": rid}, headers=customer).json()
+    assert safe == [m for m in every if "Dairy" not in m["allergens"]] and len(safe) < len(every)
+
+def test_allergen_registry_and_bulk_seed(client):
+    from app.db import SessionLocal
+    from app.services.allergen_registry import ALLERGENS
+    with count_statements() as q:
+        r = client.post("/api/allergens/seed")
+    assert r.json() == {"ok": True, "count": 9}
+    assert sum("INSERT INTO allergens" in s for s in q.statements) == 1
+
+    listed = {a["name"]: a["id"] for a in client.get("/api/allergens").json()}
+    with SessionLocal() as db, count_statements() as q:
+        assert ALLERGENS.id_for("peanuts", db) == ALLERGENS.id_for("Peanut", db) == listed["Peanuts"]
+        assert ALLERGENS.id_for("MILK", db) == listed["Dairy"] and ALLERGENS.id_for("tree nut", db) == listed["Tree Nuts"]
+        assert ALLERGENS.name_for(listed["Sesame"], db) == "Sesame"
+        assert q.count == 0
+
+def test_allergen_registry_reloads_on_unknown_id(client, restaurant, customer, monkeypatch):
+    from app.db import SessionLocal
+    from app.services import allergen_registry
+    from app.services.allergen_registry import ALLERGENS
+    _commit(client, restaurant, MENU, "stale.csv")
+    rid = _user_id(restaurant)
+    with SessionLocal() as db:
+        ALLERGENS.refresh(db)  # just loaded: a miss alone wouldn't reload for RELOAD_ON_MISS_S
+        # added behind the registry's back (another process, a migration)
+        aid = db.execute(text("INSERT INTO allergens (name) VALUES ('Mustard') RETURNING id")).scalar()
+        mid = db.execute(text("SELECT MIN(id) FROM menu_items WHERE restaurant_id = :r"), {"r": rid}).scalar()
+        db.execute(text("INSERT INTO menu_allergens (menu_id, allergen_id) VALUES (:m, :a)"), {"m": mid, "a": aid})
+        db.commit()
+    assert client.put("/api/allergens/me", json={"allergyIds": [aid, 999]}, headers=customer).json() == {"ok": True}
+    with SessionLocal() as db:
+        assert db.execute(text("SELECT allergen_id FROM user_allergies WHERE user_id = :u"),
+                          {"u": _user_id(customer)}).scalars().all() == [aid]
+    monkeypatch.setattr(allergen_registry, "RELOAD_ON_MISS_S", 0)
+    with SessionLocal() as db:
+        db.execute(text("DELETE FROM allergens WHERE id = :a"), {"a": aid}); db.commit()
+        ALLERGENS.refresh(db)
+        db.execute(text("INSERT INTO allergens (id, name) VALUES (:a, 'Celery')"), {"a": aid}); db.commit()
+    items = client.get("/api/menus", params={"restaurantId": rid}, headers=customer).json()
+    assert "Celery" in next(m for m in items if m["id"] == mid)["allergens"]
+    # an id that is gone for good is dropped, not reported as null
+    from app.services import menu_cache
+    with SessionLocal() as db:
+        db.execute(text("DELETE FROM allergens WHERE id = :a"), {"a": aid})
+        menu_cache.bump(db, rid); db.commit()
+    items = client.get("/api/menus", params={"restaurantId": rid}, headers=customer).json()
+    assert all(None not in m["allergens"] for m in items)
+    with SessionLocal() as db:
+        for t in ("menu_allergens", "user_allergies"): db.execute(text(f"DELETE FROM {t} WHERE allergen_id = :a"), {"a": aid})
+        db.commit()
+
+def test_rules_hot_reload_and_incremental_retag(client, restaurant, monkeypatch, tmp_path):
+    import json, shutil
+    from app.db import SessionLocal
+    from app.services import retag
+    from app.services.tagging import pipeline as tagger, rules as rules_mod
+    for f in rules_mod.rules_paths(): shutil.copy(f, tmp_path)
+    monkeypatch.setattr(rules_mod, "RULES_DIR", str(tmp_path))
+    old_version = tagger.MODEL_VERSION
+    try:
+        menu = [("Zaatar Flatbread", "oven baked", 6), ("Plain Rice", "steamed", 3)]
+        _commit(client, restaurant, menu, "zaatar.csv")
+        assert "Sesame" not in _menu_allergens(restaurant)["Zaatar Flatbread"]
+
+        # editing the rules file is picked up by the next tag call
+        kw = json.loads((tmp_path / "allergen_keywords.json").read_text())
+        kw["Sesame"].append("zaatar")
+        (tmp_path / "allergen_keywords.json").write_text(json.dumps(kw))
+        monkeypatch.setattr(tagger, "_next_check", 0.0)
+        tagger.tag_text("x", "")
+        assert tagger.MODEL_VERSION != old_version
+
+        with SessionLocal() as db:
+            first = retag.retag(db, batch=1, max_batches=1)
+            assert first.status == "paused" and first.rows_scanned == 1
+            run = retag.retag(db, batch=50)  # resumes from the checkpoint
+            assert run.id == first.id and run.status == "done"
+            assert 0 < run.rows_changed < run.rows_scanned
+            assert retag.retag(db).rows_scanned == 0  # nothing left on the old version
+        assert "Sesame" in _menu_allergens(restaurant)["Zaatar Flatbread"]
+        assert _menu_allergens(restaurant)["Plain Rice"] == _commit(client, restaurant, menu, "zaatar.csv")[1]["Plain Rice"]
+        with SessionLocal() as db:
+            from app.services import allergen_mask
+            assert allergen_mask.verify(db) == []
+
+        admin = register(client, "admin")
+        assert client.get("/api/tagger", headers=admin).json()["modelVersion"] == tagger.MODEL_VERSION
+        assert client.post("/api/tagger/retag", headers=admin).status_code == 202
+        assert client.post("/api/tagger/reload", headers=restaurant).status_code == 403
+    finally:
+        monkeypatch.undo()
+        tagger.reload()
+
+def test_prediction_versions_and_retention(client, restaurant):
+    from datetime import datetime
+    from app.db import SessionLocal
+    from app.services import retention
+    rows = MENU + [("Tofu Bowl", "soy glazed tofu", 9)]
+    up = client.post("/api/ingest/csv", files=csv_upload(rows, "old.csv"), headers=restaurant).json()
+    fid = up["fileId"]
+    assert client.post("/api/ingest/commit", params={"fileId": fid}, headers=restaurant).status_code == 200
+    row_preds = text("SELECT COUNT(*), COUNT(DISTINCT ap.version_id) FROM allergen_predictions ap "
+                     "JOIN parsed_rows pr ON pr.id = ap.parsed_row_id WHERE pr.file_id = :f")
+    with SessionLocal() as db:
+        kept, versions = db.execute(row_preds, {"f": fid}).one()
+        assert kept > 0 and versions == 1  # one small tagger_versions id, not the version strings
+        old = text("UPDATE files SET created_at = :t, committed_at = :t, used_at = :t WHERE id = :f")
+        db.execute(old, {"t": datetime(2000, 1, 1), "f": fid}); db.commit()
+    # an identical re-upload (served from the stored preview) counts as use: not compacted under the commit
+    assert client.post("/api/ingest/csv", files=csv_upload(rows, "old.csv"), headers=restaurant).json() == up
+    with SessionLocal() as db:
+        assert retention.compact(db, days=30, dry_run=True)["files"] == 0
+        db.execute(old, {"t": datetime(2000, 1, 1), "f": fid}); db.commit()
+        dry = retention.compact(db, days=30, dry_run=True)
+        assert (dry["files"], dry["predictions"]) == (1, kept) and db.execute(row_preds, {"f": fid}).one()[0] == kept
+        done = retention.compact(db, days=30)
+        assert (done["files"], done["predictions"]) == (1, kept) and db.execute(row_preds, {"f": fid}).one()[0] == 0
+        assert retention.compact(db, days=30)["files"] == 0
+
+    # menu items keep their own predictions; the compacted file has to be uploaded again to commit
+    assert _menu_allergens(restaurant) == {p["item_name"]: set(p["predicted_allergens"]) for p in up["preview"]}
+    assert client.post("/api/ingest/commit", params={"fileId": fid}, headers=restaurant).status_code == 409
+    again = client.post("/api/ingest/csv", files=csv_upload(rows, "old.csv"), headers=restaurant).json()
+    assert again == up
+    assert client.post("/api/ingest/commit", params={"fileId": fid}, headers=restaurant).status_code == 200
+
+def _metric(text: str, line_prefix: str) -> float:
+    return sum(float(l.rsplit(" ", 1)[1]) for l in text.splitlines() if l.startswith(line_prefix))
+
+def test_metrics_endpoint(client, restaurant):
+    before = client.get("/api/metrics").text
+    rows = [(f"Metric dish {i}", "with peanut sauce", 9) for i in range(40)]
+    _commit(client, restaurant, rows, "metrics.csv")
+    client.get("/api/no-such-route")
+    r = client.get("/api/metrics")
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+    text = r.text
+
+    # per-route counts and latency, labelled by path template
+    assert _metric(text, 'http_requests_total{method="POST",route="/api/ingest/csv",status="200"}') >= 1
+    assert 'http_request_duration_seconds_bucket{method="POST",route="/api/ingest/commit",le="+Inf"}' in text
+    assert 'route="unmatched",status="404"' in text and "/api/no-such-route" not in text
+    assert "http_requests_in_flight 1" in text  # the scrape itself
+    # ingest stages, rows and throughput
+    for stage in ("hash", "parse", "tag", "persist", "commit"):
+        assert f'ingest_stage_duration_seconds_count{{filetype="csv",step="ingest",stage="{stage}"}}' in text
+    for step in ("ingest", "commit"):
+        key = f'ingest_rows_total{{filetype="csv",step="{step}"}}'
+        assert _metric(text, key) - _metric(before, key) == 40
+        assert _metric(text, f'ingest_rows_per_second{{filetype="csv",step="{step}"}}') > 0
+    # cache counters
+    assert 'cache_hits_total{cache="menu"}' in text and "tagger_cache_hit_ratio" in text
+
+def test_per_request_query_budgets(client, restaurant, customer):
+    # regression guard for N+1s: per-row lookups in ingest/commit, lazy profile loads in listings
+    rows = [(f"Budget dish {i}", "with peanut sauce and cream cheese", 9) for i in range(300)]
+    up = client.post("/api/ingest/csv", files=csv_upload(rows, "budget.csv"), headers=restaurant)
+    assert float(up.headers["X-DB-Time-ms"]) > 0
+    assert_max_queries(up, 12)
+    assert_max_queries(client.post("/api/ingest/commit", params={"fileId": up.json()["fileId"]}, headers=restaurant), 14)
+    assert_max_queries(client.put("/api/allergens/me", json={"allergyIds": [1, 3]}, headers=customer), 5)
+    first = client.get("/api/menus", params={"safeForUser": True, "pageSize": 100}, headers=customer)
+    assert_max_queries(first, 4)
+    # streamed bodies run queries after the headers went out: no (undercounted) budget headers
+    export = client.get("/api/menus/export", headers=restaurant)
+    assert export.status_code == 200 and "X-DB-Queries" not in export.headers
+    etag = client.get("/api/menus", params={"safeForUser": True, "pageSize": 100}, headers={**customer, "If-None-Match": first.headers["ETag"]})
+    assert etag.status_code == 304 and "X-DB-Queries" in etag.headers
+    with pytest.raises(AssertionError, match="no X-DB-Queries header"):
+        assert_max_queries(export, 100)
+    assert_max_queries(client.get("/api/menus", params={"safeForUser": True, "pageSize": 100}, headers=customer), 1)
+    assert_max_queries(client.get("/api/allergens"), 1)
+
+def test_slow_query_log(client, customer, monkeypatch, caplog):
+    from app.services import db_profile
+    monkeypatch.setattr(db_profile, "DB_SLOW_QUERY_MS", 1e-6)
+    with caplog.at_level("WARNING", logger=db_profile.__name__):
+        client.get("/api/menus", params={"q": "slowquery"}, headers=customer)
+    assert any("slow query" in m and "[GET /api/menus]" in m and "SELECT" in m for m in caplog.messages)
+
+def test_menus_ndjson_export(client, restaurant, customer):
+    import json
+    from sqlalchemy import select
+    from app.models import MenuItem
+    from app.routers.menus import export_rows
+    rows = [(f"Export dish {i}", "with peanut sauce" if i % 2 else "plain rice", 5 + i) for i in range(7)]
+    _commit(client, restaurant, rows, "export.csv")
+    rid, tagged = _user_id(restaurant), _menu_allergens(restaurant)
+
+    r = client.get("/api/menus/export", params={"restaurantId": rid}, headers=customer)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("application/x-ndjson")
+    items = [json.loads(line) for line in r.text.splitlines()]
+    assert [i["item_name"] for i in items] == [n for n, _, _ in rows]
+    assert all(i["restaurant_id"] == rid and set(i["allergens"]) == tagged[i["item_name"]] for i in items)
+    peanut = client.get("/api/menus/export", params={"restaurantId": rid, "excludeAllergenIds": "1"}, headers=customer)
+    assert [json.loads(l)["item_name"] for l in peanut.text.splitlines()] == \
+        [i["item_name"] for i in items if "Peanuts" not in i["allergens"]]
+
+    # written batch by batch off the cursor
+    chunks = list(export_rows(select(MenuItem.id, MenuItem.restaurant_id, MenuItem.item_name, MenuItem.description,
+                                     MenuItem.price, MenuItem.allergen_mask)
+                              .where(MenuItem.restaurant_id == rid).order_by(MenuItem.id), batch=3))
+    assert [c.count(b"\n") for c in chunks] == [3, 3, 1]
+    assert b"".join(chunks).decode() == r.text
+
+    # links past the mask's range are read from menu_allergens, for the tags and the filter
+    from app.db import SessionLocal
+    from app.services.allergen_registry import ALLERGENS
+    with SessionLocal() as db:
+        db.execute(text("INSERT INTO allergens (id, name) VALUES (64, 'Lupin')"))
+        db.execute(text("INSERT INTO menu_allergens (menu_id, allergen_id) VALUES (:m, 64)"), {"m": items[0]["id"]})
+        db.commit()
+        ALLERGENS.refresh(db)
+    lupin = [json.loads(l) for l in client.get("/api/menus/export", params={"restaurantId": rid}, headers=customer).text.splitlines()]
+    assert lupin[0]["allergens"] == items[0]["allergens"] + ["Lupin"] and lupin[1:] == items[1:]
+    free = client.get("/api/menus/export", params={"restaurantId": rid, "excludeAllergenIds": "64"}, headers=customer)
+    assert [json.loads(l) for l in free.text.splitlines()] == items[1:]
+    with SessionLocal() as db:
+        db.execute(text("DELETE FROM menu_allergens WHERE allergen_id = 64"))
+        db.execute(text("DELETE FROM allergens WHERE id = 64")); db.commit()
+        ALLERGENS.refresh(db)
+
+def test_migrate_backfills_allergen_mask_on_upgrade(tmp_path):
+    from sqlalchemy import create_engine, select
+    from app.migrate import migrate
+    from app.models import MenuItem
+    from app.routers.menus import _exclude_allergens
+    from app.services import allergen_mask
+    engine = create_engine(f"sqlite:///{tmp_path}/baseline.db")
+    with engine.begin() as conn:  # the tables the menu filters read, as the baseline schema had them
+        for ddl in ("CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, email VARCHAR NOT NULL UNIQUE, "
+                    "password_hash VARCHAR NOT NULL, role VARCHAR NOT NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP)",
+                    "CREATE TABLE allergens (id INTEGER PRIMARY KEY, name VARCHAR NOT NULL UNIQUE)",
+                    "CREATE TABLE menu_items (id INTEGER PRIMARY KEY, restaurant_id INTEGER REFERENCES users (id), "
+                    "item_name VARCHAR NOT NULL, description TEXT, price NUMERIC(10, 2), "
+                    "created_at DATETIME DEFAULT CURRENT_TIMESTAMP)",
+                    "CREATE TABLE menu_allergens (menu_id INTEGER REFERENCES menu_items (id), "
+                    "allergen_id INTEGER REFERENCES allergens (id), PRIMARY KEY (menu_id, allergen_id))",
+                    "INSERT INTO users (id, name, email, password_hash, role) VALUES (1, 'r', 'r@x', '-', 'restaurant')",
+                    "INSERT INTO allergens (id, name) VALUES (1, 'Peanuts'), (3, 'Dairy')",
+                    "INSERT INTO menu_items (id, restaurant_id, item_name, price) VALUES (1, 1, 'Cheesecake', 7), "
+                    "(2, 1, 'Green Salad', 6)",
+                    "INSERT INTO menu_allergens (menu_id, allergen_id) VALUES (1, 3)"):
+            conn.execute(text(ddl))
+    assert migrate(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT allergen_mask FROM menu_items ORDER BY id")).scalars().all() == \
+            [allergen_mask.bit(3), 0]
+        assert conn.execute(_exclude_allergens(select(MenuItem.id), {3})).scalars().all() == [2]
+    engine.dispose()
+
+def test_cold_start_is_lazy_and_schema_setup_runs_once(tmp_path):
+    import json, os, subprocess, sys
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp_path}/cold.db")
+    probe = ("import json, sys, app.main; from app.migrate import migrate; "
+             "print(json.dumps([[m for m in ('pandas', 'numpy', 'rapidfuzz', 'pdfplumber') if m in sys.modules], "
+             "migrate(), migrate()]))")
+    out = subprocess.run([sys.executable, "-c", probe], env=env, capture_output=True, text=True, check=True,
+                         cwd=os.path.join(os.path.dirname(__file__), ".."))
+    heavy, first, second = json.loads(out.stdout.strip().splitlines()[-1])
+    assert heavy == []                     # ingestion deps and the tagger load on first use
+    assert (first, second) == (True, False)  # DDL once, then a fingerprint lookup
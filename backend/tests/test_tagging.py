@@ -0,0 +1,65 @@
+from conftest import load_corpus
+from app.services.tagging.matcher import Automaton, CompiledMatcher, compile_rules
+from app.services.tagging.scorer_rules import score_rules
+from app.services.tagging.rules import SynonymRewriter
+from app.services.tagging.pipeline import RULES, RULES_VER, expand_synonyms, tag_text, tag_texts
+
+def test_automaton_finds_overlapping_patterns():
+    ac = Automaton(["peanut", "peanut butter", "nut", "butter"])
+    assert ac.find("crunchy peanut butter") == {"peanut", "peanut butter", "nut", "butter"}
+    assert ac.find("plain rice") == set()
+
+def test_compiled_matcher_equivalent_to_score_rules():
+    m = CompiledMatcher(RULES, RULES_VER)
+    for name, desc in load_corpus():
+        for text in (f"{name} {desc}", expand_synonyms(f"{name} {desc}")):
+            assert m.score(text) == score_rules(text, RULES), text
+
+def test_compile_rules_is_cached_per_version():
+    assert compile_rules(RULES, RULES_VER) is compile_rules(RULES, RULES_VER)
+
+def test_score_many_matches_score():
+    m = CompiledMatcher(RULES, RULES_VER)
+    texts = [f"{name} {desc}" for name, desc in load_corpus()]
+    assert m.score_many(texts, chunk=7) == [m.score(t) for t in texts]
+
+def test_tag_texts_matches_tag_text():
+    rows = load_corpus()
+    assert tag_texts(rows) == [tag_text(name, desc) for name, desc in rows]
+    assert tag_texts([]) == []
+
+def test_synonym_rewriter_longest_match_single_pass():
+    rw = SynonymRewriter({"egg": ["mayo", "mayonnaise"], "cheese": ["cream cheese"], "fish sauce": ["nam pla"]})
+    assert rw("mayonnaise dip") == "egg dip"
+    assert rw("mayo, cream cheese and nam pla") == "egg, cheese and fish sauce"
+    assert rw("") == "" and rw(None) == ""
+    assert SynonymRewriter({})("mayo") == "mayo"
+
+def test_tag_cache_two_tiers_and_version_invalidation():
+    from app.db import SessionLocal
+    from app.services.tagging.cache import TagCache
+    c = TagCache(maxsize=2, use_db=True)
+    with SessionLocal() as db:
+        c.put_many(db, {"h1": {"Dairy": 0.5}, "h2": {"Eggs": 1.0}}, "r1", "s1")
+        assert c.get_many(db, ["h1", "h2", "h3"], "r1", "s1") == {"h1": {"Dairy": 0.5}, "h2": {"Eggs": 1.0}}
+        assert c.lru.hits == 2 and c.db_misses == 1
+
+        c.lru.clear()  # e.g. a fresh worker: falls through to the table
+        assert c.get_many(db, ["h1"], "r1", "s1") == {"h1": {"Dairy": 0.5}}
+        assert c.db_hits == 1
+
+        # a new rules version misses; rows of the old one stay for workers still on it until purged
+        assert c.get_many(db, ["h1"], "r2", "s1") == {}
+        c.lru.clear()
+        assert c.get_many(db, ["h1"], "r1", "s1") == {"h1": {"Dairy": 0.5}}
+        assert c.purge(db, "r2", "s1") >= 2
+        c.lru.clear()
+        assert c.get_many(db, ["h1"], "r1", "s1") == {}
+        db.rollback()
+
+def test_tag_text_uses_cache():
+    from app.services.tagging.cache import TAG_CACHE
+    tag_text("Tiramisu", "mascarpone, espresso")
+    hits = TAG_CACHE.lru.hits
+    assert tag_text("TIRAMISU!", "mascarpone,  espresso") == tag_text("Tiramisu", "mascarpone, espresso")
+    assert TAG_CACHE.lru.hits == hits + 2
@@ -33,7 +33,7 @@ export default function UploadPage() {
       const res = await fetch(url, { method:'POST', headers: { Authorization:`Bearer ${token}` }})
       const json = await res.json()
       if (!res.ok) throw new Error(json.detail || 'Commit failed')
-      alert(`Committed ${json.created} items`)
+      alert(`Committed: ${json.created} new, ${json.updated} updated, ${json.unchanged} unchanged`)
       setPreview([]); setIssues([]); setFile(null); setFileId(null)
     } catch (e) { alert(e.message) }
   }